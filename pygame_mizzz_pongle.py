@@ -1,11 +1,31 @@
-import pygame
 import os
 import sys
 import math
 import time
 import array
+import io
+import json
+import wave
+import mmap
+import struct
+import zlib
 import random
+import threading
+import re
 import traceback
+import subprocess
+import tracemalloc
+import importlib.util
+import concurrent.futures
+from collections import OrderedDict
+
+def get_flag_value(flag, default=None):
+    if flag not in sys.argv:
+        return None
+    value_index = sys.argv.index(flag) + 1
+    if value_index < len(sys.argv) and not sys.argv[value_index].startswith("-"):
+        return sys.argv[value_index]
+    return default
 
 DEBUG_LOG = False
 if "-debuglog" in sys.argv:
@@ -19,25 +39,185 @@ FUNDS_MODE = False
 if "-funds" in sys.argv:
     FUNDS_MODE = True
 
+BENCH_MODE = get_flag_value("-bench", "all")
+BENCH_SAVE_FILE = get_flag_value("-benchsave", "bench_baseline.json")
+BENCH_COMPARE_FILE = get_flag_value("-benchcompare", "bench_baseline.json")
+BENCH_THRESHOLD_ARG = get_flag_value("-benchthreshold")
+if BENCH_MODE is None and (BENCH_SAVE_FILE or BENCH_COMPARE_FILE):
+    BENCH_MODE = "all"
+
+FPS_ARG = get_flag_value("-fps")
+RENDER_SCALE_ARG = get_flag_value("-renderscale")
+
+DIRTY_RECTS_MODE = False
+if "-dirtyrects" in sys.argv:
+    DIRTY_RECTS_MODE = True
+
+SCORES_MODE = False
+if "-scores" in sys.argv:
+    SCORES_MODE = True
+
+BUILD_BUNDLE_MODE = False
+if "-buildbundle" in sys.argv:
+    BUILD_BUNDLE_MODE = True
+
+SERIAL_STARTUP_MODE = False
+if "-serialstartup" in sys.argv:
+    SERIAL_STARTUP_MODE = True
+
+SEED_ARG = get_flag_value("-seed")
+RECORD_FILE = get_flag_value("-record", "replay.bin")
+REPLAY_FILE = get_flag_value("-replay", "replay.bin")
+
+HEADLESS_MODE = False
+if "-headless" in sys.argv:
+    HEADLESS_MODE = True
+
+UNTHROTTLED_MODE = False
+if "-unthrottled" in sys.argv:
+    UNTHROTTLED_MODE = True
+
+FRAME_TIMES_MODE = False
+if "-frametimes" in sys.argv:
+    FRAME_TIMES_MODE = True
+FRAME_TIMES_FILE = get_flag_value("-frametimes", "frametimes.csv")
+
+CALIBRATE_FILE = get_flag_value("-calibrate", os.path.join("data", "level_table.json"))
+CALIBRATE_LEVELS_ARG = get_flag_value("-calibratelevels")
+CALIBRATE_SEEDS_ARG = get_flag_value("-calibrateseeds")
+CALIBRATE_SHOTS_ARG = get_flag_value("-calibrateshots")
+CALIBRATE_SIZE_ARG = get_flag_value("-calibratesize")
+
+MASK_COLLISION_MODE = False
+if "-maskcollision" in sys.argv:
+    MASK_COLLISION_MODE = True
+
+AIM_PREVIEW_MODE = False
+if "-aimpreview" in sys.argv:
+    AIM_PREVIEW_MODE = True
+
+PROFILE_MODE = False
+if "-profile" in sys.argv:
+    PROFILE_MODE = True
+PROFILE_JSON = get_flag_value("-profile")
+
 def debug_print(msg):
     if DEBUG_LOG:
         print(msg)
 
+class StartupPhase:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+    def __enter__(self):
+        self.profiler.stack.append(self.name)
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.mem = tracemalloc.get_traced_memory()[0]
+        return self
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.records.append({
+            "phase": "/".join(self.profiler.stack),
+            "wall_ms": (time.perf_counter() - self.wall) * 1000,
+            "cpu_ms": (time.process_time() - self.cpu) * 1000,
+            "mem_kib": (tracemalloc.get_traced_memory()[0] - self.mem) / 1024.0,
+        })
+        self.profiler.stack.pop()
+        return False
+
+class NullPhase:
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+class StartupProfiler:
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.records = []
+        self.stack = []
+        self.reported = False
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.started_tracing = enabled and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+    def phase(self, name):
+        if not self.enabled or self.reported:
+            return NullPhase()
+        return StartupPhase(self, name)
+    def summary(self):
+        current, peak = tracemalloc.get_traced_memory()
+        return {"total_wall_ms": (time.perf_counter() - self.start_wall) * 1000,
+                "total_cpu_ms": (time.process_time() - self.start_cpu) * 1000,
+                "traced_kib": current / 1024.0, "traced_peak_kib": peak / 1024.0,
+                "phases": sorted(self.records, key=lambda r: r["wall_ms"], reverse=True)}
+    def report(self, json_path=None):
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+        summary = self.summary()
+        print("Startup profile (sorted by wall time):")
+        print("  wall ms    cpu ms    mem KiB  phase")
+        for r in summary["phases"]:
+            print("  " + ("%8.1f" % r["wall_ms"]) + "  " + ("%8.1f" % r["cpu_ms"]) + "  " + ("%9.1f" % r["mem_kib"]) + "  " + r["phase"])
+        print("  total " + ("%.1f" % summary["total_wall_ms"]) + " ms wall, " + ("%.1f" % summary["total_cpu_ms"]) + " ms cpu, peak traced "
+              + ("%.1f" % summary["traced_peak_kib"]) + " KiB")
+        if json_path:
+            try:
+                with open(json_path, "w", encoding="utf-8") as f:
+                    json.dump(summary, f, indent=2)
+                print("Startup profile written to " + json_path)
+            except OSError as e:
+                print("Could not write startup profile: " + str(e))
+        # Tracing every allocation would slow the game itself down several times over.
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+STARTUP_PROFILE = StartupProfiler(PROFILE_MODE)
+
+with STARTUP_PROFILE.phase("import pygame"):
+    import pygame
+
+PITCH_SHIFT_AVAILABLE = importlib.util.find_spec("pydub") is not None
+if PITCH_SHIFT_AVAILABLE:
+    debug_print("pydub found. It is imported on first pitch-shift if ffmpeg is found.")
+else:
+    debug_print("pydub not available. Pitch-shift will not be used.")
+
 try:
-    from pydub import AudioSegment
-    PITCH_SHIFT_AVAILABLE = True
-    debug_print("pydub import successful. Attempting pitch-shift if ffmpeg is found.")
+    import sqlite3
+    SQLITE_AVAILABLE = True
 except ImportError:
-    PITCH_SHIFT_AVAILABLE = False
-    debug_print("pydub not available. Pitch-shift will not be used.")
+    SQLITE_AVAILABLE = False
+    debug_print("sqlite3 not available. Scores go to the plain text log.")
+
+with STARTUP_PROFILE.phase("import numpy"):
+    try:
+        import numpy
+        NUMPY_AVAILABLE = True
+    except ImportError:
+        NUMPY_AVAILABLE = False
+        debug_print("numpy not available. Hue shift will use the per-pixel fallback.")
 
 SCREEN_WIDTH = 0
 SCREEN_HEIGHT = 0
 FPS = 60
+if FPS_ARG:
+    FPS = int(FPS_ARG)
+PHYSICS_HZ = 60
+PHYSICS_DT = 1.0 / PHYSICS_HZ
+MAX_PHYSICS_STEPS_PER_FRAME = 8
+FLIPPER_ANGLE_UP = {"left": 45, "right": -45}
+FLIPPER_ANGLE_STEP = 1.0
 BALL_SPEED_MODIFIER = 0.8
 GRAVITY = 0.25
+# Approach speeds below two ticks of gravity settle onto a surface instead of bouncing.
+RESTING_CONTACT_SPEED = 2 * GRAVITY * BALL_SPEED_MODIFIER
 MAX_SHOTS = 12
 HOLES_COUNT = 5
+MASK_ROUND_TOLERANCE = 0.1
 if FUNDS_MODE:
     MAX_SHOTS = 999
 
@@ -45,48 +225,130 @@ BG_COLOR_CYCLE = 0
 COLOR_CYCLE_INTERVAL = 45
 COLOR_CYCLE_FADE_DURATION = 10
 HUE_SHIFT_STEP = 60
-COLOR_SHIFT_FPS = 2
+HUE_KEYFRAME_MAX_RESIDENT = 3
+HUE_CROSSFADE_LEVELS = 64
 
 FONT_NAME = None
 LOG_FILENAME = "score_log.txt"
+SCORE_DB_FILENAME = "scores.sqlite3"
+SCORE_TOP_N = 10
+SCORE_STORE = None
+LEGACY_SCORE_PATTERN = re.compile(r"Score: (-?\d+) - Time: (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})")
+SOUND_CACHE_FILENAME = "soundbank_cache.bin"
+SOUND_CACHE_VERSION = 1
+SOUND_PITCH_STEPS = 15
+ASSET_BUNDLE_FILENAME = "assets.bundle"
+ASSET_BUNDLE_MAGIC = b"PONGLEAB"
+ASSET_BUNDLE_VERSION = 1
+ASSET_BUNDLE_ALIGN = 16
+BUNDLE_IMAGE_NAMES = ["bumper.png", "ball.png", "hole.png", "corner.png", "panel_left.png", "panel_right.png"]
+BUNDLE_MASK_NAMES = ["bumper.png", "ball.png", "hole.png", "panel_left.png", "panel_right.png"]
+ASSET_BUNDLE = None
+STARTUP_IMAGE_NAMES = ["background.png", "bumper.png", "ball.png", "hole.png", "corner.png", "panel_left.png", "panel_right.png"]
+STARTUP_WORKERS = 0 if SERIAL_STARTUP_MODE else min(8, os.cpu_count() or 1)
+LOADING_FRAME_INTERVAL = 1.0 / 30
+REPLAY_MAGIC = b"PONGREPL"
+REPLAY_VERSION = 3
+REPLAY_HEADER = struct.Struct("<8sIQHHHB")
+REPLAY_RECORD = struct.Struct("<IBd")
+REPLAY_TRAILER = struct.Struct("<qIII")
+REPLAY_FIRE = 1
+REPLAY_FLIP_LEFT = 2
+REPLAY_FLIP_RIGHT = 3
+REPLAY_ORGON = 4
+REPLAY_REPULSINE = 5
+REPLAY_PAUSE = 6
+REPLAY_RESTART = 7
+REPLAY_END = 255
+BENCH_THRESHOLD = 25.0
+if BENCH_THRESHOLD_ARG:
+    BENCH_THRESHOLD = float(BENCH_THRESHOLD_ARG)
+FRAME_TIMER_SAMPLES = 600
+FRAME_HISTOGRAM_BUCKET_MS = 1
+FRAME_HISTOGRAM_BUCKETS = 100
+FRAME_DROP_FACTOR = 1.5
+FRAME_OVERLAY_INTERVAL = 0.5
+LEVEL_TABLE_FILENAME = "level_table.json"
+LEVEL_TABLE_VERSION = 1
+CALIBRATION_LEVELS = 10
+CALIBRATION_SEEDS = 16
+CALIBRATION_SHOTS = 1000
+CALIBRATION_SHOT_TICKS = 60 * PHYSICS_HZ
+CALIBRATION_FLIP_CHANCE = 1.0 / 30
+CALIBRATION_SHAPES = None
+AIM_PREVIEW_STEPS = 300
+AIM_PREVIEW_BOUNCES = 4
+AIM_PREVIEW_STEPS_PER_FRAME = 50
+AIM_PREVIEW_BUDGET_MS = 1.0
 MUSIC_FILES = []
-MUSIC_INDEX = 0
+MUSIC_END_EVENT = pygame.USEREVENT + 1
+SOUND_POOLS = {"button": (4, 1), "bumper": (3, 4), "panel": (2, 2), "border": (1, 2)}
+SOUND_RETRIGGER_LIMIT = 1
 
 IS_PAUSED = False
 SHOW_OPTIONS = False
 BRIGHTNESS = 0.6
 MUSIC_VOLUME = 1.0
 
-BG_IMAGES = []
+BG_STORE = None
 BG_INDEX = 0
+BG_CACHE_MAX_IMAGES = 3
+BG_CACHE_MAX_BYTES = 0
+
+DATA_README_LINES = [
+    "Possible files and what they are used for:",
+    "- background.png",
+    "- backgroundSomething.png",
+    "- bumper.png",
+    "- hole.png",
+    "- corner.png",
+    "- ball.png",
+    "- bumper.wav",
+    "- border.wav",
+    "- panel.wav",
+    "- button.wav",
+    "- panel_left.png / panel_right.png",
+    "- orgon.png",
+    "- repulsine.png",
+    "- Any .mp3 file",
+    "Game principle:",
+    "Pinball-like game.",
+    "Command line parameters:",
+    "-debuglog",
+    "-nospoon",
+    "-funds",
+    "-bench [name] (-benchsave [file], -benchcompare [file], -benchthreshold [percent])",
+    "-fps [rate]",
+    "-renderscale [factor|WxH]",
+    "-dirtyrects",
+    "-buildbundle",
+    "-profile [file.json]",
+    "-frametimes [file.csv|file.json] (F3 toggles the timing overlay)",
+    "-seed [number]",
+    "-record [file]",
+    "-replay [file] (-headless, -unthrottled)",
+    "-scores",
+    "-aimpreview (F4 toggles the shot preview)",
+    "-maskcollision",
+    "-calibrate [file] (-calibratelevels, -calibrateseeds, -calibrateshots, -calibratesize WxH)",
+    "- level_table.json (curated bumper layouts per level, written by -calibrate)",
+    "-serialstartup",
+]
 
 def ensure_data_folder():
     data_dir = os.path.join(os.getcwd(), "data")
     if not os.path.exists(data_dir):
         os.makedirs(data_dir, exist_ok=True)
     readme_path = os.path.join(data_dir, "readme.txt")
+    content = "\n".join(DATA_README_LINES) + "\n"
+    try:
+        with open(readme_path, "r", encoding="utf-8") as f:
+            if f.read() == content:
+                return
+    except OSError:
+        pass
     with open(readme_path, "w", encoding="utf-8") as f:
-        f.write("Possible files and what they are used for:\n")
-        f.write("- background.png\n")
-        f.write("- backgroundSomething.png\n")
-        f.write("- bumper.png\n")
-        f.write("- hole.png\n")
-        f.write("- corner.png\n")
-        f.write("- ball.png\n")
-        f.write("- bumper.wav\n")
-        f.write("- border.wav\n")
-        f.write("- panel.wav\n")
-        f.write("- button.wav\n")
-        f.write("- panel_left.png / panel_right.png\n")
-        f.write("- orgon.png\n")
-        f.write("- repulsine.png\n")
-        f.write("- Any .mp3 file\n")
-        f.write("Game principle:\n")
-        f.write("Pinball-like game.\n")
-        f.write("Command line parameters:\n")
-        f.write("-debuglog\n")
-        f.write("-nospoon\n")
-        f.write("-funds\n")
+        f.write(content)
 
 def load_music_files_from_data():
     data_dir = os.path.join(os.getcwd(), "data")
@@ -100,48 +362,314 @@ def load_music_files_from_data():
     MUSIC_FILES.sort()
     debug_print("Music files found: " + str(MUSIC_FILES))
 
-def load_all_background_images():
+def index_background_images():
     data_dir = os.path.join(os.getcwd(), "data")
     found_files = []
     for file in os.listdir(data_dir):
         if file.lower().startswith("background") and file.lower().endswith(".png"):
             found_files.append(file)
     found_files.sort()
-    for fn in found_files:
-        path = os.path.join(data_dir, fn)
+    debug_print("Indexed " + str(len(found_files)) + " multi-backgrounds.")
+    return [os.path.join(data_dir, fn) for fn in found_files]
+
+class BackgroundStore:
+    def __init__(self, paths, max_images=BG_CACHE_MAX_IMAGES, max_bytes=BG_CACHE_MAX_BYTES):
+        self.paths = list(paths)
+        self.max_images = max_images
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.resident_bytes = 0
+    def __len__(self):
+        return len(self.paths)
+    def _decode(self, index):
+        path = self.paths[index]
         try:
-            img = pygame.image.load(path).convert_alpha()
-            BG_IMAGES.append(img)
-            debug_print("Loaded multi-background: " + fn)
+            if ASSET_BUNDLE is not None and ASSET_BUNDLE.has(os.path.basename(path)):
+                return ASSET_BUNDLE.image(os.path.basename(path))
+            img = pygame.image.load(path)
+            debug_print("Decoded multi-background: " + os.path.basename(path))
+            return img
         except Exception as e:
-            debug_print("Error loading multi-background " + fn + ": " + str(e))
+            debug_print("Error loading multi-background " + os.path.basename(path) + ": " + str(e))
+            return None
+    def _insert(self, index, img):
+        size = img.get_pitch() * img.get_height()
+        self.cache[index] = (img, size)
+        self.resident_bytes += size
+        while len(self.cache) > 1 and (len(self.cache) > self.max_images or (self.max_bytes and self.resident_bytes > self.max_bytes)):
+            old_index, (old_img, old_size) = self.cache.popitem(last=False)
+            self.resident_bytes -= old_size
+            self.evictions += 1
+            debug_print("Evicted multi-background " + os.path.basename(self.paths[old_index]))
+    def _prefetch_worker(self, index, done):
+        img = self._decode(index)
+        with self.lock:
+            if img is not None and index not in self.cache:
+                self._insert(index, img)
+            del self.pending[index]
+        done.set()
+    def prefetch(self, index):
+        if not self.paths:
+            return
+        index = index % len(self.paths)
+        with self.lock:
+            if index in self.cache or index in self.pending:
+                return
+            done = threading.Event()
+            self.pending[index] = done
+        threading.Thread(target=self._prefetch_worker, args=(index, done), daemon=True).start()
+    def get(self, index):
+        if not self.paths:
+            return None
+        index = index % len(self.paths)
+        with self.lock:
+            done = self.pending.get(index)
+        if done is not None:
+            done.wait()
+        with self.lock:
+            if index in self.cache:
+                self.cache.move_to_end(index)
+                self.hits += 1
+                return self.cache[index][0]
+            self.misses += 1
+        img = self._decode(index)
+        if img is None:
+            return None
+        with self.lock:
+            if index not in self.cache:
+                self._insert(index, img)
+            else:
+                img = self.cache[index][0]
+        return img
+    def stats_line(self):
+        return ("Background store: hits=" + str(self.hits) + " misses=" + str(self.misses) + " evictions=" + str(self.evictions)
+                + " resident=" + str(len(self.cache)) + " images / " + str(self.resident_bytes // 1024) + " KiB")
 
-def play_next_song():
-    global MUSIC_INDEX
-    if not MUSIC_FILES:
-        debug_print("No music files present. Skipping play_next_song().")
-        return
-    try:
-        pygame.mixer.music.stop()
-        pygame.mixer.music.unload()
-        pygame.mixer.music.load(MUSIC_FILES[MUSIC_INDEX])
-        pygame.mixer.music.set_volume(MUSIC_VOLUME)
-        pygame.mixer.music.play()
-        debug_print("Playing music: " + MUSIC_FILES[MUSIC_INDEX])
-        MUSIC_INDEX = (MUSIC_INDEX + 1) % len(MUSIC_FILES)
-    except Exception as e:
-        debug_print("Error loading/playing MP3: " + str(e))
+class SoundScheduler:
+    def __init__(self, pools=SOUND_POOLS, retrigger_limit=SOUND_RETRIGGER_LIMIT):
+        self.pool_config = pools
+        self.retrigger_limit = retrigger_limit
+        self.pools = {}
+        self.voices = {}
+        self.triggers = {}
+        self.serial = 0
+        self.counters = {category: {"played": 0, "stolen": 0, "dropped": 0, "limited": 0} for category in pools}
+        self.playlist = []
+        self.music_index = 0
+        self.music_playing = False
+        self.music_queued = False
+        self.music_loader = None
+        self.next_track = None
+    def setup(self):
+        if not pygame.mixer.get_init():
+            return
+        total = sum(count for priority, count in self.pool_config.values())
+        pygame.mixer.set_num_channels(max(total, pygame.mixer.get_num_channels()))
+        pygame.mixer.set_reserved(total)
+        index = 0
+        for category, (priority, count) in sorted(self.pool_config.items(), key=lambda item: -item[1][0]):
+            self.pools[category] = [pygame.mixer.Channel(i) for i in range(index, index + count)]
+            index += count
+        self.voices = {}
+    def _channel_for(self, category):
+        priority = self.pool_config[category][0]
+        for channel in self.pools[category]:
+            if not channel.get_busy():
+                return channel, None
+        # Borrow an idle channel from a lower-priority pool before cutting anyone off.
+        lower = [c for c in self.pools if self.pool_config[c][0] < priority]
+        for other in lower:
+            for channel in self.pools[other]:
+                if not channel.get_busy():
+                    return channel, None
+        victim = None
+        for other in [category] + lower:
+            for channel in self.pools[other]:
+                voice = self.voices.get(channel)
+                if voice is None:
+                    continue
+                rank = (self.pool_config[voice[1]][0], voice[0])
+                if rank[0] <= priority and (victim is None or rank < victim[0]):
+                    victim = (rank, channel, voice[1])
+        if victim is None:
+            return None, None
+        return victim[1], victim[2]
+    def play(self, category, sound):
+        if sound is None or category not in self.pools:
+            return None
+        counters = self.counters[category]
+        if self.triggers.get(sound, 0) >= self.retrigger_limit:
+            counters["limited"] += 1
+            return None
+        self.triggers[sound] = self.triggers.get(sound, 0) + 1
+        channel, stolen_from = self._channel_for(category)
+        if channel is None:
+            counters["dropped"] += 1
+            return None
+        if stolen_from is not None:
+            self.counters[stolen_from]["stolen"] += 1
+        channel.play(sound)
+        self.serial += 1
+        self.voices[channel] = (self.serial, category)
+        counters["played"] += 1
+        return channel
+    def start_music(self, files):
+        self.playlist = list(files)
+        if not self.playlist or not pygame.mixer.get_init():
+            debug_print("No music files present. Skipping music.")
+            return
+        pygame.mixer.music.set_endevent(MUSIC_END_EVENT)
+        self.music_loader = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._prefetch_next()
+    def _read_track(self, path):
+        with open(path, "rb") as f:
+            return io.BytesIO(f.read())
+    def _prefetch_next(self):
+        path = self.playlist[self.music_index]
+        self.music_index = (self.music_index + 1) % len(self.playlist)
+        self.next_track = (path, self.music_loader.submit(self._read_track, path))
+    def on_music_end(self):
+        # SDL_mixer has already switched to the queued track, if there was one.
+        self.music_playing = self.music_queued
+        self.music_queued = False
+        if self.next_track is None and self.playlist:
+            self._prefetch_next()
+    def update(self):
+        self.triggers.clear()
+        if self.next_track is None or not self.next_track[1].done():
+            return
+        path, future = self.next_track
+        self.next_track = None
+        try:
+            data = future.result()
+            if self.music_playing:
+                pygame.mixer.music.queue(data, os.path.basename(path))
+                self.music_queued = True
+                debug_print("Queued music: " + path)
+            else:
+                pygame.mixer.music.load(data, os.path.basename(path))
+                pygame.mixer.music.set_volume(MUSIC_VOLUME)
+                pygame.mixer.music.play()
+                self.music_playing = True
+                debug_print("Playing music: " + path)
+                self._prefetch_next()
+        except Exception as e:
+            debug_print("Error loading/playing MP3 " + path + ": " + str(e))
+            if len(self.playlist) > 1:
+                self._prefetch_next()
+    def stop(self):
+        if self.music_loader is not None:
+            self.music_loader.shutdown(wait=False)
+            self.music_loader = None
+    def overlay_rows(self):
+        rows = [["audio", "played", "stolen", "dropped"]]
+        for category in sorted(self.counters, key=lambda c: -self.pool_config[c][0]):
+            c = self.counters[category]
+            rows.append([category, str(c["played"]), str(c["stolen"]), str(c["dropped"] + c["limited"])])
+        return rows
+    def stats_line(self):
+        return "Audio: " + ", ".join(category + " played=" + str(c["played"]) + " stolen=" + str(c["stolen"]) + " dropped=" + str(c["dropped"])
+                                     + " limited=" + str(c["limited"]) for category, c in self.counters.items())
 
-def check_and_play_music():
-    if not MUSIC_FILES:
-        return
-    if not pygame.mixer.music.get_busy():
-        play_next_song()
+AUDIO = SoundScheduler()
+
+class ScoreStore:
+    def __init__(self, path=SCORE_DB_FILENAME, top_n=SCORE_TOP_N):
+        self.top_n = top_n
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS scores (id INTEGER PRIMARY KEY, score INTEGER NOT NULL, played_at TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS top_scores (score_id INTEGER PRIMARY KEY, score INTEGER NOT NULL, played_at TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS daily (day TEXT PRIMARY KEY, games INTEGER NOT NULL, total INTEGER NOT NULL, best INTEGER NOT NULL, worst INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);")
+    def _insert(self, score, played_at):
+        score_id = self.db.execute("INSERT INTO scores (score, played_at) VALUES (?, ?)", (score, played_at)).lastrowid
+        self.db.execute("INSERT INTO daily (day, games, total, best, worst) VALUES (?, 1, ?, ?, ?) "
+                        "ON CONFLICT(day) DO UPDATE SET games = games + 1, total = total + excluded.total, "
+                        "best = max(best, excluded.best), worst = min(worst, excluded.worst)",
+                        (played_at[:10], score, score, score))
+        self.db.execute("INSERT INTO top_scores (score_id, score, played_at) VALUES (?, ?, ?)", (score_id, score, played_at))
+        self.db.execute("DELETE FROM top_scores WHERE score_id NOT IN "
+                        "(SELECT score_id FROM top_scores ORDER BY score DESC, score_id LIMIT ?)", (self.top_n,))
+        return score_id
+    def add(self, score, played_at=None):
+        if played_at is None:
+            played_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self.db:
+            return self._insert(score, played_at)
+    def top(self):
+        return self.db.execute("SELECT score_id, score, played_at FROM top_scores ORDER BY score DESC, score_id").fetchall()
+    def daily(self, days=14):
+        return self.db.execute("SELECT day, games, total, best, worst FROM daily ORDER BY day DESC LIMIT ?", (days,)).fetchall()
+    def games(self):
+        return self.db.execute("SELECT count(*) FROM scores").fetchone()[0]
+    def rebuild_aggregates(self):
+        self.db.execute("DELETE FROM daily")
+        self.db.execute("INSERT INTO daily (day, games, total, best, worst) "
+                        "SELECT substr(played_at, 1, 10), count(*), sum(score), max(score), min(score) FROM scores GROUP BY 1")
+        self.db.execute("DELETE FROM top_scores")
+        self.db.execute("INSERT INTO top_scores (score_id, score, played_at) "
+                        "SELECT id, score, played_at FROM scores ORDER BY score DESC, id LIMIT ?", (self.top_n,))
+    def import_legacy(self, path):
+        if self.db.execute("SELECT value FROM meta WHERE key = 'legacy_import'").fetchone() or not os.path.exists(path):
+            return 0
+        rows = []
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                match = LEGACY_SCORE_PATTERN.search(line)
+                if match:
+                    rows.append((int(match.group(1)), match.group(2)))
+        imported = len(rows)
+        with self.db:
+            self.db.executemany("INSERT INTO scores (score, played_at) VALUES (?, ?)", rows)
+            self.rebuild_aggregates()
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('legacy_import', ?)", (str(imported) + " lines from " + path,))
+        debug_print("Imported " + str(imported) + " legacy scores from " + path)
+        return imported
+    def close(self):
+        self.db.close()
+
+def open_score_store():
+    if not SQLITE_AVAILABLE:
+        return None
+    try:
+        store = ScoreStore()
+        store.import_legacy(LOG_FILENAME)
+        return store
+    except (sqlite3.Error, OSError) as e:
+        debug_print("Score store unavailable: " + str(e))
+        return None
 
 def log_score(score):
+    if SCORE_STORE is not None:
+        try:
+            score_id = SCORE_STORE.add(score)
+            debug_print("Score " + str(score) + " written to score store.")
+            return score_id
+        except sqlite3.Error as e:
+            debug_print("Score store write failed: " + str(e))
     with open(LOG_FILENAME, "a", encoding="utf-8") as f:
         f.write("Score: " + str(score) + " - Time: " + time.strftime("%Y-%m-%d %H:%M:%S") + "\n")
     debug_print("Score " + str(score) + " written to log.")
+    return None
+
+def print_score_store():
+    store = open_score_store()
+    if store is None:
+        print("Score store unavailable.")
+        return
+    print("Top " + str(store.top_n) + " of " + str(store.games()) + " games:")
+    for rank, (score_id, score, played_at) in enumerate(store.top(), 1):
+        print(str(rank).rjust(3) + ". " + str(score).rjust(8) + "  " + played_at)
+    print("Per day (games, average, best, worst):")
+    for day, games, total, best, worst in store.daily():
+        print(day + "  " + str(games).rjust(6) + "  " + str(round(total / float(games), 1)).rjust(8) + "  " + str(best).rjust(6) + "  " + str(worst).rjust(6))
+    store.close()
 
 def get_alpha_mask_circle(radius, color=(255, 0, 0)):
     surf = pygame.Surface((radius*2, radius*2), pygame.SRCALPHA)
@@ -149,12 +677,103 @@ def get_alpha_mask_circle(radius, color=(255, 0, 0)):
     mask = pygame.mask.from_surface(surf)
     return surf, mask
 
+def load_display_image(image_path):
+    name = os.path.basename(image_path)
+    if ASSET_BUNDLE is not None and ASSET_BUNDLE.has(name):
+        return ASSET_BUNDLE.image(name)
+    return pygame.image.load(image_path).convert_alpha()
+
+def load_image_mask(name, surf):
+    if ASSET_BUNDLE is not None and ASSET_BUNDLE.has(name + "#mask"):
+        return ASSET_BUNDLE.mask(name)
+    return pygame.mask.from_surface(surf)
+
 def load_image_with_mask(image_path):
-    surf = pygame.image.load(image_path).convert_alpha()
-    mask = pygame.mask.from_surface(surf)
+    surf = load_display_image(image_path)
+    mask = load_image_mask(os.path.basename(image_path), surf)
     rect = surf.get_rect()
     return surf, mask, rect
 
+def decode_asset_image(path, with_mask=True):
+    name = os.path.basename(path)
+    if not os.path.exists(path) or (ASSET_BUNDLE is not None and ASSET_BUNDLE.has(name)):
+        return None
+    surf = pygame.image.load(path)
+    mask = pygame.mask.from_surface(surf) if with_mask else None
+    return surf, mask
+
+def finish_asset_image(pipeline, path):
+    decoded = pipeline.result(os.path.basename(path))
+    if decoded is None:
+        return load_image_with_mask(path)[:2]
+    surf, mask = decoded
+    return surf.convert_alpha(), mask
+
+class StartupPipeline:
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers) if workers else None
+        self.futures = OrderedDict()
+        self.job_ms = {}
+        self.start = time.perf_counter()
+        self.reported = False
+    def _run(self, name, fn, args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.job_ms[name] = (time.perf_counter() - start) * 1000
+    def submit(self, name, fn, *args):
+        if self.executor is not None:
+            self.futures[name] = self.executor.submit(self._run, name, fn, args)
+            return
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(self._run(name, fn, args))
+        except Exception as e:
+            future.set_exception(e)
+        self.futures[name] = future
+    def wait(self, progress=None):
+        pending = list(self.futures.values())
+        while True:
+            done, pending = concurrent.futures.wait(pending, timeout=LOADING_FRAME_INTERVAL)
+            if progress:
+                progress(len(self.futures) - len(pending), len(self.futures))
+            if not pending:
+                break
+        if self.executor is not None:
+            self.executor.shutdown()
+    def result(self, name):
+        return self.futures[name].result()
+    def report(self):
+        if self.reported:
+            return
+        self.reported = True
+        wall_ms = (time.perf_counter() - self.start) * 1000
+        serial_ms = sum(self.job_ms.values())
+        lines = ["Startup pipeline: " + str(len(self.futures)) + " jobs on " + (str(self.workers) + " worker threads" if self.workers else "the main thread")
+                 + ", assets ready after " + ("%.1f" % wall_ms) + " ms, jobs take " + ("%.1f" % serial_ms) + " ms back to back"
+                 + ", startup " + ("%.1f" % ((time.perf_counter() - STARTUP_PROFILE.start_wall) * 1000)) + " ms"]
+        for name, ms in sorted(self.job_ms.items(), key=lambda item: item[1], reverse=True):
+            lines.append("  " + ("%8.1f" % ms) + " ms  " + name)
+        for line in lines:
+            if PROFILE_MODE:
+                print(line)
+            else:
+                debug_print(line)
+
+def draw_loading_screen(target, font, done, total):
+    pygame.event.pump()
+    screen = target.canvas
+    screen.fill((0,0,0))
+    w, h = screen.get_size()
+    bar = pygame.Rect(w//2 - 150, h//2, 300, 20)
+    pygame.draw.rect(screen, (200,200,200), bar, width=2)
+    pygame.draw.rect(screen, (0,255,0), (bar.x, bar.y, bar.width * done // max(1, total), bar.height))
+    label = TEXT_CACHE.render(font, "Loading " + str(done) + "/" + str(total), (255,255,255))
+    screen.blit(label, (w//2 - label.get_width()//2, bar.y - label.get_height() - 10))
+    target.present()
+
 def create_sine_wave(frequency, length_ms=200, volume=0.3):
     sample_rate = 44100
     n_samples = int(sample_rate * (length_ms / 1000.0))
@@ -170,7 +789,8 @@ def pitch_shift_wav(wav_path, semitone):
         debug_print("Pitch shift not available (pydub or ffmpeg missing).")
         return None
     try:
-        from pydub import AudioSegment
+        with STARTUP_PROFILE.phase("import pydub"):
+            from pydub import AudioSegment
         original = AudioSegment.from_file(wav_path)
         new_frame_rate = int(original.frame_rate * (2.0 ** (semitone / 12.0)))
         shifted = original._spawn(original.raw_data, overrides={"frame_rate": new_frame_rate})
@@ -181,6 +801,279 @@ def pitch_shift_wav(wav_path, semitone):
         debug_print("Pitch-shift failed: " + str(e))
         return None
 
+def decode_wav_samples(wav_path):
+    with wave.open(wav_path, "rb") as w:
+        channels = w.getnchannels()
+        width = w.getsampwidth()
+        rate = w.getframerate()
+        frames = w.readframes(w.getnframes())
+    if width == 1:
+        samples = (numpy.frombuffer(frames, dtype=numpy.uint8).astype(numpy.float32) - 128.0) / 128.0
+    elif width == 2:
+        samples = numpy.frombuffer(frames, dtype="<i2").astype(numpy.float32) / 32768.0
+    elif width == 4:
+        samples = numpy.frombuffer(frames, dtype="<i4").astype(numpy.float32) / 2147483648.0
+    else:
+        raise ValueError("unsupported sample width " + str(width))
+    return samples.reshape(-1, channels).mean(axis=1), rate
+
+def resample_samples(samples, src_rate, dst_rate):
+    n_out = int(len(samples) * float(dst_rate) / src_rate)
+    positions = numpy.arange(n_out, dtype=numpy.float64) * (float(src_rate) / dst_rate)
+    return numpy.interp(positions, numpy.arange(len(samples)), samples)
+
+def samples_to_pcm(samples, mixer_format):
+    pcm = (numpy.clip(samples, -1.0, 1.0) * 32767).astype(numpy.int16)
+    channels = mixer_format[2]
+    if channels > 1:
+        pcm = numpy.repeat(pcm[:, None], channels, axis=1)
+    return pcm.tobytes()
+
+def synthesize_tones(frequencies, length_ms, volume, mixer_format):
+    sample_rate = mixer_format[0]
+    n_samples = int(sample_rate * (length_ms / 1000.0))
+    t = numpy.arange(n_samples, dtype=numpy.float64) / sample_rate
+    waves = volume * numpy.sin(2.0 * numpy.pi * numpy.asarray(frequencies, dtype=numpy.float64)[:, None] * t[None, :])
+    return [samples_to_pcm(row, mixer_format) for row in waves]
+
+def sound_bank_key(data_dir, pitch_steps, mixer_format):
+    bumper_wav = os.path.join(data_dir, "bumper.wav")
+    source = None
+    if os.path.exists(bumper_wav):
+        st = os.stat(bumper_wav)
+        source = [st.st_mtime_ns, st.st_size]
+    return {"version": SOUND_CACHE_VERSION, "mixer": list(mixer_format), "pitch_steps": pitch_steps, "bumper_wav": source}
+
+def synthesize_sound_bank(data_dir, pitch_steps, mixer_format):
+    bank = {"bounce": []}
+    bumper_wav = os.path.join(data_dir, "bumper.wav")
+    if os.path.exists(bumper_wav):
+        try:
+            samples, rate = decode_wav_samples(bumper_wav)
+            for i in range(pitch_steps):
+                shifted_rate = int(rate * (2.0 ** ((i*0.35) / 12.0)))
+                bank["bounce"].append(samples_to_pcm(resample_samples(samples, shifted_rate, mixer_format[0]), mixer_format))
+            debug_print("Pitch-shifted bumper.wav in memory (" + str(pitch_steps) + " steps).")
+        except Exception as e:
+            debug_print("In-memory pitch shift of bumper.wav failed: " + str(e))
+    else:
+        bank["bounce"] = synthesize_tones([220*(1.04**i) for i in range(pitch_steps)], 200, 0.3, mixer_format)
+    bank["border"] = synthesize_tones([80], 150, 0.4, mixer_format)
+    bank["panel"] = synthesize_tones([100], 200, 0.4, mixer_format)
+    return bank
+
+def load_sound_bank_cache(key):
+    try:
+        with open(SOUND_CACHE_FILENAME, "rb") as f:
+            header = json.loads(f.readline().decode("utf-8"))
+            if header.get("key") != key:
+                debug_print("Sound bank cache is stale.")
+                return None
+            payload = f.read()
+    except (OSError, ValueError) as e:
+        debug_print("No usable sound bank cache: " + str(e))
+        return None
+    bank = {}
+    for name, offset, length in header["entries"]:
+        bank.setdefault(name, []).append(payload[offset:offset+length])
+    bank.setdefault("bounce", [])
+    return bank
+
+def save_sound_bank_cache(key, bank):
+    entries = []
+    chunks = []
+    offset = 0
+    for name in sorted(bank.keys()):
+        for pcm in bank[name]:
+            entries.append([name, offset, len(pcm)])
+            chunks.append(pcm)
+            offset += len(pcm)
+    try:
+        with open(SOUND_CACHE_FILENAME, "wb") as f:
+            f.write((json.dumps({"key": key, "entries": entries}) + "\n").encode("utf-8"))
+            for pcm in chunks:
+                f.write(pcm)
+        debug_print("Sound bank cache written to " + SOUND_CACHE_FILENAME)
+    except OSError as e:
+        debug_print("Could not write sound bank cache: " + str(e))
+
+def build_sound_bank(data_dir, pitch_steps):
+    mixer_format = pygame.mixer.get_init()
+    if ASSET_BUNDLE is not None:
+        bank = ASSET_BUNDLE.sound_bank(mixer_format, pitch_steps)
+        if bank is not None:
+            debug_print("Sound bank loaded from asset bundle.")
+            return bank
+    if not NUMPY_AVAILABLE or mixer_format is None or abs(mixer_format[1]) != 16:
+        debug_print("Sound bank builder unavailable => per-sound fallback.")
+        return None
+    key = sound_bank_key(data_dir, pitch_steps, mixer_format)
+    bank = load_sound_bank_cache(key)
+    if bank is not None:
+        debug_print("Sound bank loaded from cache.")
+        return bank
+    bank = synthesize_sound_bank(data_dir, pitch_steps, mixer_format)
+    save_sound_bank_cache(key, bank)
+    return bank
+
+def fallback_tone(sound_bank, name, frequency, length_ms, volume):
+    if sound_bank is not None and sound_bank.get(name):
+        return pygame.mixer.Sound(buffer=sound_bank[name][0])
+    return create_sine_wave(frequency, length_ms, volume)
+
+def display_pixel_format():
+    probe = pygame.Surface((1,1), pygame.SRCALPHA).convert_alpha()
+    if probe.get_bitsize() == 32 and probe.get_masks() == (0xff0000, 0xff00, 0xff, 0xff000000):
+        return "BGRA" if sys.byteorder == "little" else "ARGB"
+    return "RGBA"
+
+def mask_plane_bytes(mask):
+    plane = mask.to_surface(setcolor=(1,1,1,255), unsetcolor=(0,0,0,255))
+    return pygame.image.tobytes(plane, "RGB")[::3]
+
+def asset_bundle_data_start(header_len):
+    data_start = 16 + header_len
+    return data_start + (-data_start) % ASSET_BUNDLE_ALIGN
+
+def asset_bundle_sources(data_dir):
+    names = [name for name in BUNDLE_IMAGE_NAMES + ["bumper.wav"] if os.path.exists(os.path.join(data_dir, name))]
+    names += [os.path.basename(path) for path in index_background_images()]
+    sources = []
+    for name in sorted(set(names)):
+        st = os.stat(os.path.join(data_dir, name))
+        sources.append([name, st.st_mtime_ns, st.st_size])
+    return sources
+
+class AssetBundle:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = None
+        self.view = None
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_COPY)
+            if self.map[:8] != ASSET_BUNDLE_MAGIC:
+                raise ValueError("not an asset bundle")
+            header_len = struct.unpack("<Q", self.map[8:16])[0]
+            self.header = json.loads(self.map[16:16+header_len].decode("utf-8"))
+        except Exception:
+            self.close()
+            raise
+        self.data_start = asset_bundle_data_start(header_len)
+        self.view = memoryview(self.map)
+        self.entries = {}
+        for entry in self.header["entries"]:
+            self.entries[entry["name"]] = entry
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+    def has(self, name):
+        return name in self.entries
+    def _slice(self, entry):
+        start = self.data_start + entry["offset"]
+        return self.view[start:start+entry["length"]]
+    def image(self, name):
+        entry = self.entries[name]
+        return pygame.image.frombuffer(self._slice(entry), tuple(entry["size"]), self.header["pixel_format"])
+    def mask(self, name):
+        entry = self.entries[name + "#mask"]
+        plane = pygame.image.frombuffer(self._slice(entry), tuple(entry["size"]), "P")
+        plane.set_colorkey(0)
+        return pygame.mask.from_surface(plane)
+    def sound_bank(self, mixer_format, pitch_steps):
+        if mixer_format is None or self.header["mixer"] != list(mixer_format) or self.header["pitch_steps"] != pitch_steps:
+            return None
+        bank = {"bounce": []}
+        for entry in self.header["entries"]:
+            if entry["kind"] == "pcm":
+                bank.setdefault(entry["group"], []).append(self._slice(entry))
+        return bank
+
+def open_asset_bundle(data_dir):
+    path = os.path.join(data_dir, ASSET_BUNDLE_FILENAME)
+    if not os.path.exists(path):
+        debug_print("No asset bundle found. Loading loose files.")
+        return None
+    try:
+        bundle = AssetBundle(path)
+    except Exception as e:
+        debug_print("Could not open asset bundle: " + str(e))
+        return None
+    if bundle.header.get("version") != ASSET_BUNDLE_VERSION:
+        debug_print("Asset bundle version mismatch => loose files.")
+        bundle.close()
+        return None
+    if bundle.header.get("sources") != asset_bundle_sources(data_dir):
+        debug_print("Asset bundle is stale compared with data folder => loose files.")
+        bundle.close()
+        return None
+    if bundle.header.get("pixel_format") != display_pixel_format():
+        debug_print("Asset bundle pixel format differs from display => loose files.")
+        bundle.close()
+        return None
+    debug_print("Mapped asset bundle with " + str(len(bundle.entries)) + " entries.")
+    return bundle
+
+def build_asset_bundle(data_dir):
+    pixel_format = display_pixel_format()
+    entries = []
+    chunks = []
+    offset = 0
+    def add(name, kind, payload, size=None, group=None):
+        nonlocal offset
+        entry = {"name": name, "kind": kind, "offset": offset, "length": len(payload)}
+        if size is not None:
+            entry["size"] = list(size)
+        if group is not None:
+            entry["group"] = group
+        entries.append(entry)
+        padding = (-len(payload)) % ASSET_BUNDLE_ALIGN
+        chunks.append(payload + b"\0" * padding)
+        offset += len(payload) + padding
+    image_names = [name for name in BUNDLE_IMAGE_NAMES if os.path.exists(os.path.join(data_dir, name))]
+    image_names += [os.path.basename(path) for path in index_background_images() if os.path.basename(path) not in image_names]
+    for name in image_names:
+        surf = pygame.image.load(os.path.join(data_dir, name)).convert_alpha()
+        add(name, "image", pygame.image.tobytes(surf, pixel_format), surf.get_size())
+        if name in BUNDLE_MASK_NAMES:
+            add(name + "#mask", "mask", mask_plane_bytes(pygame.mask.from_surface(surf)), surf.get_size())
+    mixer_format = pygame.mixer.get_init()
+    if NUMPY_AVAILABLE and mixer_format is not None and abs(mixer_format[1]) == 16:
+        bank = synthesize_sound_bank(data_dir, SOUND_PITCH_STEPS, mixer_format)
+        for group in sorted(bank.keys()):
+            for i, pcm in enumerate(bank[group]):
+                add("sound:" + group + ":" + str(i), "pcm", pcm, group=group)
+    else:
+        mixer_format = None
+    header = {"version": ASSET_BUNDLE_VERSION, "sources": asset_bundle_sources(data_dir), "pixel_format": pixel_format,
+              "mixer": list(mixer_format) if mixer_format else None, "pitch_steps": SOUND_PITCH_STEPS, "entries": entries}
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = asset_bundle_data_start(len(header_bytes))
+    path = os.path.join(data_dir, ASSET_BUNDLE_FILENAME)
+    with open(path + ".tmp", "wb") as f:
+        f.write(ASSET_BUNDLE_MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * (data_start - 16 - len(header_bytes)))
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(path + ".tmp", path)
+    return path, len(entries), data_start + offset
+
+def run_bundle_builder():
+    ensure_data_folder()
+    pygame.mixer.pre_init(44100, -16, 1)
+    pygame.init()
+    pygame.display.set_mode((1,1), pygame.HIDDEN)
+    data_dir = os.path.join(os.getcwd(), "data")
+    path, count, size = build_asset_bundle(data_dir)
+    print("Wrote " + path + ": " + str(count) + " entries, " + str(size // 1024) + " KiB")
+    pygame.quit()
+
 def rgb_to_hsv(r, g, b):
     rf = r / 255.0
     gf = g / 255.0
@@ -221,7 +1114,7 @@ def hsv_to_rgb(h, s, v):
     b = (b + m) * 255
     return int(round(r)), int(round(g)), int(round(b))
 
-def shift_surface_hue(original_surf, hue_value):
+def shift_surface_hue_per_pixel(original_surf, hue_value):
     arr_rgb = pygame.surfarray.array3d(original_surf)
     arr_alpha = pygame.surfarray.array_alpha(original_surf)
     w, h = original_surf.get_size()
@@ -243,6 +1136,36 @@ def shift_surface_hue(original_surf, hue_value):
     del arr_rgb, arr_alpha, new_arr_rgb, new_arr_alpha
     return new_surf
 
+HUE_SECTOR_CHANNELS = (
+    ("max", "mid", "min"),
+    ("mid", "max", "min"),
+    ("min", "max", "mid"),
+    ("min", "mid", "max"),
+    ("mid", "min", "max"),
+    ("max", "min", "mid"),
+)
+
+def shift_surface_hue(original_surf, hue_value):
+    if not NUMPY_AVAILABLE:
+        return shift_surface_hue_per_pixel(original_surf, hue_value)
+    hue = hue_value % 360
+    sector = min(int(hue // 60), 5)
+    x_factor = 1 - abs(((hue / 60) % 2) - 1)
+    mid_lut = numpy.rint(numpy.arange(256, dtype=numpy.float64) * x_factor).astype(numpy.uint8)
+    new_surf = original_surf.copy()
+    new_arr_rgb = pygame.surfarray.pixels3d(new_surf)
+    red = new_arr_rgb[:, :, 0]
+    green = new_arr_rgb[:, :, 1]
+    blue = new_arr_rgb[:, :, 2]
+    channel_max = numpy.maximum(numpy.maximum(red, green), blue)
+    channel_min = numpy.minimum(numpy.minimum(red, green), blue)
+    channel_mid = channel_min + mid_lut[channel_max - channel_min]
+    channels = {"max": channel_max, "mid": channel_mid, "min": channel_min}
+    for i, name in enumerate(HUE_SECTOR_CHANNELS[sector]):
+        new_arr_rgb[:, :, i] = channels[name]
+    del red, green, blue, new_arr_rgb
+    return new_surf
+
 def safe_shift_surface_hue(surf, hue_value):
     try:
         if surf is None:
@@ -257,16 +1180,17 @@ def safe_shift_surface_hue(surf, hue_value):
         return surf
 
 class Wind:
-    def __init__(self):
-        self.angle = random.uniform(0, 2*math.pi)
-        self.strength = random.uniform(0.0, 0.2)
+    def __init__(self, rng=None):
+        self.rng = rng or random.Random()
+        self.angle = self.rng.uniform(0, 2*math.pi)
+        self.strength = self.rng.uniform(0.0, 0.2)
         self.change_timer = 0.0
     def update(self, dt):
         self.change_timer -= dt
         if self.change_timer <= 0:
-            self.change_timer = random.uniform(1.5, 4.0)
-            self.angle += random.uniform(-0.3, 0.3)
-            self.strength += random.uniform(-0.05, 0.05)
+            self.change_timer = self.rng.uniform(1.5, 4.0)
+            self.angle += self.rng.uniform(-0.3, 0.3)
+            self.strength += self.rng.uniform(-0.05, 0.05)
             self.strength = max(0, min(0.6, self.strength))
     def apply_to_ball(self, ball):
         wind_x = math.cos(self.angle)*self.strength
@@ -280,6 +1204,8 @@ class Wind:
         end_x = cx + arrow_len * math.cos(self.angle)
         end_y = cy + arrow_len * math.sin(self.angle)
         pygame.draw.line(screen, (200,200,0), (cx,cy), (end_x,end_y), width=3)
+    def gauge_rect(self):
+        return pygame.Rect(SCREEN_WIDTH - 60 - 56, 60 - 56, 112, 112)
 
 bounce_sounds = []
 bounce_index = 0
@@ -290,67 +1216,283 @@ button_sound = None
 def play_bounce_sound():
     global bounce_index
     if bounce_sounds:
-        bounce_sounds[bounce_index].play()
+        AUDIO.play("bumper", bounce_sounds[bounce_index])
         bounce_index = min(bounce_index + 1, len(bounce_sounds)-1)
 
 def play_border_sound():
-    if border_sound:
-        border_sound.play()
+    AUDIO.play("border", border_sound)
 
 def play_panel_sound():
-    if panel_sound:
-        panel_sound.play()
+    AUDIO.play("panel", panel_sound)
 
 def play_button_sound():
-    if button_sound:
-        button_sound.play()
+    AUDIO.play("button", button_sound)
 
-class Flipper(pygame.sprite.Sprite):
-    def __init__(self, side, pivot_pos, length=60):
-        super().__init__()
+def mask_radius(mask):
+    w, h = mask.get_size()
+    radius = 0.0
+    for component in mask.connected_components():
+        for x, y in component.outline():
+            radius = max(radius, math.hypot(x + 0.5 - w / 2.0, y + 0.5 - h / 2.0))
+    return radius + 0.75
+
+def mask_circle_radius(mask):
+    return math.sqrt(mask.count() / math.pi)
+
+def mask_is_round(mask, radius):
+    w, h = mask.get_size()
+    surf = pygame.Surface((w, h), pygame.SRCALPHA)
+    pygame.draw.circle(surf, (255,255,255), (w / 2.0, h / 2.0), radius)
+    circle = pygame.mask.from_surface(surf)
+    mismatch = mask.count() + circle.count() - 2 * mask.overlap_area(circle, (0, 0))
+    return mismatch <= MASK_ROUND_TOLERANCE * max(1, mask.count())
+
+def contact_normal(x, y, cx, cy, vx, vy):
+    nx = x - cx
+    ny = y - cy
+    length = math.hypot(nx, ny)
+    if length == 0:
+        nx, ny = -vx, -vy
+        length = math.hypot(nx, ny) or 1.0
+    return nx / length, ny / length
+
+def reflect_velocity(vx, vy, nx, ny, svx=0.0, svy=0.0):
+    approach = (vx - svx)*nx + (vy - svy)*ny
+    if approach >= 0:
+        return vx, vy
+    return vx - 2*approach*nx, vy - 2*approach*ny
+
+def resolve_contact(vx, vy, nx, ny, svx=0.0, svy=0.0):
+    # Returns (vx, vy, bounced); a slow approach only loses its normal component.
+    approach = (vx - svx)*nx + (vy - svy)*ny
+    if approach >= 0:
+        return vx, vy, False
+    if approach > -RESTING_CONTACT_SPEED:
+        return vx - approach*nx, vy - approach*ny, False
+    return vx - 2*approach*nx, vy - 2*approach*ny, True
+
+def closest_on_segment(x, y, a, b):
+    ux = b[0] - a[0]
+    uy = b[1] - a[1]
+    seg_sq = ux*ux + uy*uy
+    u = 0.0
+    if seg_sq > 0:
+        u = max(0.0, min(1.0, ((x - a[0])*ux + (y - a[1])*uy) / seg_sq))
+    return u, a[0] + ux*u, a[1] + uy*u
+
+def sweep_circle_xy(x0, y0, dx, dy, cx, cy, radius_sq):
+    fx = x0 - cx
+    fy = y0 - cy
+    c = fx*fx + fy*fy - radius_sq
+    if c <= 0:
+        return 0.0
+    b = fx*dx + fy*dy
+    if b >= 0:
+        return None
+    a = dx*dx + dy*dy
+    disc = b*b - a*c
+    if disc < 0:
+        return None
+    t = (-b - math.sqrt(disc)) / a
+    return t if t <= 1 else None
+
+def sweep_segment_xy(x0, y0, dx, dy, ax, ay, bx, by, radius):
+    ux = bx - ax
+    uy = by - ay
+    seg_len = math.hypot(ux, uy)
+    radius_sq = radius*radius
+    if seg_len == 0:
+        return sweep_circle_xy(x0, y0, dx, dy, ax, ay, radius_sq)
+    ux /= seg_len
+    uy /= seg_len
+    along0 = (x0 - ax)*ux + (y0 - ay)*uy
+    side0 = (y0 - ay)*ux - (x0 - ax)*uy
+    if 0 <= along0 <= seg_len and abs(side0) <= radius:
+        return 0.0
+    d_along = dx*ux + dy*uy
+    d_side = dy*ux - dx*uy
+    best = None
+    if d_side != 0:
+        for offset in (radius, -radius):
+            t = (offset - side0) / d_side
+            if 0 <= t <= 1 and 0 <= along0 + t*d_along <= seg_len:
+                if best is None or t < best:
+                    best = t
+    t = sweep_circle_xy(x0, y0, dx, dy, ax, ay, radius_sq)
+    if t is not None and (best is None or t < best):
+        best = t
+    t = sweep_circle_xy(x0, y0, dx, dy, bx, by, radius_sq)
+    if t is not None and (best is None or t < best):
+        best = t
+    return best
+
+def sweep_circle(p0, p1, center, radius):
+    return sweep_circle_xy(p0.x, p0.y, p1.x - p0.x, p1.y - p0.y, center[0], center[1], radius*radius)
+
+def sweep_segment(p0, p1, a, b, radius):
+    return sweep_segment_xy(p0.x, p0.y, p1.x - p0.x, p1.y - p0.y, a[0], a[1], b[0], b[1], radius)
+
+def segment_contact(x0, y0, dx, dy, vx, vy, a, b, radius):
+    # Returns (t, u, x, y, nx, ny) for the first touch of the capsule, or None.
+    # A start that already overlaps is pushed out along the normal instead of
+    # being rewound, so a ball resting on the capsule can still leave it.
+    t = sweep_segment_xy(x0, y0, dx, dy, a[0], a[1], b[0], b[1], radius)
+    if t is None:
+        return None
+    x = x0 + dx*t
+    y = y0 + dy*t
+    u, qx, qy = closest_on_segment(x, y, a, b)
+    nx, ny = contact_normal(x, y, qx, qy, vx, vy)
+    if t == 0:
+        x = qx + nx*radius
+        y = qy + ny*radius
+    return t, u, x, y, nx, ny
+
+class SpatialHash:
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+    def _cells(self, left, top, right, bottom):
+        cs = self.cell_size
+        for cx in range(int(left // cs), int(right // cs) + 1):
+            for cy in range(int(top // cs), int(bottom // cs) + 1):
+                yield (cx, cy)
+    def insert(self, item, center, radius):
+        for key in self._cells(center[0] - radius, center[1] - radius, center[0] + radius, center[1] + radius):
+            self.cells.setdefault(key, []).append(item)
+    def remove(self, item, center, radius):
+        for key in self._cells(center[0] - radius, center[1] - radius, center[0] + radius, center[1] + radius):
+            cell = self.cells.get(key)
+            if cell and item in cell:
+                cell.remove(item)
+                if not cell:
+                    del self.cells[key]
+    def query(self, left, top, right, bottom):
+        found = []
+        seen = set()
+        for key in self._cells(left, top, right, bottom):
+            cell = self.cells.get(key)
+            if not cell:
+                continue
+            for item in cell:
+                if item not in seen:
+                    seen.add(item)
+                    found.append(item)
+        return found
+
+def rotate_mask(mask, angle):
+    surf = mask.to_surface(setcolor=(255,255,255,255), unsetcolor=(0,0,0,0))
+    return pygame.mask.from_surface(pygame.transform.rotate(surf, angle))
+
+class RotationAtlas:
+    def __init__(self, build_frame, angle_limit, step=FLIPPER_ANGLE_STEP):
+        self.step = step
+        self.frames = {}
+        last = int(round(abs(angle_limit) / step))
+        direction = 1 if angle_limit >= 0 else -1
+        for i in range(last + 1):
+            self.frames[i * direction] = build_frame(i * direction * step)
+        self.min_key = min(self.frames)
+        self.max_key = max(self.frames)
+    def key(self, angle):
+        return max(self.min_key, min(self.max_key, int(round(angle / self.step))))
+    def quantize(self, angle):
+        return self.key(angle) * self.step
+    def get(self, angle):
+        return self.frames[self.key(angle)]
+
+def flipper_mask_frame_builder(base_mask, side):
+    def build(angle):
+        mask = rotate_mask(base_mask, angle)
+        w, h = mask.get_size()
+        if side=="left":
+            pivot_offset = (w, h//2)
+        else:
+            pivot_offset = (0, h//2)
+        return mask, pivot_offset
+    return build
+
+def load_flipper_image(side, length=60):
+    data_dir = os.path.join(os.getcwd(), "data")
+    if side=="left" and os.path.exists(os.path.join(data_dir, "panel_left.png")):
+        return load_display_image(os.path.join(data_dir, "panel_left.png"))
+    elif side=="right" and os.path.exists(os.path.join(data_dir, "panel_right.png")):
+        return load_display_image(os.path.join(data_dir, "panel_right.png"))
+    w = length
+    h = 15
+    surf = pygame.Surface((w,h), pygame.SRCALPHA)
+    color = (200,200,200)
+    pygame.draw.rect(surf, color, (0,0,w,h), border_radius=5)
+    return surf
+
+class CollisionShapes:
+    def __init__(self, ball_mask, bumper_mask, flipper_masks, hole_size=(80,30)):
+        self.ball_mask = ball_mask
+        self.bumper_mask = bumper_mask
+        self.flipper_masks = flipper_masks
+        self.flipper_atlases = {}
+        for side, mask in flipper_masks.items():
+            self.flipper_atlases[side] = RotationAtlas(flipper_mask_frame_builder(mask, side), FLIPPER_ANGLE_UP[side])
+        self.hole_size = hole_size
+        self.bumper_radius = bumper_mask.get_size()[0] // 2
+        self.bumper_reach = mask_radius(bumper_mask)
+        self.ball_radius = mask_radius(ball_mask)
+        self.ball_circle = mask_circle_radius(ball_mask)
+        self.bumper_circle = mask_circle_radius(bumper_mask)
+        self.bumper_contact = self.bumper_circle + self.ball_circle
+        self.exact_bumpers = MASK_COLLISION_MODE or not mask_is_round(bumper_mask, self.bumper_circle)
+        self.exact_flippers = MASK_COLLISION_MODE
+        if self.exact_bumpers and not MASK_COLLISION_MODE:
+            debug_print("bumper.png is not round => using pixel mask collision for bumpers.")
+
+def make_default_collision_shapes():
+    _, ball_mask = get_alpha_mask_circle(10)
+    _, bumper_mask = get_alpha_mask_circle(20)
+    flipper_surf = pygame.Surface((60,15), pygame.SRCALPHA)
+    pygame.draw.rect(flipper_surf, (200,200,200), (0,0,60,15), border_radius=5)
+    flipper_mask = pygame.mask.from_surface(flipper_surf)
+    return CollisionShapes(ball_mask, bumper_mask, {"left": flipper_mask, "right": flipper_mask})
+
+class FlipperState:
+    def __init__(self, side, pivot_pos, atlas):
         self.side = side
         self.angle = 0
+        self.shape_angle = 0
         self.pivot = pivot_pos
-        self.length = length
-        self.angle_up = 45 if side=="left" else -45
+        self.atlas = atlas
+        self.length, self.thickness = atlas.get(0)[0].get_size()
+        self.angle_up = FLIPPER_ANGLE_UP[side]
         self.rotating = False
         self.time_since_flip = 0.0
         self.flip_duration = 0.15
-        self.original_image = None
         self.mask = None
-        self.image = None
         self.rect = None
-        self._load_or_build_image()
+        self.segment = None
+        self.end_velocity = ((0.0, 0.0), (0.0, 0.0))
         self._update_rotation()
-    def _load_or_build_image(self):
-        data_dir = os.path.join(os.getcwd(), "data")
-        if self.side=="left" and os.path.exists(os.path.join(data_dir, "panel_left.png")):
-            self.original_image = pygame.image.load(os.path.join(data_dir, "panel_left.png")).convert_alpha()
-        elif self.side=="right" and os.path.exists(os.path.join(data_dir, "panel_right.png")):
-            self.original_image = pygame.image.load(os.path.join(data_dir, "panel_right.png")).convert_alpha()
-        else:
-            w = self.length
-            h = 15
-            surf = pygame.Surface((w,h), pygame.SRCALPHA)
-            color = (200,200,200)
-            pygame.draw.rect(surf, color, (0,0,w,h), border_radius=5)
-            self.original_image = surf
     def trigger_flip(self):
         self.rotating = True
         self.time_since_flip = 0.0
     def _update_rotation(self):
-        rotated = pygame.transform.rotate(self.original_image, self.angle)
-        w, h = rotated.get_size()
-        if self.side=="left":
-            pivot_offset = (w, h//2)
-        else:
-            pivot_offset = (0, h//2)
-        self.rect = rotated.get_rect()
-        self.rect.topleft = (self.pivot[0] - pivot_offset[0], self.pivot[1] - pivot_offset[1])
-        self.image = rotated
-        self.mask = pygame.mask.from_surface(rotated)
-    def update(self, dt, ball):
+        self.shape_angle = self.atlas.quantize(self.angle)
+        self.mask, pivot_offset = self.atlas.get(self.angle)
+        w, h = self.mask.get_size()
+        self.rect = pygame.Rect(self.pivot[0] - pivot_offset[0], self.pivot[1] - pivot_offset[1], w, h)
+        cx = self.rect.x + self.rect.width / 2.0
+        cy = self.rect.y + self.rect.height / 2.0
+        rad = math.radians(self.shape_angle)
+        half_len = self.length / 2.0
+        dx = math.cos(rad) * half_len
+        dy = -math.sin(rad) * half_len
+        self.segment = ((cx - dx, cy - dy), (cx + dx, cy + dy), self.thickness / 2.0)
+    def capsule(self):
+        return self.segment
+    def surface_velocity(self, u):
+        (avx, avy), (bvx, bvy) = self.end_velocity
+        return avx + (bvx - avx)*u, avy + (bvy - avy)*u
+    def update(self, dt):
         if self.rotating:
+            a0, b0, radius = self.segment
             self.time_since_flip += dt
             alpha = self.time_since_flip / self.flip_duration
             if alpha < 1.0:
@@ -359,117 +1501,841 @@ class Flipper(pygame.sprite.Sprite):
                 self.rotating=False
                 self.angle=0
             self._update_rotation()
-        if pygame.sprite.collide_mask(ball, self):
-            if self.side in ("left","right"):
-                ball.vel.x = -ball.vel.x
-            play_panel_sound()
+            a, b, radius = self.segment
+            if self.rotating:
+                self.end_velocity = ((a[0] - a0[0], a[1] - a0[1]), (b[0] - b0[0], b[1] - b0[1]))
+            else:
+                self.end_velocity = ((0.0, 0.0), (0.0, 0.0))
 
-class Hole(pygame.sprite.Sprite):
-    def __init__(self, pos, w, h, hole_surf=None, hole_mask=None):
-        super().__init__()
+class HoleState:
+    def __init__(self, pos, w, h):
         self.pos = pos
         self.width = w
         self.height = h
-        self.original_surf = hole_surf
-        self.original_mask = hole_mask
-        self.image = None
-        self.mask = None
         self.rect = None
-        self._update_surface(w,h)
-    def _update_surface(self, w,h):
-        if self.original_surf:
-            new_surf = pygame.transform.scale(self.original_surf, (w,h))
-            self.image = new_surf
-            self.mask = pygame.mask.from_surface(new_surf)
-            self.rect = self.image.get_rect(midtop=self.pos)
-        else:
-            surf = pygame.Surface((w,h), pygame.SRCALPHA)
-            pygame.draw.rect(surf, (0,255,0,50), (0,0,w,h), border_radius=10)
-            self.image = surf
-            self.mask = pygame.mask.from_surface(surf)
-            self.rect = self.image.get_rect(midtop=self.pos)
+        self._update_rect()
+    def _update_rect(self):
+        self.rect = pygame.Rect(0, 0, self.width, self.height)
+        self.rect.midtop = self.pos
     def enlarge(self, amount=10):
         self.width += amount
-        self._update_surface(self.width, self.height)
+        self._update_rect()
 
-class Bumper(pygame.sprite.Sprite):
-    def __init__(self, pos, surf, mask):
-        super().__init__()
-        self.image = surf
+class BumperState:
+    def __init__(self, pos, mask):
+        self.pos = pos
+        self.center = pygame.math.Vector2(pos)
         self.mask = mask
-        self.rect = self.image.get_rect(center=pos)
-    def on_hit(self):
-        self.kill()
+        self.rect = pygame.Rect((0,0), mask.get_size())
+        self.rect.center = (int(round(pos[0])), int(round(pos[1])))
 
-class Ball(pygame.sprite.Sprite):
-    def __init__(self, pos, ball_surf, ball_mask):
-        super().__init__()
-        self.original_image = ball_surf
-        self.image = self.original_image.copy()
-        self.mask = ball_mask
-        self.rect = self.image.get_rect(center=pos)
+class BallState:
+    def __init__(self, pos, mask, radius):
+        self.mask = mask
+        self.radius = radius
+        self.rect = pygame.Rect((0,0), mask.get_size())
+        self.rect.center = pos
         self.pos = pygame.math.Vector2(pos)
+        self.prev_pos = pygame.math.Vector2(pos)
         self.vel = pygame.math.Vector2(0,0)
         self.fired = False
         self.active = True
         self.bottom_bounce_count = 0
-    def update(self):
+    def move_to(self, pos):
+        self.pos = pygame.math.Vector2(pos)
+        self.rect.center = (int(self.pos.x), int(self.pos.y))
+    def update(self, state):
         if not self.fired or not self.active:
             return
         self.vel.y += GRAVITY * BALL_SPEED_MODIFIER
-        self.pos += self.vel * BALL_SPEED_MODIFIER
-        self.rect.center = (int(self.pos.x), int(self.pos.y))
+        distance = self.vel.length() * BALL_SPEED_MODIFIER
+        substeps = max(1, int(math.ceil(distance / max(1.0, self.radius))))
+        hit_flippers = set()
+        for i in range(substeps):
+            start = pygame.math.Vector2(self.pos)
+            self.move_to(self.pos + self.vel * (BALL_SPEED_MODIFIER / substeps))
+            self._bounce_borders(state)
+            collide_flippers(state, start, hit_flippers)
+            collide_bumpers(state, start)
+    def _bounce_borders(self, state):
         if self.rect.left < 0:
             self.rect.left = 0
             self.pos.x = self.rect.centerx
             self.vel.x = -self.vel.x
-            play_border_sound()
+            state.events.append(("border", None))
             self.bottom_bounce_count = 0
-        if self.rect.right > SCREEN_WIDTH:
-            self.rect.right = SCREEN_WIDTH
+        if self.rect.right > state.width:
+            self.rect.right = state.width
             self.pos.x = self.rect.centerx
             self.vel.x = -self.vel.x
-            play_border_sound()
+            state.events.append(("border", None))
             self.bottom_bounce_count = 0
         if self.rect.top < 0:
             self.rect.top = 0
             self.pos.y = self.rect.centery
             self.vel.y = -self.vel.y
-            play_border_sound()
+            state.events.append(("border", None))
             self.bottom_bounce_count = 0
-        if self.rect.bottom > SCREEN_HEIGHT:
-            self.rect.bottom = SCREEN_HEIGHT
+        if self.rect.bottom > state.height:
+            self.rect.bottom = state.height
             self.pos.y = self.rect.centery
             self.vel.y = -self.vel.y
-            play_border_sound()
+            state.events.append(("border", None))
             self.bottom_bounce_count += 1
 
-def place_bumpers(bumper_count, bumper_surf, bumper_mask):
-    bumpers = pygame.sprite.Group()
-    attempts = 0
-    max_attempts = 500
-    radius_estimate = bumper_surf.get_width() // 2
-    debug_print("Placing " + str(bumper_count) + " bumpers with radius estimate " + str(radius_estimate) + ".")
-    while len(bumpers) < bumper_count and attempts < max_attempts:
-        x = random.randint(150, SCREEN_WIDTH - 150)
-        y = random.randint(100, SCREEN_HEIGHT // 2)
-        candidate = Bumper((x,y), bumper_surf, bumper_mask)
-        overlap = False
-        for b in bumpers:
-            dx = b.rect.centerx - candidate.rect.centerx
-            dy = b.rect.centery - candidate.rect.centery
-            dist = math.sqrt(dx*dx + dy*dy)
-            if dist < radius_estimate*2:
-                overlap = True
+def mask_contact(ball, body, start, t):
+    if t > 0:
+        end = pygame.math.Vector2(ball.pos)
+        ball.move_to(start.lerp(end, t))
+        if pygame.sprite.collide_mask(ball, body):
+            return True
+        ball.move_to(end)
+    return pygame.sprite.collide_mask(ball, body) is not None
+
+def mask_normal(ball, body):
+    offset = (body.rect.x - ball.rect.x, body.rect.y - ball.rect.y)
+    nx = ball.mask.overlap_area(body.mask, (offset[0] + 1, offset[1])) - ball.mask.overlap_area(body.mask, (offset[0] - 1, offset[1]))
+    ny = ball.mask.overlap_area(body.mask, (offset[0], offset[1] + 1)) - ball.mask.overlap_area(body.mask, (offset[0], offset[1] - 1))
+    if nx == 0 and ny == 0:
+        return contact_normal(ball.rect.centerx, ball.rect.centery, body.rect.centerx, body.rect.centery, ball.vel.x, ball.vel.y)
+    return contact_normal(nx, ny, 0, 0, 0, 0)
+
+def bounce_off_flipper(ball, f, normal=None):
+    a, b, radius = f.capsule()
+    u, qx, qy = closest_on_segment(ball.pos.x, ball.pos.y, a, b)
+    if normal is None:
+        normal = contact_normal(ball.pos.x, ball.pos.y, qx, qy, ball.vel.x, ball.vel.y)
+    svx, svy = f.surface_velocity(u)
+    ball.vel.x, ball.vel.y, bounced = resolve_contact(ball.vel.x, ball.vel.y, normal[0], normal[1],
+                                                      svx / BALL_SPEED_MODIFIER, svy / BALL_SPEED_MODIFIER)
+    return bounced
+
+def collide_flippers(state, start, hit_flippers):
+    ball = state.ball
+    if state.shapes.exact_flippers:
+        for f in state.flippers:
+            if f in hit_flippers:
+                continue
+            a, b, radius = f.capsule()
+            t = sweep_segment(start, ball.pos, a, b, radius + ball.radius + 0.75)
+            if t is None or not mask_contact(ball, f, start, t):
+                continue
+            if bounce_off_flipper(ball, f, mask_normal(ball, f)):
+                hit_flippers.add(f)
+                state.events.append(("panel", f))
+        return
+    first = None
+    contact = state.shapes.ball_circle
+    vx, vy = ball.vel.x, ball.vel.y
+    dx = ball.pos.x - start.x
+    dy = ball.pos.y - start.y
+    for f in state.flippers:
+        if f in hit_flippers:
+            continue
+        a, b, radius = f.capsule()
+        hit = segment_contact(start.x, start.y, dx, dy, vx, vy, a, b, radius + contact)
+        if hit is None:
+            continue
+        svx, svy = f.surface_velocity(hit[1])
+        svx /= BALL_SPEED_MODIFIER
+        svy /= BALL_SPEED_MODIFIER
+        # Contacts the ball is already leaving are not collisions.
+        if (vx - svx)*hit[4] + (vy - svy)*hit[5] >= 0:
+            continue
+        if first is None or hit[0] < first[0][0]:
+            first = (hit, f, svx, svy)
+    if first is None:
+        return
+    (t, u, x, y, nx, ny), f, svx, svy = first
+    ball.move_to((x, y))
+    hit_flippers.add(f)
+    ball.vel.x, ball.vel.y, bounced = resolve_contact(vx, vy, nx, ny, svx, svy)
+    if bounced:
+        state.events.append(("panel", f))
+
+def bumper_candidates(state, start, end, reach):
+    left = min(start.x, end.x) - reach
+    top = min(start.y, end.y) - reach
+    right = max(start.x, end.x) + reach
+    bottom = max(start.y, end.y) + reach
+    return state.bumper_grid.query(left, top, right, bottom)
+
+def hit_bumper(state, bump):
+    debug_print("Collision => +50")
+    state.level_score += 50
+    state.bumpers.remove(bump)
+    state.bumper_grid.remove(bump, bump.center, state.shapes.bumper_reach)
+    state.events.append(("bumper", bump))
+    state.ball.bottom_bounce_count = 0
+
+def collide_bumpers(state, start):
+    ball = state.ball
+    if state.shapes.exact_bumpers:
+        reach = state.shapes.bumper_reach + ball.radius
+        for bump in bumper_candidates(state, start, ball.pos, ball.radius):
+            t = sweep_circle(start, ball.pos, bump.center, reach)
+            if t is None or not mask_contact(ball, bump, start, t):
+                continue
+            nx, ny = mask_normal(ball, bump)
+            ball.vel.x, ball.vel.y = reflect_velocity(ball.vel.x, ball.vel.y, nx, ny)
+            hit_bumper(state, bump)
+        return
+    first = None
+    contact_sq = state.shapes.bumper_contact ** 2
+    dx = ball.pos.x - start.x
+    dy = ball.pos.y - start.y
+    for bump in bumper_candidates(state, start, ball.pos, ball.radius):
+        t = sweep_circle_xy(start.x, start.y, dx, dy, bump.center.x, bump.center.y, contact_sq)
+        if t is not None and (first is None or t < first[0]):
+            first = (t, bump)
+    if first is None:
+        return
+    t, bump = first
+    ball.move_to((start.x + dx*t, start.y + dy*t))
+    nx, ny = contact_normal(ball.pos.x, ball.pos.y, bump.center.x, bump.center.y, ball.vel.x, ball.vel.y)
+    ball.vel.x, ball.vel.y = reflect_velocity(ball.vel.x, ball.vel.y, nx, ny)
+    hit_bumper(state, bump)
+
+def trace_path(state, angle, points, bounces, max_steps=AIM_PREVIEW_STEPS, max_bounces=AIM_PREVIEW_BOUNCES):
+    # Appends the predicted path to points and bounces, yielding after every tick so
+    # the caller can spread a long prediction over several frames.
+    ball = state.ball
+    shapes = state.shapes
+    half_w = ball.rect.width // 2
+    half_h = ball.rect.height // 2
+    min_x, max_x = half_w, state.width - (ball.rect.width - half_w)
+    min_y, max_y = half_h, state.height - (ball.rect.height - half_h)
+    contact = shapes.bumper_contact
+    contact_sq = contact * contact
+    # The bumper grid already lists every bumper in each cell within bumper_reach of it;
+    # growing a path's box by the rest of the contact distance finds every bumper it can touch.
+    grid = state.bumper_grid.cells
+    cell = state.bumper_grid.cell_size
+    pad = max(0.0, contact - shapes.bumper_reach)
+    bumper_top = min(bump.center.y for bump in state.bumpers) - contact if state.bumpers else state.height
+    bumper_bottom = max(bump.center.y for bump in state.bumpers) + contact if state.bumpers else 0
+    flippers = []
+    for f in state.flippers:
+        a, b, radius = f.capsule()
+        radius += shapes.ball_circle
+        flippers.append((min(a[0], b[0]) - radius, min(a[1], b[1]) - radius, max(a[0], b[0]) + radius, max(a[1], b[1]) + radius, a, b, radius))
+    flipper_top = min(entry[1] for entry in flippers) if flippers else state.height
+    holes = [h.rect.inflate(ball.rect.width, ball.rect.height) for h in state.holes]
+    hole_top = min(rect.top for rect in holes) if holes else state.height
+    speed = 25 * BALL_SPEED_MODIFIER
+    vx = speed * math.cos(angle)
+    vy = speed * math.sin(angle)
+    wind_x = math.cos(state.wind.angle) * state.wind.strength
+    gravity = GRAVITY * BALL_SPEED_MODIFIER
+    modifier = BALL_SPEED_MODIFIER
+    substep_len = max(1.0, ball.radius)
+    x, y = ball.pos.x, ball.pos.y
+    hit_bumpers = set()
+    points.append((x, y))
+
+    def candidates(x0, y0, x1, y1):
+        found = []
+        if max(y0, y1) < bumper_top or min(y0, y1) > bumper_bottom:
+            return found
+        for cx in range(int((min(x0, x1) - pad) // cell), int((max(x0, x1) + pad) // cell) + 1):
+            for cy in range(int((min(y0, y1) - pad) // cell), int((max(y0, y1) + pad) // cell) + 1):
+                for bump in grid.get((cx, cy), ()):
+                    if bump not in hit_bumpers and bump not in found:
+                        found.append(bump)
+        return found
+
+    def touches_bumper(x0, y0, x1, y1, lo_x, lo_y, hi_x, hi_y):
+        dx = x1 - x0
+        dy = y1 - y0
+        for cx in range(int((lo_x - pad) // cell), int((hi_x + pad) // cell) + 1):
+            for cy in range(int((lo_y - pad) // cell), int((hi_y + pad) // cell) + 1):
+                for bump in grid.get((cx, cy), ()):
+                    center = bump.center
+                    if bump not in hit_bumpers and sweep_circle_xy(x0, y0, dx, dy, center.x, center.y, contact_sq) is not None:
+                        return True
+        return False
+
+    def near_flippers(x0, y0, x1, y1):
+        if max(y0, y1) < flipper_top:
+            return []
+        lo_x, hi_x = (x0, x1) if x0 < x1 else (x1, x0)
+        lo_y, hi_y = (y0, y1) if y0 < y1 else (y1, y0)
+        return [entry for entry in flippers if not (hi_x < entry[0] or lo_x > entry[2] or hi_y < entry[1] or lo_y > entry[3])]
+
+    for i in range(max_steps):
+        vx += wind_x
+        vy += gravity
+        substeps = max(1, int(math.ceil(math.hypot(vx, vy) * modifier / substep_len)))
+        factor = modifier / substeps
+        # A tick that stays inside the borders and clears every shape is a straight line;
+        # anything else is replayed substep by substep exactly like BallState.update.
+        step_x = vx * factor
+        step_y = vy * factor
+        x1 = x + step_x
+        y1 = y + step_y
+        for k in range(1, substeps):
+            x1 += step_x
+            y1 += step_y
+        # Float form of the int() border test in _bounce_borders; it can only send extra ticks to the exact replay.
+        exact = x1 < min_x or x1 >= max_x + 1 or y1 < min_y or y1 >= max_y + 1
+        if not exact:
+            lo_x, hi_x = (x, x1) if x < x1 else (x1, x)
+            lo_y, hi_y = (y, y1) if y < y1 else (y1, y)
+            if hi_y >= flipper_top:
+                for entry in flippers:
+                    if not (hi_x < entry[0] or lo_x > entry[2] or hi_y < entry[1] or lo_y > entry[3]):
+                        exact = True
+                        break
+            if not exact and hi_y >= bumper_top and lo_y <= bumper_bottom:
+                exact = touches_bumper(x, y, x1, y1, lo_x, lo_y, hi_x, hi_y)
+        bounced = False
+        if not exact:
+            x, y = x1, y1
+        else:
+            hit_flippers = set()
+            for k in range(substeps):
+                x0, y0 = x, y
+                x += vx * factor
+                y += vy * factor
+                if int(x) < min_x or int(x) > max_x:
+                    x = min_x if int(x) < min_x else max_x
+                    vx = -vx
+                    bounced = True
+                if int(y) < min_y or int(y) > max_y:
+                    y = min_y if int(y) < min_y else max_y
+                    vy = -vy
+                    bounced = True
+                dx = x - x0
+                dy = y - y0
+                first = None
+                for entry in near_flippers(x0, y0, x, y):
+                    if entry in hit_flippers:
+                        continue
+                    hit = segment_contact(x0, y0, dx, dy, vx, vy, entry[4], entry[5], entry[6])
+                    if hit is None or vx*hit[4] + vy*hit[5] >= 0:
+                        continue
+                    if first is None or hit[0] < first[0][0]:
+                        first = (hit, entry)
+                if first is not None:
+                    (t, u, x, y, nx, ny), entry = first
+                    hit_flippers.add(entry)
+                    vx, vy, hit = resolve_contact(vx, vy, nx, ny)
+                    bounced = bounced or hit
+                    dx = x - x0
+                    dy = y - y0
+                first = None
+                for bump in candidates(x0, y0, x, y):
+                    t = sweep_circle_xy(x0, y0, dx, dy, bump.center.x, bump.center.y, contact_sq)
+                    if t is not None and (first is None or t < first[0]):
+                        first = (t, bump)
+                if first is not None:
+                    t, bump = first
+                    bx, by = bump.center.x, bump.center.y
+                    x = x0 + dx*t
+                    y = y0 + dy*t
+                    hit_bumpers.add(bump)
+                    nx, ny = contact_normal(x, y, bx, by, vx, vy)
+                    vx, vy = reflect_velocity(vx, vy, nx, ny)
+                    bounced = True
+        points.append((x, y))
+        if y >= hole_top and any(rect.collidepoint(x, y) for rect in holes):
+            break
+        if bounced:
+            bounces.append((x, y))
+            if len(bounces) >= max_bounces:
                 break
-        if not overlap:
-            bumpers.add(candidate)
-        attempts += 1
-    if len(bumpers) < bumper_count:
-        debug_print("Could only place " + str(len(bumpers)) + " bumpers (wanted " + str(bumper_count) + ").")
+        yield
+
+def predict_path(state, angle, max_steps=AIM_PREVIEW_STEPS, max_bounces=AIM_PREVIEW_BOUNCES):
+    points = []
+    bounces = []
+    for tick in trace_path(state, angle, points, bounces, max_steps, max_bounces):
+        pass
+    return points, bounces
+
+class AimPreview:
+    def __init__(self, max_steps=AIM_PREVIEW_STEPS, max_bounces=AIM_PREVIEW_BOUNCES, steps_per_frame=AIM_PREVIEW_STEPS_PER_FRAME):
+        self.max_steps = max_steps
+        self.max_bounces = max_bounces
+        self.steps_per_frame = steps_per_frame
+        self.key = None
+        self.bumpers = None
+        self.tracer = None
+        self.points = []
+        self.bounces = []
+        self.rect = None
+        self.computes = 0
+        self.revision = 0
+        self.compute_ms = 0.0
+    def update(self, state, angle):
+        ball = state.ball
+        key = (angle, state.wind.angle, state.wind.strength, ball.pos.x, ball.pos.y, len(state.bumpers),
+               tuple(f.shape_angle for f in state.flippers), tuple(h.width for h in state.holes))
+        if key != self.key or state.bumpers is not self.bumpers:
+            self.points = []
+            self.bounces = []
+            self.tracer = trace_path(state, angle, self.points, self.bounces, self.max_steps, self.max_bounces)
+            self.computes += 1
+            self.key = key
+            self.bumpers = state.bumpers
+        elif self.tracer is None:
+            return False
+        # A new aim only costs steps_per_frame ticks now; the rest of the path follows on the next frames.
+        start = time.perf_counter()
+        steps = 0
+        for tick in self.tracer:
+            steps += 1
+            if steps >= self.steps_per_frame:
+                break
+        else:
+            self.tracer = None
+        self.compute_ms = (time.perf_counter() - start) * 1000
+        self.revision += 1
+        xs = [p[0] for p in self.points]
+        ys = [p[1] for p in self.points]
+        self.rect = pygame.Rect(int(min(xs)) - 6, int(min(ys)) - 6, int(max(xs) - min(xs)) + 13, int(max(ys) - min(ys)) + 13)
+        return True
+    def draw(self, screen):
+        if len(self.points) > 1:
+            pygame.draw.lines(screen, (255,255,255), False, self.points, 1)
+        for point in self.bounces:
+            pygame.draw.circle(screen, (255,255,0), point, 4, width=1)
+
+def bumper_region(width, height):
+    return 150, 100, width - 150, height // 2
+
+def hex_lattice_shape(spacing, region_w, region_h):
+    row_h = spacing * math.sqrt(3) / 2
+    rows = int(region_h // row_h) + 1
+    cols_even = int(region_w // spacing) + 1
+    cols_odd = int((region_w - spacing / 2) // spacing) + 1 if region_w >= spacing / 2 else 0
+    return rows, cols_even, cols_odd, row_h
+
+def hex_lattice_capacity(spacing, region_w, region_h):
+    rows, cols_even, cols_odd, row_h = hex_lattice_shape(spacing, region_w, region_h)
+    return ((rows + 1) // 2) * cols_even + (rows // 2) * cols_odd
+
+def bumper_capacity(radius_estimate, width, height):
+    x0, y0, x1, y1 = bumper_region(width, height)
+    if x1 < x0 or y1 < y0:
+        return 0
+    return hex_lattice_capacity(max(1.0, radius_estimate * 2.0), x1 - x0, y1 - y0)
+
+def place_bumpers(bumper_count, radius_estimate, width, height, seed=None):
+    rng = random.Random(seed)
+    x0, y0, x1, y1 = bumper_region(width, height)
+    debug_print("Placing " + str(bumper_count) + " bumpers with radius estimate " + str(radius_estimate) + ".")
+    if bumper_count <= 0 or x1 < x0 or y1 < y0:
+        return []
+    region_w = x1 - x0
+    region_h = y1 - y0
+    min_dist = max(1.0, radius_estimate * 2.0)
+    capacity = hex_lattice_capacity(min_dist, region_w, region_h)
+    if capacity < bumper_count:
+        density = capacity / float((region_w + 1) * (region_h + 1)) * 10000
+        debug_print("Could only place " + str(capacity) + " bumpers (wanted " + str(bumper_count) + "). Maximum density at radius "
+                    + str(radius_estimate) + " is " + str(round(density, 2)) + " bumpers per 100x100 px.")
+        spacing = min_dist
+        bumper_count = capacity
     else:
-        debug_print("Successfully placed " + str(len(bumpers)) + " bumpers.")
-    return bumpers
+        low = min_dist
+        high = max(region_w, region_h, min_dist) * 2.0 + 1.0
+        for i in range(40):
+            mid = (low + high) / 2
+            if hex_lattice_capacity(mid, region_w, region_h) >= bumper_count:
+                low = mid
+            else:
+                high = mid
+        spacing = low
+    rows, cols_even, cols_odd, row_h = hex_lattice_shape(spacing, region_w, region_h)
+    used_w = (cols_even - 1) * spacing
+    if rows > 1 and cols_odd > 0:
+        used_w = max(used_w, (cols_odd - 1) * spacing + spacing / 2)
+    used_h = (rows - 1) * row_h
+    origin_x = x0 + rng.uniform(0, max(0.0, region_w - used_w))
+    origin_y = y0 + rng.uniform(0, max(0.0, region_h - used_h))
+    sites = []
+    for row in range(rows):
+        offset = spacing / 2 if row % 2 else 0.0
+        cols = cols_odd if row % 2 else cols_even
+        for col in range(cols):
+            sites.append((origin_x + offset + col * spacing, origin_y + row * row_h))
+    jitter = (spacing - min_dist) / (2 * math.sqrt(2))
+    positions = []
+    for sx, sy in rng.sample(sites, bumper_count):
+        x = rng.uniform(max(x0, sx - jitter), min(x1, sx + jitter))
+        y = rng.uniform(max(y0, sy - jitter), min(y1, sy + jitter))
+        positions.append((x, y))
+    debug_print("Successfully placed " + str(len(positions)) + " bumpers.")
+    return positions
+
+class GameState:
+    def __init__(self, width, height, shapes, seed=None, level_table=None):
+        self.width = width
+        self.height = height
+        self.shapes = shapes
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.level_table = level_table
+        self.tick = 0
+        self.bumper_hits = 0
+        self.bumper_crc = 0
+        self.wind = Wind(self.rng)
+        self.level = 1
+        self.total_score = 0
+        self.level_score = 0
+        self.shots_left = MAX_SHOTS
+        self.phase = "playing"
+        self.events = []
+        self.bumpers = []
+        self.bumper_grid = None
+        self.holes = []
+        self.flippers = []
+        self.ball = None
+        self.orgon_button_state = "HIDDEN"
+        self.orgon_button_timer = 0.0
+        self.repulsine_button_state = "HIDDEN"
+        self.repulsine_button_timer = 0.0
+        self._build_holes()
+        start_level(self)
+    def _build_holes(self):
+        gap = self.width // (HOLES_COUNT+1)
+        hole_width, hole_height = self.shapes.hole_size
+        for i in range(HOLES_COUNT):
+            pos_x = (i+1)*gap
+            pos_y = self.height - 80
+            self.holes.append(HoleState((pos_x, pos_y), hole_width, hole_height))
+            lf_pivot = (pos_x - hole_width//2, pos_y+10)
+            self.flippers.append(FlipperState("left", lf_pivot, self.shapes.flipper_atlases["left"]))
+            rf_pivot = (pos_x + hole_width//2, pos_y+10)
+            self.flippers.append(FlipperState("right", rf_pivot, self.shapes.flipper_atlases["right"]))
+    def new_ball(self):
+        return BallState((self.width//2,50), self.shapes.ball_mask, self.shapes.ball_radius)
+
+def build_bumper_grid(bumpers, reach):
+    grid = SpatialHash(max(16, int(reach * 2)))
+    for bump in bumpers:
+        grid.insert(bump, bump.center, reach)
+    return grid
+
+def load_level_table(path, width, height):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            table = json.load(f)
+        if table.get("version") != LEVEL_TABLE_VERSION:
+            debug_print("Ignoring " + path + ": unsupported version " + str(table.get("version")))
+            return None
+        if (table["width"], table["height"]) != (width, height):
+            debug_print("Ignoring " + path + ": calibrated for " + str(table["width"]) + "x" + str(table["height"])
+                        + ", screen is " + str(width) + "x" + str(height))
+            return None
+        levels = {int(entry["level"]): (int(entry["bumpers"]), int(entry["seed"])) for entry in table["levels"]}
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        debug_print("Could not read level table " + path + ": " + str(e))
+        return None
+    debug_print("Loaded level table " + path + " with " + str(len(levels)) + " levels.")
+    return levels
+
+def start_level(state):
+    bumper_count = state.level
+    layout_seed = state.rng.getrandbits(32)
+    if state.level_table and state.level in state.level_table:
+        bumper_count, layout_seed = state.level_table[state.level]
+    positions = place_bumpers(bumper_count, state.shapes.bumper_radius, state.width, state.height, layout_seed)
+    state.bumpers = [BumperState(pos, state.shapes.bumper_mask) for pos in positions]
+    state.bumper_grid = build_bumper_grid(state.bumpers, state.shapes.bumper_reach)
+    state.shots_left = MAX_SHOTS
+    state.level_score = 0
+    state.ball = state.new_ball()
+    state.phase = "playing"
+
+def advance_level(state):
+    state.level += 1
+    start_level(state)
+
+def restart_game(state):
+    state.total_score = 0
+    state.level = 1
+    start_level(state)
+
+def apply_input(state, action):
+    ball = state.ball
+    if action[0] == "flip":
+        for f in state.flippers:
+            if f.side==action[1]:
+                f.trigger_flip()
+    elif action[0] == "fire":
+        if not ball.fired and state.shots_left > 0:
+            angle = action[1]
+            speed = 25 * BALL_SPEED_MODIFIER
+            ball.vel.x = speed*math.cos(angle)
+            ball.vel.y = speed*math.sin(angle)
+            ball.fired = True
+            state.shots_left -= 1
+            state.events.append(("fire", None))
+            debug_print("Ball fired angle " + str(angle) + " speed " + str(speed))
+    elif action[0] == "orgon":
+        if state.orgon_button_state == "VISIBLE":
+            state.wind.angle = state.rng.uniform(0, 2 * math.pi)
+            state.wind.strength = state.rng.uniform(0.0, 0.6)
+            state.orgon_button_state = "HIDDEN"
+            state.orgon_button_timer = 0.0
+    elif action[0] == "repulsine":
+        if state.repulsine_button_state == "VISIBLE":
+            if ball.fired and ball.active:
+                ball.vel.y = -abs(ball.vel.y) * 2.0
+            state.repulsine_button_state = "HIDDEN"
+            state.repulsine_button_timer = 0.0
+
+def update_button_timers(state, dt):
+    state.orgon_button_timer += dt
+    if state.orgon_button_state == "HIDDEN":
+        if state.orgon_button_timer >= 30.0:
+            state.orgon_button_state = "VISIBLE"
+            state.orgon_button_timer = 0.0
+    elif state.orgon_button_state == "VISIBLE":
+        if state.orgon_button_timer >= 30.0:
+            state.orgon_button_state = "HIDDEN"
+            state.orgon_button_timer = 0.0
+    state.repulsine_button_timer += dt
+    if state.repulsine_button_state == "HIDDEN":
+        if state.repulsine_button_timer >= 20.0:
+            state.repulsine_button_state = "VISIBLE"
+            state.repulsine_button_timer = 0.0
+    elif state.repulsine_button_state == "VISIBLE":
+        if state.repulsine_button_timer >= 20.0:
+            state.repulsine_button_state = "HIDDEN"
+            state.repulsine_button_timer = 0.0
+
+def step(state, inputs, dt):
+    state.events = []
+    if state.phase != "playing":
+        return state.events
+    for action in inputs:
+        apply_input(state, action)
+    if not NOSPOON_MODE:
+        update_button_timers(state, dt)
+    FRAME_TIMER.lap("timers")
+    state.wind.update(dt)
+    ball = state.ball
+    ball.prev_pos = pygame.math.Vector2(ball.pos)
+    if ball.fired and ball.active:
+        state.wind.apply_to_ball(ball)
+    FRAME_TIMER.lap("wind")
+    for f in state.flippers:
+        f.update(dt)
+    FRAME_TIMER.lap("flippers")
+    ball.update(state)
+    FRAME_TIMER.lap("ball")
+    for name, obj in state.events:
+        if name == "bumper":
+            state.bumper_hits += 1
+            state.bumper_crc = zlib.crc32(struct.pack("<Idd", state.tick, obj.center.x, obj.center.y), state.bumper_crc)
+    for hobj in state.holes:
+        if ball.rect.colliderect(hobj.rect):
+            debug_print("Ball => hole => -25")
+            state.level_score -= 25
+            ball.active = False
+            ball.bottom_bounce_count = 0
+            state.events.append(("hole", hobj))
+            break
+    if not ball.active:
+        debug_print("Ball inactive => new ball top")
+        state.ball = state.new_ball()
+        ball = state.ball
+        state.events.append(("new_ball", ball))
+    if ball.bottom_bounce_count >= 5:
+        debug_print("bottom bounce too often => enlarge holes")
+        for hobj in state.holes:
+            hobj.enlarge(10)
+        ball.bottom_bounce_count = 0
+        state.events.append(("enlarge", None))
+    if len(state.bumpers) == 0:
+        state.total_score += state.level_score
+        debug_print("Level " + str(state.level) + " complete => total " + str(state.total_score))
+        state.phase = "level_complete"
+        state.events.append(("level_complete", None))
+    elif state.shots_left <= 0 and not ball.fired:
+        debug_print("Out of shots => Game Over")
+        state.phase = "game_over"
+        state.events.append(("game_over", None))
+    state.tick += 1
+    FRAME_TIMER.lap("holes")
+    return state.events
+
+def encode_replay_action(action):
+    if action[0] == "fire":
+        return REPLAY_FIRE, action[1]
+    if action[0] == "flip":
+        return (REPLAY_FLIP_LEFT if action[1] == "left" else REPLAY_FLIP_RIGHT), 0.0
+    if action[0] == "orgon":
+        return REPLAY_ORGON, 0.0
+    return REPLAY_REPULSINE, 0.0
+
+def decode_replay_action(code, value):
+    if code == REPLAY_FIRE:
+        return ("fire", value)
+    if code == REPLAY_FLIP_LEFT:
+        return ("flip", "left")
+    if code == REPLAY_FLIP_RIGHT:
+        return ("flip", "right")
+    if code == REPLAY_ORGON:
+        return ("orgon",)
+    if code == REPLAY_REPULSINE:
+        return ("repulsine",)
+    return None
+
+class ReplayRecorder:
+    def __init__(self, path, state):
+        self.path = path
+        self.file = open(path, "wb")
+        flags = (1 if NOSPOON_MODE else 0) | (2 if state.level_table else 0) | (4 if MASK_COLLISION_MODE else 0)
+        self.file.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, state.seed, state.width, state.height, MAX_SHOTS, flags))
+        self.records = 0
+        debug_print("Recording replay to " + path + " (seed " + str(state.seed) + ")")
+    def write(self, tick, code, value=0.0):
+        self.file.write(REPLAY_RECORD.pack(tick, code, value))
+        self.records += 1
+    def record_inputs(self, tick, inputs):
+        for action in inputs:
+            code, value = encode_replay_action(action)
+            self.write(tick, code, value)
+    def close(self, state):
+        if self.file is None:
+            return
+        self.write(state.tick, REPLAY_END)
+        self.file.write(REPLAY_TRAILER.pack(state.total_score + state.level_score, state.level, state.bumper_hits, state.bumper_crc))
+        self.file.close()
+        self.file = None
+        debug_print("Replay closed: " + str(self.records) + " records, " + str(state.tick) + " ticks")
+
+class ReplayPlayer:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, self.seed, self.width, self.height, self.max_shots, flags = REPLAY_HEADER.unpack_from(data, 0)
+        if magic != REPLAY_MAGIC:
+            raise ValueError("not a replay file: " + path)
+        if version != REPLAY_VERSION:
+            raise ValueError("replay version " + str(version) + " was recorded with different physics (this build plays version " + str(REPLAY_VERSION) + ")")
+        self.nospoon = bool(flags & 1)
+        self.level_table = bool(flags & 2)
+        self.mask_collision = bool(flags & 4)
+        self.records = []
+        self.end_tick = None
+        self.expected = None
+        offset = REPLAY_HEADER.size
+        while offset + REPLAY_RECORD.size <= len(data):
+            tick, code, value = REPLAY_RECORD.unpack_from(data, offset)
+            offset += REPLAY_RECORD.size
+            if code == REPLAY_END:
+                self.end_tick = tick
+                if offset + REPLAY_TRAILER.size <= len(data):
+                    self.expected = REPLAY_TRAILER.unpack_from(data, offset)
+                break
+            self.records.append((tick, code, value))
+        self.position = 0
+    def apply_settings(self):
+        global MAX_SHOTS, NOSPOON_MODE, MASK_COLLISION_MODE
+        MAX_SHOTS = self.max_shots
+        NOSPOON_MODE = self.nospoon
+        MASK_COLLISION_MODE = self.mask_collision
+    def inputs_for(self, tick):
+        inputs = []
+        while self.position < len(self.records) and self.records[self.position][0] <= tick:
+            record_tick, code, value = self.records[self.position]
+            if code == REPLAY_RESTART:
+                break
+            self.position += 1
+            action = decode_replay_action(code, value)
+            if action is not None:
+                inputs.append(action)
+        return inputs
+    def restart_at(self, tick):
+        while self.position < len(self.records) and self.records[self.position][1] == REPLAY_PAUSE:
+            self.position += 1
+        if self.position < len(self.records) and self.records[self.position][1] == REPLAY_RESTART:
+            self.position += 1
+            return True
+        return False
+    def finished(self, tick):
+        if self.end_tick is not None:
+            return tick >= self.end_tick
+        return self.position >= len(self.records)
+    def verify(self, state):
+        actual = (state.total_score + state.level_score, state.level, state.bumper_hits, state.bumper_crc)
+        return self.expected is None or actual == tuple(self.expected), actual
+
+def flipper_image_atlas(original_image, side):
+    return RotationAtlas(lambda angle: pygame.transform.rotate(original_image, angle), FLIPPER_ANGLE_UP[side])
+
+class Flipper(pygame.sprite.Sprite):
+    def __init__(self, body, image_atlas):
+        super().__init__()
+        self.body = body
+        self.image_atlas = image_atlas
+        self.angle = None
+        self.image = None
+        self.rect = None
+        self.update()
+    def update(self):
+        if self.angle != self.body.shape_angle:
+            self.image = self.image_atlas.get(self.body.shape_angle)
+            self.angle = self.body.shape_angle
+        self.rect = self.body.rect
+
+class Hole(pygame.sprite.Sprite):
+    surface_cache = {}
+    def __init__(self, body, hole_surf=None):
+        super().__init__()
+        self.body = body
+        self.original_surf = hole_surf
+        self.width = None
+        self.image = None
+        self.rect = None
+        self.update()
+    def _update_surface(self, w,h):
+        key = (self.original_surf, w, h)
+        if key in Hole.surface_cache:
+            self.image = Hole.surface_cache[key]
+            return
+        if self.original_surf:
+            self.image = pygame.transform.scale(self.original_surf, (w,h))
+        else:
+            surf = pygame.Surface((w,h), pygame.SRCALPHA)
+            pygame.draw.rect(surf, (0,255,0,50), (0,0,w,h), border_radius=10)
+            self.image = surf
+        Hole.surface_cache[key] = self.image
+    def update(self):
+        if self.width != self.body.width:
+            self._update_surface(self.body.width, self.body.height)
+            self.width = self.body.width
+        self.rect = self.body.rect
+
+class Bumper(pygame.sprite.Sprite):
+    def __init__(self, body, surf):
+        super().__init__()
+        self.body = body
+        self.image = surf
+        self.rect = body.rect
+
+class Ball(pygame.sprite.Sprite):
+    def __init__(self, body, ball_surf):
+        super().__init__()
+        self.image = ball_surf
+        self.body = None
+        self.rect = None
+        self.set_body(body)
+    def set_body(self, body):
+        self.body = body
+        self.rect = self.image.get_rect(center=body.rect.center)
+    def update(self, alpha):
+        pos = self.body.prev_pos.lerp(self.body.pos, max(0.0, min(1.0, alpha)))
+        self.rect.center = (int(pos.x), int(pos.y))
 
 def make_pre_darkened_copy(original, brightness):
     if original is None:
@@ -484,186 +2350,749 @@ def make_pre_darkened_copy(original, brightness):
     copy_surf.blit(overlay, (0,0))
     return copy_surf
 
+class TextCache:
+    def __init__(self, max_items=256):
+        self.max_items = max_items
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    def render(self, font, text, color, antialias=True):
+        key = (font, text, tuple(color), antialias)
+        surf = self.cache.get(key)
+        if surf is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return surf
+        self.misses += 1
+        surf = font.render(text, antialias, color)
+        self.cache[key] = surf
+        if len(self.cache) > self.max_items:
+            self.cache.popitem(last=False)
+        return surf
+    def render_number(self, font, prefix, value, color, suffix=""):
+        key = (font, prefix, value, suffix, tuple(color))
+        surf = self.cache.get(key)
+        if surf is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return surf
+        parts = [self.render(font, prefix, color)]
+        for ch in str(value):
+            parts.append(self.render(font, ch, color))
+        if suffix:
+            parts.append(self.render(font, suffix, color))
+        surf = pygame.Surface((sum(p.get_width() for p in parts), max(p.get_height() for p in parts)), pygame.SRCALPHA)
+        x = 0
+        for part in parts:
+            surf.blit(part, (x, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            x += part.get_width()
+        self.cache[key] = surf
+        if len(self.cache) > self.max_items:
+            self.cache.popitem(last=False)
+        return surf
+
+TEXT_CACHE = TextCache()
+
+class DamageTracker:
+    def __init__(self):
+        self.rects = []
+        self.previous = {}
+        self.full = True
+        self.pixels_redrawn = 0
+        self.total_pixels_redrawn = 0
+        self.frames = 0
+    def reset(self):
+        self.rects = []
+        self.previous = {}
+        self.full = True
+    def invalidate(self):
+        self.full = True
+    def add(self, rect):
+        self.rects.append(pygame.Rect(rect))
+    def track(self, key, rect, content=None):
+        old = self.previous.get(key)
+        if old is None or old[0] != rect or old[1] != content:
+            if old is not None:
+                self.rects.append(old[0])
+            if rect is not None:
+                self.rects.append(pygame.Rect(rect))
+        if rect is None:
+            self.previous.pop(key, None)
+        else:
+            self.previous[key] = (pygame.Rect(rect), content)
+    def collect(self, bounds):
+        self.frames += 1
+        if self.full:
+            self.full = False
+            self.rects = []
+            self.pixels_redrawn = bounds.width * bounds.height
+            self.total_pixels_redrawn += self.pixels_redrawn
+            return None
+        merged = []
+        for rect in self.rects:
+            rect = rect.clip(bounds)
+            if rect.width == 0 or rect.height == 0:
+                continue
+            i = rect.collidelist(merged)
+            while i != -1:
+                rect.union_ip(merged.pop(i))
+                i = rect.collidelist(merged)
+            merged.append(rect)
+        self.rects = []
+        self.pixels_redrawn = sum(r.width * r.height for r in merged)
+        self.total_pixels_redrawn += self.pixels_redrawn
+        if self.frames % 300 == 0:
+            debug_print("Dirty rects: " + str(self.pixels_redrawn) + " px this frame, avg " + str(self.total_pixels_redrawn // self.frames) + " px/frame")
+        return merged
+
+class FrameTimer:
+    def __init__(self, enabled=False, samples=FRAME_TIMER_SAMPLES):
+        self.enabled = enabled
+        self.samples = samples
+        self.buffers = OrderedDict()
+        self.current = {}
+        self.frames = 0
+        self.dropped = 0
+        self.histogram = [0] * (FRAME_HISTOGRAM_BUCKETS + 1)
+        self.frame_start = 0.0
+        self.last = 0.0
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if self.frame_start:
+            self._finish_frame(now)
+        self.frame_start = now
+        self.last = now
+    def set_enabled(self, enabled):
+        if enabled == self.enabled:
+            return
+        self.enabled = enabled
+        # Laps taken before the next begin_frame() belong to no frame.
+        self.frame_start = 0.0
+        self.last = 0.0
+        self.current = {}
+    def skip_frame(self):
+        self.frame_start = 0.0
+        self.current = {}
+    def lap(self, name):
+        if not self.enabled or not self.frame_start:
+            return
+        now = time.perf_counter()
+        self.current[name] = self.current.get(name, 0.0) + (now - self.last)
+        self.last = now
+    def _finish_frame(self, now):
+        total = now - self.frame_start
+        self.current["frame"] = total
+        slot = self.frames % self.samples
+        for name in self.current:
+            if name not in self.buffers:
+                self.buffers[name] = array.array("d", [0.0]) * self.samples
+        for name, buf in self.buffers.items():
+            buf[slot] = self.current.get(name, 0.0) * 1000
+        self.frames += 1
+        if total > FRAME_DROP_FACTOR / FPS:
+            self.dropped += 1
+        bucket = int(total * 1000 / FRAME_HISTOGRAM_BUCKET_MS)
+        self.histogram[min(bucket, FRAME_HISTOGRAM_BUCKETS)] += 1
+        self.current = {}
+    def percentiles(self, name):
+        n = min(self.frames, self.samples)
+        if n == 0:
+            return 0.0, 0.0, 0.0
+        values = sorted(self.buffers[name][:n])
+        return tuple(values[min(n - 1, int(q * n))] for q in (0.50, 0.95, 0.99))
+    def overlay_rows(self):
+        rows = [["section", "p50", "p95", "p99 ms"]]
+        for name in self.buffers:
+            rows.append([name] + ["%.2f" % v for v in self.percentiles(name)])
+        rows.append(["frames " + str(self.frames), "", "dropped", str(self.dropped)])
+        return rows
+    def render_overlay(self, font, extra_rows=()):
+        rendered = [[font.render(cell, True, (255,255,0)) for cell in row] for row in self.overlay_rows() + list(extra_rows)]
+        column_widths = [max(row[i].get_width() for row in rendered) + 12 for i in range(4)]
+        line_height = font.get_linesize()
+        surf = pygame.Surface((sum(column_widths) + 12, line_height * len(rendered) + 12), pygame.SRCALPHA)
+        surf.fill((0,0,0,180))
+        for r, row in enumerate(rendered):
+            x = 6
+            for i, cell in enumerate(row):
+                if i == 0:
+                    surf.blit(cell, (x, 6 + r * line_height))
+                else:
+                    surf.blit(cell, (x + column_widths[i] - 12 - cell.get_width(), 6 + r * line_height))
+                x += column_widths[i]
+        return surf
+    def summary(self):
+        sections = {}
+        for name in self.buffers:
+            p50, p95, p99 = self.percentiles(name)
+            sections[name] = {"p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+        return {"frames": self.frames, "dropped": self.dropped, "bucket_ms": FRAME_HISTOGRAM_BUCKET_MS,
+                "histogram": self.histogram, "sections": sections}
+    def dump(self, path):
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                if path.lower().endswith(".json"):
+                    json.dump(self.summary(), f, indent=2)
+                else:
+                    f.write("frame_ms_from,frame_ms_to,frames\n")
+                    for i, count in enumerate(self.histogram):
+                        upper = str((i + 1) * FRAME_HISTOGRAM_BUCKET_MS) if i < FRAME_HISTOGRAM_BUCKETS else "inf"
+                        f.write(str(i * FRAME_HISTOGRAM_BUCKET_MS) + "," + upper + "," + str(count) + "\n")
+            debug_print("Frame-time histogram written to " + path)
+        except OSError as e:
+            debug_print("Could not write frame-time histogram: " + str(e))
+
+FRAME_TIMER = FrameTimer(FRAME_TIMES_MODE)
+
+class BackgroundCompositor:
+    def __init__(self):
+        self.source = None
+        self.size = None
+        self.scaled_source = None
+        self.brightness = None
+        self.surface = None
+        self.rebuild_count = 0
+    def invalidate(self):
+        self.source = None
+        self.scaled_source = None
+        self.surface = None
+    def get(self, source, brightness):
+        if source is None:
+            return None
+        size = (SCREEN_WIDTH, SCREEN_HEIGHT)
+        if source is not self.source or size != self.size or self.scaled_source is None:
+            self.scaled_source = pygame.transform.scale(source, size).convert()
+            self.source = source
+            self.size = size
+            self.surface = None
+        if self.surface is None or brightness != self.brightness:
+            self.surface = make_pre_darkened_copy(self.scaled_source, brightness)
+            self.brightness = brightness
+            self.rebuild_count += 1
+            debug_print("Background rebuilt (" + str(size[0]) + "x" + str(size[1]) + ", brightness=" + str(brightness) + ")")
+        return self.surface
+
+class HueKeyframes:
+    def __init__(self, step=HUE_SHIFT_STEP, max_resident=HUE_KEYFRAME_MAX_RESIDENT):
+        self.step = step
+        self.max_resident = max(2, max_resident)
+        self.source = None
+        self.size = None
+        self.scaled_source = None
+        self.generation = 0
+        self.frames = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.output = None
+        self.output_key = None
+        self.shade = None
+        self.builds = 0
+        self.evictions = 0
+        self.rebuild_count = 0
+    def set_source(self, source, hues=()):
+        size = (SCREEN_WIDTH, SCREEN_HEIGHT)
+        if source is self.source and size == self.size:
+            return
+        with self.lock:
+            self.generation += 1
+            self.frames.clear()
+            self.pending.clear()
+        self.source = source
+        self.size = size
+        self.scaled_source = pygame.transform.scale(source, size)
+        self.output = pygame.Surface(size).convert()
+        self.output_key = None
+        self.shade = pygame.Surface(size).convert()
+        self.shade.fill((0,0,0))
+        # Start the given hues and the steps after the last one, up to max_resident, right away.
+        wanted = []
+        for hue in hues:
+            if hue % 360 not in wanted:
+                wanted.append(hue % 360)
+        while wanted and len(wanted) < self.max_resident:
+            hue = (wanted[-1] + self.step) % 360
+            if hue in wanted:
+                break
+            wanted.append(hue)
+        for hue in wanted:
+            self.prefetch(hue)
+    def _build_worker(self, hue, generation, done):
+        frame = safe_shift_surface_hue(self.scaled_source, hue).convert()
+        with self.lock:
+            if generation == self.generation:
+                self.frames[hue] = frame
+                self.builds += 1
+                while len(self.frames) > self.max_resident:
+                    old_hue, _ = self.frames.popitem(last=False)
+                    self.evictions += 1
+                    debug_print("Evicted hue keyframe " + str(old_hue))
+                self.pending.pop(hue, None)
+        done.set()
+    def prefetch(self, hue):
+        hue = hue % 360
+        with self.lock:
+            if hue in self.frames or hue in self.pending:
+                return
+            done = threading.Event()
+            self.pending[hue] = done
+            generation = self.generation
+        threading.Thread(target=self._build_worker, args=(hue, generation, done), daemon=True).start()
+    def get(self, hue):
+        hue = hue % 360
+        with self.lock:
+            frame = self.frames.get(hue)
+            if frame is not None:
+                self.frames.move_to_end(hue)
+        if frame is None:
+            self.prefetch(hue)
+        return frame
+    def wait(self, hue=None):
+        with self.lock:
+            if hue is None:
+                pending = list(self.pending.values())
+            else:
+                pending = [self.pending[hue % 360]] if hue % 360 in self.pending else []
+        for done in pending:
+            done.wait()
+    def compose(self, old_hue, new_hue, alpha, brightness):
+        old_frame = self.get(old_hue)
+        if old_frame is None:
+            # The on-screen keyframe is missing only right after set_source(); wait for it
+            # rather than flashing the unshifted background.
+            self.wait(old_hue)
+            old_frame = self.get(old_hue)
+        new_frame = self.get(new_hue)
+        if self.max_resident > 2:
+            self.prefetch(new_hue + self.step)
+        if old_frame is None:
+            old_frame = new_frame or self.scaled_source
+        if new_frame is None:
+            new_frame = old_frame
+        blend = int(alpha * HUE_CROSSFADE_LEVELS) * 255 // HUE_CROSSFADE_LEVELS if new_frame is not old_frame else 0
+        shade = 0 if brightness >= 1.0 else int((1.0 - brightness)*255)
+        key = (old_frame, new_frame, blend, shade)
+        if key == self.output_key:
+            return self.output
+        self.output.blit(old_frame, (0,0))
+        if blend:
+            new_frame.set_alpha(blend)
+            self.output.blit(new_frame, (0,0))
+            new_frame.set_alpha(None)
+        if shade:
+            self.shade.set_alpha(shade)
+            self.output.blit(self.shade, (0,0))
+        self.output_key = key
+        self.rebuild_count += 1
+        return self.output
+    def stats_line(self):
+        return ("Hue keyframes: builds=" + str(self.builds) + " evictions=" + str(self.evictions)
+                + " resident=" + str(len(self.frames)) + "/" + str(self.max_resident) + " composes=" + str(self.rebuild_count))
+
+class UILayers:
+    buttons = {
+        "options": ((180,180,180), ("Options",), None),
+        "orgon": ((150,220,150), ("Orgon", "Akkumulator"), 5),
+        "repulsine": ((150,150,220), ("Repulsine",), None),
+    }
+    def __init__(self, font):
+        self.font = font
+        self.size = None
+        self.rects = {}
+        self.faces = {}
+        self.backdrop = None
+        self.corner_source = None
+        self.corner_blits = []
+        self.rebuild_count = 0
+    def layout(self, size, rects):
+        if size == self.size and rects == self.rects:
+            return
+        self.size = size
+        self.rects = dict(rects)
+        self.faces = {}
+        for name, rect in self.rects.items():
+            self.faces[(name, "VISIBLE")] = (self._build_face(name, rect), rect.topleft)
+            self.faces[(name, "HIDDEN")] = None
+        self.backdrop = pygame.Surface(size).convert()
+        self.backdrop.fill((50,50,50))
+        self.backdrop.set_alpha(200)
+        self.corner_source = None
+        self.rebuild_count += 1
+        debug_print("UI layers rebuilt (" + str(size[0]) + "x" + str(size[1]) + ")")
+    def _build_face(self, name, rect):
+        color, lines, top = UILayers.buttons[name]
+        face = pygame.Surface(rect.size, pygame.SRCALPHA)
+        pygame.draw.rect(face, color, face.get_rect(), border_radius=8)
+        texts = [TEXT_CACHE.render(self.font, line, (0,0,0)) for line in lines]
+        y = top if top is not None else rect.height/2 - sum(t.get_height() for t in texts)/2
+        for text in texts:
+            face.blit(text, (rect.width/2 - text.get_width()/2, y))
+            y += text.get_height()
+        return face.convert_alpha()
+    def corners(self, corner_surf, hole_positions):
+        if hole_positions is not self.corner_source:
+            sorted_positions = sorted(hole_positions, key=lambda p: p[0])
+            self.corner_blits = []
+            for i in range(len(sorted_positions)-1):
+                mid_x = (sorted_positions[i][0]+sorted_positions[i+1][0])//2
+                self.corner_blits.append((corner_surf, corner_surf.get_rect(midtop=(mid_x, self.size[1] - 80))))
+            self.corner_source = hole_positions
+        return self.corner_blits
+    def face(self, name, button_state="VISIBLE"):
+        return self.faces[(name, button_state)]
+
+def parse_render_scale(value, native_w, native_h):
+    try:
+        if "x" in value.lower():
+            w, h = (int(v) for v in value.lower().split("x"))
+        else:
+            factor = float(value)
+            w, h = int(native_w * factor), int(native_h * factor)
+    except ValueError:
+        debug_print("Invalid -renderscale " + value + " => rendering at native resolution.")
+        return native_w, native_h
+    if w <= 0 or h <= 0:
+        return native_w, native_h
+    return min(w, native_w), min(h, native_h)
+
+class RenderTarget:
+    def __init__(self, display_size, logical_size, flags=0):
+        self.logical_size = tuple(logical_size)
+        self.mode = "native"
+        self.window = None
+        if self.logical_size != tuple(display_size):
+            try:
+                self.window = pygame.display.set_mode(self.logical_size, flags | pygame.SCALED)
+                if pygame.display.get_window_size() != self.logical_size:
+                    self.mode = "scaled"
+            except pygame.error as e:
+                debug_print("pygame.SCALED unavailable: " + str(e))
+            if self.mode != "scaled":
+                self.mode = "software"
+        if self.mode == "software" or self.window is None:
+            self.window = pygame.display.set_mode(display_size, flags)
+        if self.mode == "software":
+            self.canvas = pygame.Surface(self.logical_size, 0, self.window)
+        else:
+            self.canvas = self.window
+    def to_logical(self, pos):
+        if self.mode != "software":
+            return pos
+        ww, wh = self.window.get_size()
+        return (pos[0] * self.logical_size[0] // ww, pos[1] * self.logical_size[1] // wh)
+    def mouse_pos(self):
+        return self.to_logical(pygame.mouse.get_pos())
+    def to_window(self, rect):
+        ww, wh = self.window.get_size()
+        lw, lh = self.logical_size
+        left = rect.left * ww // lw
+        top = rect.top * wh // lh
+        return pygame.Rect(left, top, -(-rect.right * ww // lw) - left, -(-rect.bottom * wh // lh) - top)
+    def present(self, rects=None):
+        if self.mode != "software":
+            if rects is None:
+                pygame.display.flip()
+            else:
+                pygame.display.update(rects)
+            return
+        if rects is None:
+            pygame.transform.scale(self.canvas, self.window.get_size(), self.window)
+            pygame.display.flip()
+            return
+        updated = []
+        for rect in rects:
+            rect = rect.clip(self.canvas.get_rect())
+            if rect.width and rect.height:
+                dest = self.to_window(rect)
+                pygame.transform.scale(self.canvas.subsurface(rect), dest.size, self.window.subsurface(dest))
+                updated.append(dest)
+        pygame.display.update(updated)
+
+def draw_scene(screen, state, layers, background, sprite_groups, ball_group, fonts, sliders,
+               corner_surf=None, hole_positions=(), aim_preview=None, overlay=None):
+    font_small, font_big = fonts
+    brightness_slider_rect, music_slider_rect = sliders
+    if background:
+        screen.blit(background,(0,0))
+    else:
+        screen.fill((0,0,0))
+    FRAME_TIMER.lap("draw bg")
+    for group in sprite_groups:
+        group.draw(screen)
+    if corner_surf:
+        screen.blits(layers.corners(corner_surf, hole_positions), doreturn=False)
+    ball_group.draw(screen)
+    if aim_preview:
+        aim_preview.draw(screen)
+    FRAME_TIMER.lap("sprites")
+    state.wind.draw(screen)
+    screen.blit(TEXT_CACHE.render_number(font_small, "Level: ", state.level, (255,255,255)), (10,10))
+    screen.blit(TEXT_CACHE.render_number(font_small, "Shots left: ", state.shots_left, (255,255,255)), (10,40))
+    screen.blit(TEXT_CACHE.render_number(font_small, "Score: ", state.total_score+state.level_score, (255,255,255)), (10,70))
+    screen.blit(*layers.face("options"))
+    if not NOSPOON_MODE:
+        orgon_face = layers.face("orgon", state.orgon_button_state)
+        if orgon_face:
+            screen.blit(*orgon_face)
+        repulsine_face = layers.face("repulsine", state.repulsine_button_state)
+        if repulsine_face:
+            screen.blit(*repulsine_face)
+    if SHOW_OPTIONS:
+        screen.blit(layers.backdrop, (0,0))
+        menu_title = TEXT_CACHE.render(font_big, "OPTIONS", (255,255,255))
+        screen.blit(menu_title, (SCREEN_WIDTH//2 - menu_title.get_width()//2, SCREEN_HEIGHT//2 - 100))
+        pygame.draw.rect(screen, (200,200,200), brightness_slider_rect)
+        fill_w = int(brightness_slider_rect.width * BRIGHTNESS)
+        fill_rect = pygame.Rect(brightness_slider_rect.x, brightness_slider_rect.y, fill_w, brightness_slider_rect.height)
+        pygame.draw.rect(screen, (0,255,0), fill_rect)
+        bri_label = TEXT_CACHE.render_number(font_small, "Brightness: ", int(BRIGHTNESS*100), (255,255,255), "%")
+        screen.blit(bri_label, (brightness_slider_rect.centerx - bri_label.get_width()//2, brightness_slider_rect.y - 25))
+        pygame.draw.rect(screen, (200,200,200), music_slider_rect)
+        fill_w2 = int(music_slider_rect.width * MUSIC_VOLUME)
+        fill2_rect = pygame.Rect(music_slider_rect.x, music_slider_rect.y, fill_w2, music_slider_rect.height)
+        pygame.draw.rect(screen, (0,255,0), fill2_rect)
+        vol_label = TEXT_CACHE.render_number(font_small, "Music Volume: ", int(MUSIC_VOLUME*100), (255,255,255), "%")
+        screen.blit(vol_label, (music_slider_rect.centerx - vol_label.get_width()//2, music_slider_rect.y - 25))
+    if overlay:
+        screen.blit(overlay, overlay.get_rect(topright=(SCREEN_WIDTH - 10, 10)))
+    FRAME_TIMER.lap("hud")
+
 def main():
     again = True
     while again:
         debug_print("Starting new main loop iteration.")
-        ensure_data_folder()
-        try:
-            pygame.mixer.pre_init(44100, -16, 1)
-            pygame.init()
-            pygame.mixer.init()
-            debug_print("Pygame and mixer initialized successfully.")
-        except Exception as e:
-            debug_print("Error initializing Pygame or mixer: " + str(e))
-            sys.exit(1)
-        info = pygame.display.Info()
-        global SCREEN_WIDTH, SCREEN_HEIGHT
-        SCREEN_WIDTH = info.current_w
-        SCREEN_HEIGHT = info.current_h
-        debug_print("Detected screen size: " + str(SCREEN_WIDTH) + "x" + str(SCREEN_HEIGHT))
-        try:
-            screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.FULLSCREEN)
-        except Exception as e:
-            debug_print("Error setting fullscreen mode: " + str(e))
-            sys.exit(1)
-        pygame.display.set_caption("OpenSource-Pinball-like-Game")
-        clock = pygame.time.Clock()
-        global FONT_NAME
-        FONT_NAME = pygame.font.get_default_font()
-        font_big = pygame.font.SysFont(FONT_NAME, 60)
-        font_small = pygame.font.SysFont(FONT_NAME, 30)
-        load_music_files_from_data()
-        load_all_background_images()
-        check_and_play_music()
-        data_dir = os.path.join(os.getcwd(), "data")
-        original_background_surf = None
-        if os.path.exists(os.path.join(data_dir, "background.png")):
+        with STARTUP_PROFILE.phase("ensure_data_folder"):
+            ensure_data_folder()
+        with STARTUP_PROFILE.phase("pygame.init"):
             try:
-                original_background_surf = pygame.image.load(os.path.join(data_dir, "background.png")).convert_alpha()
-                debug_print("Loaded background.png successfully.")
+                pygame.mixer.pre_init(44100, -16, 1)
+                pygame.init()
+                pygame.mixer.init()
+                AUDIO.setup()
+                debug_print("Pygame and mixer initialized successfully.")
             except Exception as e:
-                debug_print("Error loading background.png: " + str(e))
-        else:
-            debug_print("No background.png found. Using plain color fill.")
-        if os.path.exists(os.path.join(data_dir, "bumper.png")):
+                debug_print("Error initializing Pygame or mixer: " + str(e))
+                sys.exit(1)
+        replay_player = None
+        seed = int(SEED_ARG) if SEED_ARG else None
+        if REPLAY_FILE:
             try:
-                bumper_surf, bumper_mask, _ = load_image_with_mask(os.path.join(data_dir, "bumper.png"))
-                debug_print("Loaded bumper.png successfully.")
+                replay_player = ReplayPlayer(REPLAY_FILE)
             except Exception as e:
-                debug_print("Error loading bumper.png: " + str(e))
-                bumper_surf, bumper_mask = get_alpha_mask_circle(20, color=(255,100,100))
-        else:
-            debug_print("No bumper.png found. Using fallback circle for bumpers.")
-            bumper_surf, bumper_mask = get_alpha_mask_circle(20, color=(255,100,100))
-        if os.path.exists(os.path.join(data_dir, "ball.png")):
+                print("Could not load replay " + REPLAY_FILE + ": " + str(e))
+                sys.exit(1)
+            replay_player.apply_settings()
+            seed = replay_player.seed
+        with STARTUP_PROFILE.phase("display"):
+            info = pygame.display.Info()
+            global SCREEN_WIDTH, SCREEN_HEIGHT
+            SCREEN_WIDTH = info.current_w
+            SCREEN_HEIGHT = info.current_h
+            debug_print("Detected screen size: " + str(SCREEN_WIDTH) + "x" + str(SCREEN_HEIGHT))
+            display_flags = pygame.FULLSCREEN
+            display_size = (SCREEN_WIDTH, SCREEN_HEIGHT)
+            if replay_player is not None:
+                SCREEN_WIDTH, SCREEN_HEIGHT = replay_player.width, replay_player.height
+                display_flags = 0
+                display_size = (SCREEN_WIDTH, SCREEN_HEIGHT)
+            elif RENDER_SCALE_ARG:
+                SCREEN_WIDTH, SCREEN_HEIGHT = parse_render_scale(RENDER_SCALE_ARG, SCREEN_WIDTH, SCREEN_HEIGHT)
             try:
-                ball_surf, ball_mask, _ = load_image_with_mask(os.path.join(data_dir, "ball.png"))
-                debug_print("Loaded ball.png successfully.")
+                target = RenderTarget(display_size, (SCREEN_WIDTH, SCREEN_HEIGHT), display_flags)
             except Exception as e:
-                debug_print("Error loading ball.png: " + str(e))
+                debug_print("Error setting fullscreen mode: " + str(e))
+                sys.exit(1)
+            screen = target.canvas
+            debug_print("Rendering at " + str(SCREEN_WIDTH) + "x" + str(SCREEN_HEIGHT) + " (" + target.mode + ")")
+            pygame.display.set_caption("OpenSource-Pinball-like-Game")
+        clock = pygame.time.Clock()
+        data_dir = os.path.join(os.getcwd(), "data")
+        global ASSET_BUNDLE
+        with STARTUP_PROFILE.phase("asset bundle"):
+            if ASSET_BUNDLE is None:
+                ASSET_BUNDLE = open_asset_bundle(data_dir)
+        pipeline = StartupPipeline(STARTUP_WORKERS)
+        pipeline.submit("music scan", load_music_files_from_data)
+        pipeline.submit("background index", index_background_images)
+        for name in STARTUP_IMAGE_NAMES:
+            pipeline.submit(name, decode_asset_image, os.path.join(data_dir, name), name != "background.png" and name != "corner.png")
+        pipeline.submit("sound bank", build_sound_bank, data_dir, SOUND_PITCH_STEPS)
+        global FONT_NAME
+        with STARTUP_PROFILE.phase("fonts"):
+            FONT_NAME = pygame.font.get_default_font()
+            font_big = pygame.font.SysFont(FONT_NAME, 60)
+            font_small = pygame.font.SysFont(FONT_NAME, 30)
+        global SCORE_STORE
+        with STARTUP_PROFILE.phase("score store"):
+            if SCORE_STORE is None and replay_player is None:
+                SCORE_STORE = open_score_store()
+        with STARTUP_PROFILE.phase("asset jobs"):
+            pipeline.wait(lambda done, total: draw_loading_screen(target, font_small, done, total))
+        global BG_STORE
+        with STARTUP_PROFILE.phase("background index"):
+            BG_STORE = BackgroundStore(pipeline.result("background index"))
+        with STARTUP_PROFILE.phase("music start"):
+            pipeline.result("music scan")
+            AUDIO.start_music(MUSIC_FILES)
+        with STARTUP_PROFILE.phase("background.png"):
+            original_background_surf = None
+            if os.path.exists(os.path.join(data_dir, "background.png")):
+                try:
+                    original_background_surf = finish_asset_image(pipeline, os.path.join(data_dir, "background.png"))[0]
+                    debug_print("Loaded background.png successfully.")
+                except Exception as e:
+                    debug_print("Error loading background.png: " + str(e))
+            else:
+                debug_print("No background.png found. Using plain color fill.")
+        with STARTUP_PROFILE.phase("sprites and masks"):
+            if os.path.exists(os.path.join(data_dir, "bumper.png")):
+                try:
+                    bumper_surf, bumper_mask = finish_asset_image(pipeline, os.path.join(data_dir, "bumper.png"))
+                    debug_print("Loaded bumper.png successfully.")
+                except Exception as e:
+                    debug_print("Error loading bumper.png: " + str(e))
+                    bumper_surf, bumper_mask = get_alpha_mask_circle(20, color=(255,100,100))
+            else:
+                debug_print("No bumper.png found. Using fallback circle for bumpers.")
+                bumper_surf, bumper_mask = get_alpha_mask_circle(20, color=(255,100,100))
+            if os.path.exists(os.path.join(data_dir, "ball.png")):
+                try:
+                    ball_surf, ball_mask = finish_asset_image(pipeline, os.path.join(data_dir, "ball.png"))
+                    debug_print("Loaded ball.png successfully.")
+                except Exception as e:
+                    debug_print("Error loading ball.png: " + str(e))
+                    ball_surf, ball_mask = get_alpha_mask_circle(10, color=(120,120,120))
+            else:
+                debug_print("No ball.png found. Using fallback circle for ball.")
                 ball_surf, ball_mask = get_alpha_mask_circle(10, color=(120,120,120))
-        else:
-            debug_print("No ball.png found. Using fallback circle for ball.")
-            ball_surf, ball_mask = get_alpha_mask_circle(10, color=(120,120,120))
-        hole_surf = None
-        hole_mask = None
-        if os.path.exists(os.path.join(data_dir, "hole.png")):
-            try:
-                hole_surf, hole_mask, _ = load_image_with_mask(os.path.join(data_dir, "hole.png"))
-                debug_print("Loaded hole.png successfully.")
-            except Exception as e:
-                debug_print("Error loading hole.png: " + str(e))
-                hole_surf = None
-                hole_mask = None
-        else:
-            debug_print("No hole.png found. Will use fallback rect for holes.")
-        corner_surf = None
-        if os.path.exists(os.path.join(data_dir, "corner.png")):
-            try:
-                corner_surf = pygame.image.load(os.path.join(data_dir, "corner.png")).convert_alpha()
-                debug_print("Loaded corner.png successfully.")
-            except Exception as e:
-                debug_print("Error loading corner.png: " + str(e))
-        holes_group = pygame.sprite.Group()
-        flipper_group = pygame.sprite.Group()
-        gap = SCREEN_WIDTH // (HOLES_COUNT+1)
-        hole_width = 80
-        hole_height = 30
-        hole_positions = []
-        for i in range(HOLES_COUNT):
-            pos_x = (i+1)*gap
-            pos_y = SCREEN_HEIGHT - 80
-            hole_obj = Hole((pos_x, pos_y), hole_width, hole_height, hole_surf, hole_mask)
-            holes_group.add(hole_obj)
-            hole_positions.append((pos_x, pos_y))
-            lf_pivot = (pos_x - hole_width//2, pos_y+10)
-            left_flipper = Flipper("left", lf_pivot, length=60)
-            flipper_group.add(left_flipper)
-            rf_pivot = (pos_x + hole_width//2, pos_y+10)
-            right_flipper = Flipper("right", rf_pivot, length=60)
-            flipper_group.add(right_flipper)
+            hole_surf = None
+            hole_mask = None
+            if os.path.exists(os.path.join(data_dir, "hole.png")):
+                try:
+                    hole_surf, hole_mask = finish_asset_image(pipeline, os.path.join(data_dir, "hole.png"))
+                    debug_print("Loaded hole.png successfully.")
+                except Exception as e:
+                    debug_print("Error loading hole.png: " + str(e))
+                    hole_surf = None
+                    hole_mask = None
+            else:
+                debug_print("No hole.png found. Will use fallback rect for holes.")
+            corner_surf = None
+            if os.path.exists(os.path.join(data_dir, "corner.png")):
+                try:
+                    corner_surf = finish_asset_image(pipeline, os.path.join(data_dir, "corner.png"))[0]
+                    debug_print("Loaded corner.png successfully.")
+                except Exception as e:
+                    debug_print("Error loading corner.png: " + str(e))
         global bounce_sounds, bounce_index, border_sound, panel_sound, button_sound
-        bounce_sounds = []
-        bounce_index = 0
-        bumper_wav = os.path.join(data_dir,"bumper.wav")
-        pitch_steps = 15
-        if os.path.exists(bumper_wav):
-            debug_print("Found bumper.wav. Attempting pitch shifts up to " + str(pitch_steps))
-            tested_pitch_shift = pitch_shift_wav(bumper_wav, 0.0)
-            if tested_pitch_shift is not None:
+        with STARTUP_PROFILE.phase("sound bank"):
+            bounce_sounds = []
+            bounce_index = 0
+            bumper_wav = os.path.join(data_dir,"bumper.wav")
+            pitch_steps = SOUND_PITCH_STEPS
+            sound_bank = pipeline.result("sound bank")
+            if sound_bank is not None and sound_bank["bounce"]:
+                bounce_sounds = [pygame.mixer.Sound(buffer=pcm) for pcm in sound_bank["bounce"]]
+            elif os.path.exists(bumper_wav):
+                debug_print("Found bumper.wav. Attempting pitch shifts up to " + str(pitch_steps))
+                tested_pitch_shift = pitch_shift_wav(bumper_wav, 0.0)
+                if tested_pitch_shift is not None:
+                    for i in range(pitch_steps):
+                        raw_data = pitch_shift_wav(bumper_wav, i*0.35)
+                        if raw_data is not None:
+                            s = pygame.mixer.Sound(buffer=raw_data)
+                            bounce_sounds.append(s)
+                        else:
+                            one_sound = pygame.mixer.Sound(bumper_wav)
+                            bounce_sounds.append(one_sound)
+                else:
+                    debug_print("Pitch shift unavailable. Using non-shifted bumper.wav repeatedly.")
+                    one_sound = pygame.mixer.Sound(bumper_wav)
+                    bounce_sounds = [one_sound]*pitch_steps
+            else:
+                debug_print("No bumper.wav found. Generating sine waves.")
+                base_freq = 220
                 for i in range(pitch_steps):
-                    raw_data = pitch_shift_wav(bumper_wav, i*0.35)
-                    if raw_data is not None:
-                        s = pygame.mixer.Sound(buffer=raw_data)
-                        bounce_sounds.append(s)
-                    else:
-                        one_sound = pygame.mixer.Sound(bumper_wav)
-                        bounce_sounds.append(one_sound)
+                    freq = base_freq*(1.04**i)
+                    s = create_sine_wave(freq,200,0.3)
+                    bounce_sounds.append(s)
+            if not bounce_sounds:
+                debug_print("No bounce sounds => adding fallback sine wave.")
+                bounce_sounds.append(create_sine_wave(220,200,0.3))
+            border_sound = None
+            border_wav = os.path.join(data_dir,"border.wav")
+            if os.path.exists(border_wav):
+                try:
+                    border_sound = pygame.mixer.Sound(border_wav)
+                    debug_print("border.wav loaded.")
+                except Exception as e:
+                    debug_print("Failed to load border.wav: " + str(e))
+                    border_sound = fallback_tone(sound_bank, "border", 80,150,0.4)
             else:
-                debug_print("Pitch shift unavailable. Using non-shifted bumper.wav repeatedly.")
-                one_sound = pygame.mixer.Sound(bumper_wav)
-                bounce_sounds = [one_sound]*pitch_steps
-        else:
-            debug_print("No bumper.wav found. Generating sine waves.")
-            base_freq = 220
-            for i in range(pitch_steps):
-                freq = base_freq*(1.04**i)
-                s = create_sine_wave(freq,200,0.3)
-                bounce_sounds.append(s)
-        if not bounce_sounds:
-            debug_print("No bounce sounds => adding fallback sine wave.")
-            bounce_sounds.append(create_sine_wave(220,200,0.3))
-        border_sound = None
-        border_wav = os.path.join(data_dir,"border.wav")
-        if os.path.exists(border_wav):
-            try:
-                border_sound = pygame.mixer.Sound(border_wav)
-                debug_print("border.wav loaded.")
-            except Exception as e:
-                debug_print("Failed to load border.wav: " + str(e))
-                border_sound = create_sine_wave(80,150,0.4)
-        else:
-            debug_print("No border.wav => fallback sine wave.")
-            border_sound = create_sine_wave(80,150,0.4)
-        panel_sound = None
-        panel_wav = os.path.join(data_dir,"panel.wav")
-        if os.path.exists(panel_wav):
-            try:
-                panel_sound = pygame.mixer.Sound(panel_wav)
-                debug_print("panel.wav loaded.")
-            except Exception as e:
-                debug_print("Failed panel.wav => fallback.")
-                panel_sound = create_sine_wave(100,200,0.4)
-        else:
-            debug_print("No panel.wav => fallback.")
-            panel_sound = create_sine_wave(100,200,0.4)
-        button_sound = None
-        button_wav = os.path.join(data_dir,"button.wav")
-        if os.path.exists(button_wav):
+                debug_print("No border.wav => fallback sine wave.")
+                border_sound = fallback_tone(sound_bank, "border", 80,150,0.4)
+            panel_sound = None
+            panel_wav = os.path.join(data_dir,"panel.wav")
+            if os.path.exists(panel_wav):
+                try:
+                    panel_sound = pygame.mixer.Sound(panel_wav)
+                    debug_print("panel.wav loaded.")
+                except Exception as e:
+                    debug_print("Failed panel.wav => fallback.")
+                    panel_sound = fallback_tone(sound_bank, "panel", 100,200,0.4)
+            else:
+                debug_print("No panel.wav => fallback.")
+                panel_sound = fallback_tone(sound_bank, "panel", 100,200,0.4)
+            button_sound = None
+            button_wav = os.path.join(data_dir,"button.wav")
+            if os.path.exists(button_wav):
+                try:
+                    button_sound = pygame.mixer.Sound(button_wav)
+                    debug_print("button.wav loaded.")
+                except Exception as e:
+                    debug_print("Failed button.wav => no button sound.")
+        with STARTUP_PROFILE.phase("flipper images"):
+            flipper_images = {}
+            flipper_masks = {}
+            for side in ("left", "right"):
+                path = os.path.join(data_dir, "panel_" + side + ".png")
+                if os.path.exists(path):
+                    flipper_images[side], flipper_masks[side] = finish_asset_image(pipeline, path)
+                else:
+                    flipper_images[side] = load_flipper_image(side)
+                    flipper_masks[side] = load_image_mask(os.path.basename(path), flipper_images[side])
+        pipeline.report()
+        with STARTUP_PROFILE.phase("collision shapes"):
+            shapes = CollisionShapes(ball_mask, bumper_mask, flipper_masks)
+        with STARTUP_PROFILE.phase("game state"):
+            level_table = None
+            if replay_player is None or replay_player.level_table:
+                level_table = load_level_table(os.path.join(data_dir, LEVEL_TABLE_FILENAME), SCREEN_WIDTH, SCREEN_HEIGHT)
+            state = GameState(SCREEN_WIDTH, SCREEN_HEIGHT, shapes, seed, level_table)
+        recorder = None
+        if RECORD_FILE and replay_player is None:
             try:
-                button_sound = pygame.mixer.Sound(button_wav)
-                debug_print("button.wav loaded.")
-            except Exception as e:
-                debug_print("Failed button.wav => no button sound.")
-        wind = Wind()
-        total_score = 0
-        level = 1
+                recorder = ReplayRecorder(RECORD_FILE, state)
+            except OSError as e:
+                debug_print("Could not open replay file: " + str(e))
+        holes_group = pygame.sprite.Group()
+        for body in state.holes:
+            holes_group.add(Hole(body, hole_surf))
+        hole_positions = [body.pos for body in state.holes]
+        with STARTUP_PROFILE.phase("flipper image atlases"):
+            flipper_image_atlases = {side: flipper_image_atlas(img, side) for side, img in flipper_images.items()}
+        flipper_group = pygame.sprite.Group()
+        for body in state.flippers:
+            flipper_group.add(Flipper(body, flipper_image_atlases[body.side]))
+        STARTUP_PROFILE.report(PROFILE_JSON)
         running = True
         color_cycle_start_time = 0.0
         old_hue = 0.0
         new_hue = HUE_SHIFT_STEP
-        next_hue_update = 0.0
-        bg_interpolated_surf = None
+        bg_compositor = BackgroundCompositor()
+        hue_keyframes = HueKeyframes()
         global IS_PAUSED, SHOW_OPTIONS, BRIGHTNESS, MUSIC_VOLUME
-        orgon_button_state = "HIDDEN"
-        orgon_button_timer = 0.0
-        repulsine_button_state = "HIDDEN"
-        repulsine_button_timer = 0.0
-        ORGON_BUTTON_VISIBLE_TIME = 30.0
-        ORGON_BUTTON_HIDDEN_TIME = 30.0
-        REPULSINE_BUTTON_VISIBLE_TIME = 20.0
-        REPULSINE_BUTTON_HIDDEN_TIME = 20.0
         orgon_button_width = 140
         orgon_button_height = 50
         repulsine_button_width = 140
@@ -673,108 +3102,128 @@ def main():
         options_button_rect = pygame.Rect(10, SCREEN_HEIGHT - 60, 140, 50)
         brightness_slider_rect = pygame.Rect(SCREEN_WIDTH//2 - 150, SCREEN_HEIGHT//2 - 30, 300, 20)
         music_slider_rect = pygame.Rect(SCREEN_WIDTH//2 - 150, SCREEN_HEIGHT//2 + 30, 300, 20)
+        ui_layers = UILayers(font_small)
+        ui_layers.layout((SCREEN_WIDTH, SCREEN_HEIGHT), {"options": options_button_rect, "orgon": orgon_button_rect, "repulsine": repulsine_button_rect})
         dragging_slider = None
+        damage = DamageTracker()
+        last_show_options = SHOW_OPTIONS
+        last_bg_rebuilds = 0
+        level_bg = None
+        show_frame_overlay = False
+        aim_preview = AimPreview()
+        show_aim_preview = AIM_PREVIEW_MODE
+        aim_visible = False
+        frame_overlay = None
+        frame_overlay_revision = 0
+        next_frame_overlay = 0.0
+        def draw_current_scene():
+            draw_scene(screen, state, ui_layers, level_bg, (bumper_group, holes_group, flipper_group), ball_group,
+                       (font_small, font_big), (brightness_slider_rect, music_slider_rect), corner_surf, hole_positions,
+                       aim_preview if aim_visible else None, frame_overlay if show_frame_overlay else None)
         while running:
-            if BG_IMAGES:
-                BG_INDEX = (level - 1) % len(BG_IMAGES)
-                debug_print("Using background index " + str(BG_INDEX) + "/" + str(len(BG_IMAGES)))
-            bumper_group = place_bumpers(level, bumper_surf, bumper_mask)
-            shots_left = MAX_SHOTS
-            level_score = 0
-            ball = Ball((SCREEN_WIDTH//2,50), ball_surf, ball_mask)
-            ball_group = pygame.sprite.GroupSingle(ball)
+            if len(BG_STORE):
+                BG_INDEX = (state.level - 1) % len(BG_STORE)
+                debug_print("Using background index " + str(BG_INDEX) + "/" + str(len(BG_STORE)))
+            bumper_sprites = {}
+            bumper_group = pygame.sprite.Group()
+            for body in state.bumpers:
+                bumper_sprites[body] = Bumper(body, bumper_surf)
+                bumper_group.add(bumper_sprites[body])
+            ball_sprite = Ball(state.ball, ball_surf)
+            ball_group = pygame.sprite.GroupSingle(ball_sprite)
             level_active = True
-            if BG_IMAGES:
-                current_level_bg = BG_IMAGES[BG_INDEX]
-            else:
+            current_level_bg = None
+            if len(BG_STORE):
+                current_level_bg = BG_STORE.get(BG_INDEX)
+                BG_STORE.prefetch(BG_INDEX + 1)
+                debug_print(BG_STORE.stats_line())
+            if current_level_bg is None:
                 current_level_bg = original_background_surf
-            pre_dark_bg = make_pre_darkened_copy(current_level_bg, BRIGHTNESS)
+            inputs = []
+            accumulator = 0.0
+            damage.reset()
             while running and level_active:
-                dt = clock.tick(FPS)/1000.0
-                check_and_play_music()
+                FRAME_TIMER.begin_frame()
+                if UNTHROTTLED_MODE:
+                    clock.tick()
+                    dt = PHYSICS_DT * MAX_PHYSICS_STEPS_PER_FRAME
+                else:
+                    dt = clock.tick(FPS)/1000.0
+                FRAME_TIMER.lap("wait")
+                AUDIO.update()
                 for event in pygame.event.get():
                     if event.type == pygame.QUIT:
                         debug_print("QUIT event")
                         running = False
+                    elif event.type == MUSIC_END_EVENT:
+                        AUDIO.on_music_end()
                     elif event.type == pygame.KEYDOWN:
                         if event.key == pygame.K_ESCAPE:
                             debug_print("ESC => exit")
                             running = False
                         elif event.key in (pygame.K_LEFT, pygame.K_w):
                             if not IS_PAUSED:
-                                for f in flipper_group:
-                                    if f.side=="left":
-                                        f.trigger_flip()
+                                inputs.append(("flip", "left"))
                         elif event.key in (pygame.K_RIGHT, pygame.K_d):
                             if not IS_PAUSED:
-                                for f in flipper_group:
-                                    if f.side=="right":
-                                        f.trigger_flip()
+                                inputs.append(("flip", "right"))
                         elif event.key == pygame.K_p:
                             IS_PAUSED = not IS_PAUSED
                             debug_print("Paused toggled => " + str(IS_PAUSED))
+                            if recorder:
+                                recorder.write(state.tick, REPLAY_PAUSE, float(IS_PAUSED))
+                        elif event.key == pygame.K_F3:
+                            show_frame_overlay = not show_frame_overlay
+                            FRAME_TIMER.set_enabled(show_frame_overlay or FRAME_TIMES_MODE)
+                            next_frame_overlay = 0.0
+                        elif event.key == pygame.K_F4:
+                            show_aim_preview = not show_aim_preview
                     elif event.type == pygame.MOUSEBUTTONDOWN:
+                        pos = target.to_logical(event.pos)
                         if event.button == 1:
-                            if options_button_rect.collidepoint(event.pos):
+                            if options_button_rect.collidepoint(pos):
                                 play_button_sound()
                                 SHOW_OPTIONS = not SHOW_OPTIONS
                                 if SHOW_OPTIONS:
                                     IS_PAUSED = True
                                 else:
                                     IS_PAUSED = False
-                                pre_dark_bg = make_pre_darkened_copy(current_level_bg, BRIGHTNESS)
+                                if recorder:
+                                    recorder.write(state.tick, REPLAY_PAUSE, float(IS_PAUSED))
                             else:
                                 if SHOW_OPTIONS:
-                                    if brightness_slider_rect.collidepoint(event.pos):
+                                    if brightness_slider_rect.collidepoint(pos):
                                         dragging_slider = "brightness"
-                                    elif music_slider_rect.collidepoint(event.pos):
+                                    elif music_slider_rect.collidepoint(pos):
                                         dragging_slider = "music"
                                 else:
                                     if not IS_PAUSED:
-                                        if orgon_button_state == "VISIBLE" and orgon_button_rect.collidepoint(event.pos):
+                                        if state.orgon_button_state == "VISIBLE" and orgon_button_rect.collidepoint(pos):
                                             play_button_sound()
-                                            wind.angle = random.uniform(0, 2 * math.pi)
-                                            wind.strength = random.uniform(0.0, 0.6)
-                                            orgon_button_state = "HIDDEN"
-                                            orgon_button_timer = 0.0
-                                        elif repulsine_button_state == "VISIBLE" and repulsine_button_rect.collidepoint(event.pos):
+                                            inputs.append(("orgon",))
+                                        elif state.repulsine_button_state == "VISIBLE" and repulsine_button_rect.collidepoint(pos):
                                             play_button_sound()
-                                            if ball.fired and ball.active:
-                                                ball.vel.y = -abs(ball.vel.y) * 2.0
-                                            repulsine_button_state = "HIDDEN"
-                                            repulsine_button_timer = 0.0
-                                        elif not ball.fired and shots_left > 0:
-                                            mx, my = pygame.mouse.get_pos()
-                                            dx = mx - ball.pos.x
-                                            dy = my - ball.pos.y
-                                            angle = math.atan2(dy,dx)
-                                            speed = 25 * BALL_SPEED_MODIFIER
-                                            ball.vel.x = speed*math.cos(angle)
-                                            ball.vel.y = speed*math.sin(angle)
-                                            ball.fired = True
-                                            shots_left -= 1
-                                            bounce_index = 0
-                                            debug_print("Ball fired angle " + str(angle) + " speed " + str(speed))
+                                            inputs.append(("repulsine",))
+                                        elif not state.ball.fired and state.shots_left > 0:
+                                            mx, my = pos
+                                            dx = mx - state.ball.pos.x
+                                            dy = my - state.ball.pos.y
+                                            inputs.append(("fire", math.atan2(dy,dx)))
                                         else:
-                                            for f in flipper_group:
-                                                if f.side=="left":
-                                                    f.trigger_flip()
+                                            inputs.append(("flip", "left"))
                         elif event.button == 3:
                             if not IS_PAUSED and not SHOW_OPTIONS:
-                                for f in flipper_group:
-                                    if f.side=="right":
-                                        f.trigger_flip()
+                                inputs.append(("flip", "right"))
                     elif event.type == pygame.MOUSEBUTTONUP:
                         if event.button == 1:
                             dragging_slider = None
                     elif event.type == pygame.MOUSEMOTION:
                         if SHOW_OPTIONS and dragging_slider is not None:
-                            mx, my = event.pos
+                            mx, my = target.to_logical(event.pos)
                             if dragging_slider == "brightness":
                                 rel_x = mx - brightness_slider_rect.x
                                 rel_x = max(0, min(rel_x, brightness_slider_rect.width))
                                 BRIGHTNESS = rel_x / brightness_slider_rect.width
-                                pre_dark_bg = make_pre_darkened_copy(current_level_bg, BRIGHTNESS)
                                 debug_print("BRIGHTNESS => " + str(BRIGHTNESS))
                             elif dragging_slider == "music":
                                 rel_x = mx - music_slider_rect.x
@@ -782,89 +3231,86 @@ def main():
                                 MUSIC_VOLUME = rel_x / music_slider_rect.width
                                 pygame.mixer.music.set_volume(MUSIC_VOLUME)
                                 debug_print("MUSIC_VOLUME => " + str(MUSIC_VOLUME))
-                if not NOSPOON_MODE:
-                    if not IS_PAUSED:
-                        orgon_button_timer += dt
-                        if orgon_button_state == "HIDDEN":
-                            if orgon_button_timer >= 30.0:
-                                orgon_button_state = "VISIBLE"
-                                orgon_button_timer = 0.0
-                        elif orgon_button_state == "VISIBLE":
-                            if orgon_button_timer >= 30.0:
-                                orgon_button_state = "HIDDEN"
-                                orgon_button_timer = 0.0
-                        repulsine_button_timer += dt
-                        if repulsine_button_state == "HIDDEN":
-                            if repulsine_button_timer >= 20.0:
-                                repulsine_button_state = "VISIBLE"
-                                repulsine_button_timer = 0.0
-                        elif repulsine_button_state == "VISIBLE":
-                            if repulsine_button_timer >= 20.0:
-                                repulsine_button_state = "HIDDEN"
-                                repulsine_button_timer = 0.0
+                FRAME_TIMER.lap("events")
                 if not IS_PAUSED:
-                    wind.update(dt)
-                    if ball.fired and ball.active:
-                        wind.apply_to_ball(ball)
-                    ball_group.update()
-                    for f in flipper_group:
-                        f.update(dt, ball)
-                    for bump in bumper_group:
-                        if pygame.sprite.collide_mask(ball, bump):
-                            debug_print("Collision => +50")
-                            level_score += 50
-                            ball.vel.y = -ball.vel.y
-                            bump.on_hit()
-                            play_bounce_sound()
-                            ball.bottom_bounce_count = 0
-                    for hobj in holes_group:
-                        if ball.rect.colliderect(hobj.rect):
-                            debug_print("Ball => hole => -25")
-                            level_score -= 25
-                            ball.active = False
-                            ball_group.empty()
-                            ball.bottom_bounce_count = 0
+                    accumulator = min(accumulator + dt, PHYSICS_DT * MAX_PHYSICS_STEPS_PER_FRAME)
+                    while accumulator >= PHYSICS_DT and state.phase == "playing":
+                        accumulator -= PHYSICS_DT
+                        FRAME_TIMER.lap("physics")
+                        if replay_player is not None:
+                            inputs = replay_player.inputs_for(state.tick)
+                        elif recorder:
+                            recorder.record_inputs(state.tick, inputs)
+                        for name, obj in step(state, inputs, PHYSICS_DT):
+                            if name == "border":
+                                play_border_sound()
+                            elif name == "panel":
+                                play_panel_sound()
+                            elif name == "bumper":
+                                play_bounce_sound()
+                                removed = bumper_sprites.pop(obj)
+                                damage.add(removed.rect)
+                                removed.kill()
+                            elif name == "fire":
+                                bounce_index = 0
+                            elif name == "new_ball":
+                                ball_sprite.set_body(obj)
+                        inputs = []
+                        FRAME_TIMER.lap("physics")
+                        if replay_player is not None and replay_player.finished(state.tick):
+                            running = False
                             break
-                    if not ball.active and len(ball_group)==0:
-                        debug_print("Ball inactive => new ball top")
-                        ball = Ball((SCREEN_WIDTH//2,50), ball_surf, ball_mask)
-                        ball_group.add(ball)
-                    if ball.bottom_bounce_count >= 5:
-                        debug_print("bottom bounce too often => enlarge holes")
-                        for hobj in holes_group:
-                            hobj.enlarge(10)
-                        ball.bottom_bounce_count = 0
-                    if len(bumper_group) == 0:
-                        total_score += level_score
-                        debug_print("Level " + str(level) + " complete => total " + str(total_score))
-                        txt = font_big.render("Level " + str(level) + " complete (score change: " + str(level_score) + ")", True, (255,255,255))
+                    flipper_group.update()
+                    holes_group.update()
+                    ball_group.update(accumulator / PHYSICS_DT)
+                    FRAME_TIMER.lap("sprite upd")
+                    if state.phase == "level_complete":
+                        txt = TEXT_CACHE.render(font_big, "Level " + str(state.level) + " complete (score change: " + str(state.level_score) + ")", (255,255,255))
                         screen.fill((0,0,0))
                         screen.blit(txt, (SCREEN_WIDTH//2 - txt.get_width()//2, SCREEN_HEIGHT//2))
-                        pygame.display.flip()
-                        pygame.time.wait(2000)
-                        level += 1
+                        target.present()
+                        if not UNTHROTTLED_MODE:
+                            pygame.time.wait(2000)
+                        FRAME_TIMER.skip_frame()
+                        advance_level(state)
                         level_active = False
                         continue
-                    if shots_left <= 0 and not ball.fired and len(bumper_group) > 0:
-                        debug_print("Out of shots => Game Over")
-                        msg = font_big.render("Game Over", True, (255,50,50))
-                        info = font_small.render("Score: " + str(total_score), True, (255,255,255))
+                    if state.phase == "game_over":
+                        msg = TEXT_CACHE.render(font_big, "Game Over", (255,50,50))
+                        info = TEXT_CACHE.render_number(font_small, "Score: ", state.total_score, (255,255,255))
                         screen.fill((0,0,0))
                         screen.blit(msg, (SCREEN_WIDTH//2-msg.get_width()//2,SCREEN_HEIGHT//2-40))
                         screen.blit(info,(SCREEN_WIDTH//2-info.get_width()//2,SCREEN_HEIGHT//2+20))
-                        again_surf = font_small.render("Again? y/n", True, (255,255,255))
+                        again_surf = TEXT_CACHE.render(font_small, "Again? y/n", (255,255,255))
                         screen.blit(again_surf, (SCREEN_WIDTH//2-again_surf.get_width()//2, SCREEN_HEIGHT//2+60))
-                        pygame.display.flip()
-                        log_score(total_score)
+                        if replay_player is not None:
+                            target.present()
+                            if replay_player.restart_at(state.tick):
+                                restart_game(state)
+                            else:
+                                running = False
+                            break
+                        score_id = log_score(state.total_score)
+                        if SCORE_STORE is not None:
+                            y = SCREEN_HEIGHT//2 + 110
+                            for rank, (top_id, top_score, played_at) in enumerate(SCORE_STORE.top(), 1):
+                                color = (255,255,0) if top_id == score_id else (200,200,200)
+                                row = TEXT_CACHE.render(font_small, str(rank) + ". " + str(top_score) + "   " + played_at[:10], color)
+                                screen.blit(row, (SCREEN_WIDTH//2-row.get_width()//2, y))
+                                y += row.get_height()
+                        target.present()
                         asking = True
                         while asking:
+                            AUDIO.update()
                             for ev in pygame.event.get():
-                                if ev.type == pygame.KEYDOWN:
+                                if ev.type == MUSIC_END_EVENT:
+                                    AUDIO.on_music_end()
+                                elif ev.type == pygame.KEYDOWN:
                                     if ev.key == pygame.K_y:
                                         debug_print("User => play again")
-                                        shots_left = MAX_SHOTS
-                                        total_score = 0
-                                        level = 1
+                                        if recorder:
+                                            recorder.write(state.tick, REPLAY_RESTART)
+                                        restart_game(state)
                                         asking = False
                                         break
                                     elif ev.key == pygame.K_n:
@@ -881,81 +3327,917 @@ def main():
                         new_hue = (old_hue + HUE_SHIFT_STEP) % 360
                         color_cycle_start_time = current_time
                         elapsed = 0.0
-                    if elapsed < COLOR_CYCLE_FADE_DURATION:
-                        alpha = elapsed / COLOR_CYCLE_FADE_DURATION
-                        current_hue = (1 - alpha)*old_hue + alpha*new_hue
+                    alpha = min(1.0, elapsed / COLOR_CYCLE_FADE_DURATION)
+                    hue_keyframes.set_source(original_background_surf, (old_hue, new_hue))
+                    level_bg = hue_keyframes.compose(old_hue, new_hue, alpha, BRIGHTNESS)
+                else:
+                    level_bg = bg_compositor.get(current_level_bg, BRIGHTNESS)
+                aim_visible = show_aim_preview and not state.ball.fired and state.shots_left > 0 and not IS_PAUSED and not SHOW_OPTIONS
+                if aim_visible:
+                    mx, my = target.mouse_pos()
+                    aim_preview.update(state, math.atan2(my - state.ball.pos.y, mx - state.ball.pos.x))
+                FRAME_TIMER.lap("compose")
+                if show_frame_overlay and time.time() >= next_frame_overlay:
+                    next_frame_overlay = time.time() + FRAME_OVERLAY_INTERVAL
+                    frame_overlay = FRAME_TIMER.render_overlay(font_small, AUDIO.overlay_rows())
+                    frame_overlay_revision += 1
+                if DIRTY_RECTS_MODE:
+                    bg_rebuilds = bg_compositor.rebuild_count + hue_keyframes.rebuild_count
+                    if SHOW_OPTIONS or SHOW_OPTIONS != last_show_options or bg_rebuilds != last_bg_rebuilds:
+                        damage.invalidate()
+                    last_show_options = SHOW_OPTIONS
+                    last_bg_rebuilds = bg_rebuilds
+                    damage.track("ball", ball_sprite.rect)
+                    for spr in flipper_group:
+                        damage.track(spr, spr.rect, spr.angle)
+                    for spr in holes_group:
+                        damage.track(spr, spr.rect, spr.width)
+                    damage.track("wind", state.wind.gauge_rect(), (state.wind.angle, state.wind.strength))
+                    damage.track("aim", aim_preview.rect if aim_visible else None, aim_preview.revision)
+                    damage.track("hud", pygame.Rect(10, 10, SCREEN_WIDTH // 3, 90), (state.level, state.shots_left, state.total_score+state.level_score))
+                    damage.track("orgon", orgon_button_rect, state.orgon_button_state)
+                    damage.track("repulsine", repulsine_button_rect, state.repulsine_button_state)
+                    if show_frame_overlay and frame_overlay:
+                        damage.track("frametimes", frame_overlay.get_rect(topright=(SCREEN_WIDTH - 10, 10)), frame_overlay_revision)
                     else:
-                        current_hue = new_hue
-                    if current_time >= next_hue_update:
-                        next_hue_update = current_time + 1.0 / COLOR_SHIFT_FPS
-                        bg_interpolated_surf = safe_shift_surface_hue(original_background_surf, current_hue)
-                    if bg_interpolated_surf:
-                        bg_scaled = pygame.transform.scale(bg_interpolated_surf, (SCREEN_WIDTH, SCREEN_HEIGHT))
-                        screen.blit(bg_scaled,(0,0))
+                        damage.track("frametimes", None)
+                    dirty = damage.collect(screen.get_rect())
+                    if dirty is None:
+                        draw_current_scene()
+                        target.present()
                     else:
-                        screen.fill((0,0,0))
+                        for rect in dirty:
+                            screen.set_clip(rect)
+                            draw_current_scene()
+                        screen.set_clip(None)
+                        target.present(dirty)
                 else:
-                    if pre_dark_bg:
-                        bg_scaled = pygame.transform.scale(pre_dark_bg, (SCREEN_WIDTH, SCREEN_HEIGHT))
-                        screen.blit(bg_scaled,(0,0))
-                    else:
-                        screen.fill((0,0,0))
-                bumper_group.draw(screen)
-                holes_group.draw(screen)
-                flipper_group.draw(screen)
-                if corner_surf:
-                    sorted_positions = sorted(hole_positions, key=lambda p: p[0])
-                    for i in range(len(sorted_positions)-1):
-                        left_x = sorted_positions[i][0]
-                        right_x = sorted_positions[i+1][0]
-                        mid_x = (left_x+right_x)//2
-                        y = SCREEN_HEIGHT - 80
-                        c_rect = corner_surf.get_rect(midtop=(mid_x,y))
-                        screen.blit(corner_surf, c_rect)
-                ball_group.draw(screen)
-                wind.draw(screen)
-                lvl_surf = font_small.render("Level: " + str(level), True, (255,255,255))
-                screen.blit(lvl_surf,(10,10))
-                shot_surf = font_small.render("Shots left: " + str(shots_left), True, (255,255,255))
-                screen.blit(shot_surf,(10,40))
-                score_surf = font_small.render("Score: " + str(total_score+level_score), True, (255,255,255))
-                screen.blit(score_surf,(10,70))
-                pygame.draw.rect(screen, (180,180,180), options_button_rect, border_radius=8)
-                opt_txt = font_small.render("Options", True, (0,0,0))
-                screen.blit(opt_txt, (options_button_rect.centerx - opt_txt.get_width()/2, options_button_rect.centery - opt_txt.get_height()/2))
-                if not NOSPOON_MODE:
-                    if orgon_button_state == "VISIBLE":
-                        pygame.draw.rect(screen, (150,220,150), orgon_button_rect, border_radius=8)
-                        line1 = font_small.render("Orgon", True, (0,0,0))
-                        line2 = font_small.render("Akkumulator", True, (0,0,0))
-                        screen.blit(line1, (orgon_button_rect.centerx - line1.get_width()/2, orgon_button_rect.y + 5))
-                        screen.blit(line2, (orgon_button_rect.centerx - line2.get_width()/2, orgon_button_rect.y + 5 + line1.get_height()))
-                    if repulsine_button_state == "VISIBLE":
-                        pygame.draw.rect(screen, (150,150,220), repulsine_button_rect, border_radius=8)
-                        repulsine_txt = font_small.render("Repulsine", True, (0,0,0))
-                        screen.blit(repulsine_txt, (repulsine_button_rect.centerx - repulsine_txt.get_width()/2, repulsine_button_rect.centery - repulsine_txt.get_height()/2))
-                if SHOW_OPTIONS:
-                    menu_bg = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-                    menu_bg.fill((50,50,50,200))
-                    screen.blit(menu_bg, (0,0))
-                    menu_title = font_big.render("OPTIONS", True, (255,255,255))
-                    screen.blit(menu_title, (SCREEN_WIDTH//2 - menu_title.get_width()//2, SCREEN_HEIGHT//2 - 100))
-                    pygame.draw.rect(screen, (200,200,200), brightness_slider_rect)
-                    fill_w = int(brightness_slider_rect.width * BRIGHTNESS)
-                    fill_rect = pygame.Rect(brightness_slider_rect.x, brightness_slider_rect.y, fill_w, brightness_slider_rect.height)
-                    pygame.draw.rect(screen, (0,255,0), fill_rect)
-                    bri_label = font_small.render("Brightness: " + str(int(BRIGHTNESS*100)) + "%", True, (255,255,255))
-                    screen.blit(bri_label, (brightness_slider_rect.centerx - bri_label.get_width()//2, brightness_slider_rect.y - 25))
-                    pygame.draw.rect(screen, (200,200,200), music_slider_rect)
-                    fill_w2 = int(music_slider_rect.width * MUSIC_VOLUME)
-                    fill2_rect = pygame.Rect(music_slider_rect.x, music_slider_rect.y, fill_w2, music_slider_rect.height)
-                    pygame.draw.rect(screen, (0,255,0), fill2_rect)
-                    vol_label = font_small.render("Music Volume: " + str(int(MUSIC_VOLUME*100)) + "%", True, (255,255,255))
-                    screen.blit(vol_label, (music_slider_rect.centerx - vol_label.get_width()//2, music_slider_rect.y - 25))
-                pygame.display.flip()
+                    draw_current_scene()
+                    target.present()
+                FRAME_TIMER.lap("flip")
+        if recorder:
+            recorder.close(state)
+        if replay_player is not None:
+            report_replay(replay_player, state)
+        if FRAME_TIMES_MODE:
+            FRAME_TIMER.dump(FRAME_TIMES_FILE)
+        AUDIO.stop()
+        debug_print(AUDIO.stats_line())
         pygame.quit()
         debug_print("Pygame quit. Exiting application.")
         sys.exit()
 
+def load_collision_shapes(data_dir):
+    masks = {}
+    for name, radius in (("bumper.png", 20), ("ball.png", 10)):
+        path = os.path.join(data_dir, name)
+        mask = None
+        if os.path.exists(path):
+            try:
+                mask = load_image_with_mask(path)[1]
+            except Exception as e:
+                debug_print("Error loading " + name + ": " + str(e))
+        if mask is None:
+            mask = get_alpha_mask_circle(radius)[1]
+        masks[name] = mask
+    flipper_masks = {side: load_image_mask("panel_" + side + ".png", load_flipper_image(side)) for side in ("left", "right")}
+    return CollisionShapes(masks["ball.png"], masks["bumper.png"], flipper_masks)
+
+def report_replay(player, state, elapsed=None):
+    matches, actual = player.verify(state)
+    line = ("Replay: " + str(state.tick) + " ticks, score " + str(actual[0]) + ", level " + str(actual[1])
+            + ", bumper hits " + str(actual[2]) + ", bumper crc " + str(actual[3]))
+    if elapsed:
+        line += ", " + str(round(elapsed, 3)) + " s (" + str(int(state.tick / elapsed)) + " ticks/s)"
+    print(line)
+    if player.expected is None:
+        print("Replay has no recorded result (recording was not closed).")
+    elif matches:
+        print("Replay matches the recorded result.")
+    else:
+        print("Replay DIVERGED from the recorded result: expected " + str(tuple(player.expected)) + ", got " + str(actual))
+
+def run_headless_replay(path):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    try:
+        player = ReplayPlayer(path)
+    except Exception as e:
+        print("Could not load replay " + path + ": " + str(e))
+        return
+    player.apply_settings()
+    pygame.init()
+    pygame.display.set_mode((1,1))
+    data_dir = os.path.join(os.getcwd(), "data")
+    global ASSET_BUNDLE
+    ASSET_BUNDLE = open_asset_bundle(data_dir)
+    level_table = None
+    if player.level_table:
+        level_table = load_level_table(os.path.join(data_dir, LEVEL_TABLE_FILENAME), player.width, player.height)
+    state = GameState(player.width, player.height, load_collision_shapes(data_dir), player.seed, level_table)
+    STARTUP_PROFILE.report(PROFILE_JSON)
+    start = time.perf_counter()
+    next_step = start
+    while not player.finished(state.tick):
+        if state.phase == "level_complete":
+            advance_level(state)
+            continue
+        if state.phase == "game_over":
+            if player.restart_at(state.tick):
+                restart_game(state)
+                continue
+            break
+        step(state, player.inputs_for(state.tick), PHYSICS_DT)
+        if not UNTHROTTLED_MODE:
+            next_step += PHYSICS_DT
+            delay = next_step - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    report_replay(player, state, time.perf_counter() - start)
+    pygame.quit()
+
+def calibration_worker_init(data_dir):
+    global ASSET_BUNDLE, CALIBRATION_SHAPES
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.display.init()
+    pygame.display.set_mode((1,1))
+    ASSET_BUNDLE = open_asset_bundle(data_dir)
+    CALIBRATION_SHAPES = load_collision_shapes(data_dir)
+
+def calibrate_layout(level, layout_seed, width, height, shots, sim_seed):
+    start = time.process_time()
+    shapes = CALIBRATION_SHAPES
+    rng = random.Random(sim_seed)
+    positions = place_bumpers(level, shapes.bumper_radius, width, height, layout_seed)
+    attempts = 0
+    cleared = 0
+    fired = 0
+    ticks = 0
+    remaining = 0.0
+    while positions and fired < shots:
+        state = GameState(width, height, shapes, rng.getrandbits(32))
+        state.bumpers = [BumperState(pos, shapes.bumper_mask) for pos in positions]
+        state.bumper_grid = build_bumper_grid(state.bumpers, shapes.bumper_reach)
+        shot_ticks = 0
+        while state.phase == "playing":
+            inputs = []
+            if not state.ball.fired:
+                inputs.append(("fire", rng.uniform(0.2, math.pi - 0.2)))
+                shot_ticks = 0
+            elif shot_ticks >= CALIBRATION_SHOT_TICKS:
+                state.ball = state.new_ball()
+                continue
+            if rng.random() < CALIBRATION_FLIP_CHANCE:
+                inputs.append(("flip", rng.choice(("left", "right"))))
+            step(state, inputs, PHYSICS_DT)
+            shot_ticks += 1
+            ticks += 1
+        attempts += 1
+        fired += MAX_SHOTS - state.shots_left
+        if state.phase == "level_complete":
+            cleared += 1
+        remaining += len(state.bumpers) / float(len(positions))
+    return {"level": level, "seed": layout_seed, "bumpers": len(positions), "difficulty": remaining / max(1, attempts),
+            "clear_rate": cleared / float(max(1, attempts)), "mean_shots": fired / float(max(1, attempts)),
+            "shots": fired, "ticks": ticks, "cpu_s": time.process_time() - start}
+
+def curate_level_table(results):
+    levels = []
+    previous = 0.0
+    for level in sorted(set(r["level"] for r in results)):
+        candidates = sorted((r for r in results if r["level"] == level and r["bumpers"] > 0), key=lambda r: (r["difficulty"], r["mean_shots"]))
+        if not candidates:
+            continue
+        harder = [r for r in candidates if r["difficulty"] >= previous] or candidates[-1:]
+        pick = harder[(len(harder) - 1) // 2]
+        previous = pick["difficulty"]
+        levels.append({key: pick[key] for key in ("level", "bumpers", "seed", "difficulty", "clear_rate", "mean_shots")})
+    return levels
+
+def run_level_calibration(path):
+    ensure_data_folder()
+    width, height = 1920, 1080
+    if CALIBRATE_SIZE_ARG:
+        width, height = (int(v) for v in CALIBRATE_SIZE_ARG.lower().split("x"))
+    levels = int(CALIBRATE_LEVELS_ARG) if CALIBRATE_LEVELS_ARG else CALIBRATION_LEVELS
+    seeds = int(CALIBRATE_SEEDS_ARG) if CALIBRATE_SEEDS_ARG else CALIBRATION_SEEDS
+    shots = int(CALIBRATE_SHOTS_ARG) if CALIBRATE_SHOTS_ARG else CALIBRATION_SHOTS
+    workers = os.cpu_count() or 1
+    master = random.Random(int(SEED_ARG) if SEED_ARG else None)
+    jobs = [(level, master.getrandbits(32), width, height, shots, master.getrandbits(32)) for level in range(1, levels + 1) for i in range(seeds)]
+    data_dir = os.path.join(os.getcwd(), "data")
+    print("Calibrating " + str(len(jobs)) + " layouts (" + str(levels) + " levels x " + str(seeds) + " seeds, "
+          + str(shots) + " shots each) at " + str(width) + "x" + str(height) + " on " + str(workers) + " processes")
+    results = []
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=calibration_worker_init, initargs=(data_dir,)) as pool:
+        futures = [pool.submit(calibrate_layout, *job) for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            r = future.result()
+            results.append(r)
+            print("level " + str(r["level"]) + " seed " + str(r["seed"]) + ": difficulty " + ("%.3f" % r["difficulty"])
+                  + ", cleared " + ("%.1f" % (r["clear_rate"] * 100)) + "%, " + ("%.1f" % r["mean_shots"]) + " shots per attempt"
+                  + " (" + str(len(results)) + "/" + str(len(jobs)) + ")")
+    elapsed = time.perf_counter() - start
+    results.sort(key=lambda r: (r["level"], r["difficulty"], r["mean_shots"]))
+    table = {"version": LEVEL_TABLE_VERSION, "width": width, "height": height, "max_shots": MAX_SHOTS, "shots_per_layout": shots,
+             "time": time.strftime("%Y-%m-%d %H:%M:%S"), "levels": curate_level_table(results),
+             "candidates": [{key: r[key] for key in ("level", "bumpers", "seed", "difficulty", "clear_rate", "mean_shots")} for r in results]}
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(table, f, indent=2)
+    os.replace(path + ".tmp", path)
+    for entry in table["levels"]:
+        print("Level " + str(entry["level"]) + ": seed " + str(entry["seed"]) + ", difficulty " + ("%.3f" % entry["difficulty"])
+              + ", cleared " + ("%.1f" % (entry["clear_rate"] * 100)) + "%")
+    total_shots = sum(r["shots"] for r in results)
+    cpu_s = sum(r["cpu_s"] for r in results)
+    print("Wrote " + path + ": " + str(len(table["levels"])) + " levels")
+    print("Simulated " + str(total_shots) + " shots (" + str(sum(r["ticks"] for r in results)) + " ticks) in " + ("%.1f" % elapsed) + " s: "
+          + ("%.1f" % (total_shots / elapsed)) + " shots/s, " + ("%.1f" % (total_shots / elapsed / workers)) + " shots/s per core, "
+          + ("%.1f" % (total_shots / cpu_s if cpu_s else 0.0)) + " shots per CPU second")
+
+def make_benchmark_surface(w, h, seed=1234, block=8):
+    rng = random.Random(seed)
+    surf = pygame.Surface((w, h), pygame.SRCALPHA)
+    for x in range(0, w, block):
+        for y in range(0, h, block):
+            color = (rng.randrange(256), rng.randrange(256), rng.randrange(256), rng.randrange(256))
+            surf.fill(color, (x, y, block, block))
+    return surf
+
+def benchmark_hue_shift():
+    results = {}
+    big = make_benchmark_surface(1920, 1080)
+    small = make_benchmark_surface(160, 120, block=1)
+    repeats = 5
+    start = time.perf_counter()
+    for i in range(repeats):
+        shift_surface_hue(big, i * HUE_SHIFT_STEP + 17)
+    elapsed = time.perf_counter() - start
+    results["vectorized_mpix_per_s"] = (1920 * 1080 * repeats) / elapsed / 1e6
+    start = time.perf_counter()
+    slow = shift_surface_hue_per_pixel(small, 137)
+    elapsed = time.perf_counter() - start
+    results["per_pixel_mpix_per_s"] = (160 * 120) / elapsed / 1e6
+    max_diff = 0
+    for hue in (0, 37, 60, 137, 200, 299, 359.5):
+        slow = shift_surface_hue_per_pixel(small, hue)
+        fast = shift_surface_hue(small, hue)
+        for x in range(0, 160, 3):
+            for y in range(0, 120, 3):
+                a = slow.get_at((x, y))
+                b = fast.get_at((x, y))
+                max_diff = max(max_diff, abs(a.r - b.r), abs(a.g - b.g), abs(a.b - b.b), abs(a.a - b.a))
+    results["max_channel_diff"] = max_diff
+    results["speedup"] = results["vectorized_mpix_per_s"] / results["per_pixel_mpix_per_s"]
+    return results
+
+def benchmark_background_blit():
+    results = {}
+    source = make_benchmark_surface(1280, 720)
+    global SCREEN_WIDTH, SCREEN_HEIGHT
+    for label, size in (("1080p", (1920, 1080)), ("4k", (3840, 2160))):
+        SCREEN_WIDTH, SCREEN_HEIGHT = size
+        screen = pygame.display.set_mode(size)
+        frames = 30
+        pre_dark_bg = make_pre_darkened_copy(source.convert_alpha(), BRIGHTNESS)
+        start = time.perf_counter()
+        for i in range(frames):
+            bg_scaled = pygame.transform.scale(pre_dark_bg, size)
+            screen.blit(bg_scaled, (0,0))
+        results[label + "_scale_per_frame_ms"] = (time.perf_counter() - start) / frames * 1000
+        compositor = BackgroundCompositor()
+        start = time.perf_counter()
+        for i in range(frames):
+            screen.blit(compositor.get(source, BRIGHTNESS), (0,0))
+        results[label + "_cached_ms"] = (time.perf_counter() - start) / frames * 1000
+    return results
+
+def benchmark_render_scale():
+    results = {}
+    source = make_benchmark_surface(1280, 720)
+    global SCREEN_WIDTH, SCREEN_HEIGHT
+    display_size = (3840, 2160)
+    for label, factor in (("native", 1), ("half", 2)):
+        SCREEN_WIDTH, SCREEN_HEIGHT = display_size[0] // factor, display_size[1] // factor
+        target = RenderTarget(display_size, (SCREEN_WIDTH, SCREEN_HEIGHT))
+        compositor = BackgroundCompositor()
+        overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+        overlay.set_alpha(128)
+        target.canvas.blit(compositor.get(source, BRIGHTNESS), (0,0))
+        frames = 20
+        start = time.perf_counter()
+        for i in range(frames):
+            target.canvas.blit(compositor.get(source, BRIGHTNESS), (0,0))
+            target.canvas.blit(overlay, (0,0))
+            target.present()
+        results[label + "_4k_frame_ms"] = (time.perf_counter() - start) / frames * 1000
+        if target.mode == "software":
+            start = time.perf_counter()
+            for i in range(frames):
+                pygame.transform.smoothscale(target.canvas, display_size, target.window)
+            results[label + "_smoothscale_present_ms"] = (time.perf_counter() - start) / frames * 1000
+    return results
+
+def benchmark_color_cycle():
+    results = {}
+    global SCREEN_WIDTH, SCREEN_HEIGHT
+    SCREEN_WIDTH, SCREEN_HEIGHT = 1920, 1080
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    source = make_benchmark_surface(1280, 720).convert_alpha()
+    scaled = pygame.transform.scale(source, (SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+    repeats = 5
+    start = time.perf_counter()
+    for i in range(repeats):
+        screen.blit(make_pre_darkened_copy(shift_surface_hue(scaled, i * 12), BRIGHTNESS), (0,0))
+    results["live_update_ms"] = (time.perf_counter() - start) / repeats * 1000
+    keyframes = HueKeyframes(max_resident=360 // HUE_SHIFT_STEP)
+    start = time.perf_counter()
+    keyframes.set_source(source, (0,))
+    keyframes.wait()
+    results["keyframes_build_ms"] = (time.perf_counter() - start) * 1000
+    results["keyframes_resident_mib"] = sum(f.get_pitch() * f.get_height() for f in keyframes.frames.values()) / 1048576.0
+    frames = 120
+    start = time.perf_counter()
+    for i in range(frames):
+        screen.blit(keyframes.compose(0, HUE_SHIFT_STEP, i / float(frames), BRIGHTNESS), (0,0))
+    results["crossfade_frame_ms"] = (time.perf_counter() - start) / frames * 1000
+    results["crossfade_composes"] = keyframes.rebuild_count
+    return results
+
+def benchmark_physics():
+    results = {}
+    rng = random.Random(99)
+    state = GameState(1920, 1080, make_default_collision_shapes(), seed=99)
+    steps = 20000
+    start = time.perf_counter()
+    for i in range(steps):
+        inputs = []
+        if not state.ball.fired:
+            inputs.append(("fire", rng.uniform(0.2, math.pi - 0.2)))
+        if i % 30 == 0:
+            inputs.append(("flip", rng.choice(("left", "right"))))
+        step(state, inputs, 1.0 / FPS)
+        if state.phase == "level_complete":
+            advance_level(state)
+        elif state.phase == "game_over":
+            restart_game(state)
+    elapsed = time.perf_counter() - start
+    results["steps_per_s"] = steps / elapsed
+    results["reached_level"] = state.level
+    return results
+
+def benchmark_bumper_collision():
+    results = {}
+    shapes = make_default_collision_shapes()
+    state = GameState(1920, 1080, shapes)
+    ball_radius = shapes.ball_radius
+    reach = shapes.bumper_reach + ball_radius
+    for count in (10, 100, 1000, 10000):
+        rng = random.Random(count)
+        state.bumpers = [BumperState((rng.uniform(150, 1770), rng.uniform(100, 540)), shapes.bumper_mask) for i in range(count)]
+        state.bumper_grid = build_bumper_grid(state.bumpers, shapes.bumper_reach)
+        segments = []
+        for i in range(2000):
+            start = pygame.math.Vector2(rng.uniform(150, 1770), rng.uniform(100, 540))
+            segments.append((start, start + pygame.math.Vector2(rng.uniform(-10, 10), rng.uniform(-10, 10))))
+        start_time = time.perf_counter()
+        for p0, p1 in segments:
+            for bump in state.bumpers:
+                sweep_circle(p0, p1, bump.center, reach)
+        linear = (time.perf_counter() - start_time) / len(segments)
+        start_time = time.perf_counter()
+        for p0, p1 in segments:
+            for bump in bumper_candidates(state, p0, p1, ball_radius):
+                sweep_circle(p0, p1, bump.center, reach)
+        hashed = (time.perf_counter() - start_time) / len(segments)
+        results["linear_us_" + str(count)] = linear * 1e6
+        results["grid_us_" + str(count)] = hashed * 1e6
+    return results
+
+def benchmark_narrow_phase():
+    results = {}
+    shapes = make_default_collision_shapes()
+    state = GameState(1920, 1080, shapes, seed=23)
+    ball = state.ball
+    rng = random.Random(23)
+    bump = BumperState((960, 400), shapes.bumper_mask)
+    flipper = state.flippers[0]
+    a, b, radius = flipper.capsule()
+    bodies = (("bumper", bump, (960, 400)), ("flipper", flipper, ((a[0] + b[0]) / 2, (a[1] + b[1]) / 2)))
+    for name, body, center in bodies:
+        cases = []
+        for i in range(2000):
+            heading = rng.uniform(0, 2 * math.pi)
+            distance = rng.uniform(0, 40)
+            start = pygame.math.Vector2(center[0] + math.cos(heading) * distance, center[1] + math.sin(heading) * distance)
+            cases.append((start, start + pygame.math.Vector2(rng.uniform(-10, 10), rng.uniform(-10, 10))))
+        analytic_hits = []
+        start_time = time.perf_counter()
+        for p0, p1 in cases:
+            if name == "bumper":
+                t = sweep_circle(p0, p1, body.center, shapes.bumper_contact)
+                if t is not None:
+                    contact = p0.lerp(p1, t)
+                    contact_normal(contact.x, contact.y, body.center.x, body.center.y, p1.x - p0.x, p1.y - p0.y)
+            else:
+                t = sweep_segment(p0, p1, a, b, radius + shapes.ball_circle)
+                if t is not None:
+                    contact = p0.lerp(p1, t)
+                    u, qx, qy = closest_on_segment(contact.x, contact.y, a, b)
+                    contact_normal(contact.x, contact.y, qx, qy, p1.x - p0.x, p1.y - p0.y)
+            analytic_hits.append(t is not None)
+        results[name + "_analytic_us"] = (time.perf_counter() - start_time) / len(cases) * 1e6
+        mask_hits = []
+        start_time = time.perf_counter()
+        for p0, p1 in cases:
+            ball.move_to(p1)
+            if name == "bumper":
+                t = sweep_circle(p0, p1, body.center, shapes.bumper_reach + ball.radius)
+            else:
+                t = sweep_segment(p0, p1, a, b, radius + ball.radius + 0.75)
+            hit = t is not None and mask_contact(ball, body, p0, t)
+            if hit:
+                mask_normal(ball, body)
+            mask_hits.append(hit)
+        results[name + "_mask_us"] = (time.perf_counter() - start_time) / len(cases) * 1e6
+        results[name + "_agreement_pct"] = sum(1 for x, y in zip(analytic_hits, mask_hits) if x == y) * 100.0 / len(cases)
+    # Resting contact: a slow ball dropped along a flipper must bounce or settle,
+    # never report a panel hit on every tick.
+    failures = 0
+    for i in range(61):
+        state = GameState(1920, 1080, shapes, seed=23)
+        state.wind.strength = 0
+        state.wind.change_timer = float("inf")
+        ball = state.ball
+        ball.move_to((a[0] - 10 + i * (b[0] - a[0] + 20) / 60.0, min(a[1], b[1]) - radius - shapes.ball_circle - 5))
+        ball.vel.update(0, 3)
+        ball.fired = True
+        streak = 0
+        for tick in range(10 * PHYSICS_HZ):
+            events = step(state, [], PHYSICS_DT)
+            if state.ball is not ball or state.phase != "playing":
+                break
+            streak = streak + 1 if any(event[0] == "panel" for event in events) else 0
+            if streak >= PHYSICS_HZ // 3:
+                failures += 1
+                break
+    results["resting_failures"] = failures
+    return results
+
+def benchmark_bumper_placement():
+    results = {}
+    for count in (10, 100, 1000, 10000):
+        start = time.perf_counter()
+        positions = place_bumpers(count, 5, 3840, 2160, seed=count)
+        results["ms_" + str(count)] = (time.perf_counter() - start) * 1000
+        results["placed_" + str(count)] = len(positions)
+    results["level_capacity_1080p"] = bumper_capacity(20, 1920, 1080)
+    return results
+
+def benchmark_flipper_rotation():
+    results = {}
+    shapes = make_default_collision_shapes()
+    base_mask = shapes.flipper_masks["left"]
+    frames = 2000
+    start = time.perf_counter()
+    for i in range(frames):
+        rotate_mask(base_mask, (i % 46))
+    results["rotate_per_frame_us"] = (time.perf_counter() - start) / frames * 1e6
+    body = FlipperState("left", (500, 500), shapes.flipper_atlases["left"])
+    start = time.perf_counter()
+    for i in range(frames):
+        body.angle = i % 46
+        body._update_rotation()
+    results["atlas_per_frame_us"] = (time.perf_counter() - start) / frames * 1e6
+    return results
+
+def benchmark_text_cache():
+    results = {}
+    font = pygame.font.SysFont(pygame.font.get_default_font(), 30)
+    screen = pygame.Surface((800, 200))
+    cache = TextCache()
+    frames = 2000
+    start = time.perf_counter()
+    for i in range(frames):
+        screen.blit(font.render("Score: " + str((i // 20) * 50), True, (255,255,255)), (10,70))
+        screen.blit(font.render("Shots left: " + str((i // 200) % 12), True, (255,255,255)), (10,40))
+        screen.blit(font.render("Options", True, (0,0,0)), (10,100))
+    results["render_per_frame_us"] = (time.perf_counter() - start) / frames * 1e6
+    start = time.perf_counter()
+    for i in range(frames):
+        screen.blit(cache.render_number(font, "Score: ", (i // 20) * 50, (255,255,255)), (10,70))
+        screen.blit(cache.render_number(font, "Shots left: ", (i // 200) % 12, (255,255,255)), (10,40))
+        screen.blit(cache.render(font, "Options", (0,0,0)), (10,100))
+    results["cached_per_frame_us"] = (time.perf_counter() - start) / frames * 1e6
+    results["cache_hit_ratio"] = cache.hits / float(cache.hits + cache.misses)
+    return results
+
+def benchmark_sound_bank():
+    results = {}
+    pygame.mixer.init(44100, -16, 1)
+    mixer_format = pygame.mixer.get_init()
+    start = time.perf_counter()
+    for i in range(15):
+        create_sine_wave(220*(1.04**i), 200, 0.3)
+    results["python_loop_tones_ms"] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    for pcm in synthesize_tones([220*(1.04**i) for i in range(15)], 200, 0.3, mixer_format):
+        pygame.mixer.Sound(buffer=pcm)
+    results["batched_tones_ms"] = (time.perf_counter() - start) * 1000
+    data_dir = os.path.join(os.getcwd(), "data")
+    global SOUND_CACHE_FILENAME
+    saved_cache_filename = SOUND_CACHE_FILENAME
+    SOUND_CACHE_FILENAME = os.path.join(os.getcwd(), "bench_soundbank_cache.bin")
+    try:
+        if os.path.exists(SOUND_CACHE_FILENAME):
+            os.remove(SOUND_CACHE_FILENAME)
+        start = time.perf_counter()
+        build_sound_bank(data_dir, 15)
+        results["cold_bank_ms"] = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        build_sound_bank(data_dir, 15)
+        results["warm_bank_ms"] = (time.perf_counter() - start) * 1000
+    finally:
+        if os.path.exists(SOUND_CACHE_FILENAME):
+            os.remove(SOUND_CACHE_FILENAME)
+        SOUND_CACHE_FILENAME = saved_cache_filename
+    pygame.mixer.quit()
+    return results
+
+def benchmark_audio():
+    results = {}
+    pygame.mixer.init(44100, -16, 1)
+    scheduler = SoundScheduler()
+    scheduler.setup()
+    bumper_tones = [create_sine_wave(220*(1.04**i), 200, 0.3) for i in range(15)]
+    border_tone = create_sine_wave(80, 150, 0.4)
+    panel_tone = create_sine_wave(100, 200, 0.4)
+    frames = 120
+    calls = 0
+    elapsed = 0.0
+    for frame in range(frames):
+        scheduler.update()
+        # A ball rattling along a border fires border sounds every substep while bumpers keep getting hit.
+        start = time.perf_counter()
+        for i in range(8):
+            scheduler.play("border", border_tone)
+        scheduler.play("panel", panel_tone)
+        if frame % 4 == 0:
+            scheduler.play("bumper", bumper_tones[(frame // 4) % len(bumper_tones)])
+        elapsed += time.perf_counter() - start
+        calls += 9 + (frame % 4 == 0)
+        time.sleep(1.0 / 60)
+    results["play_us"] = elapsed / calls * 1e6
+    for category, counters in scheduler.counters.items():
+        for name in ("played", "stolen", "dropped", "limited"):
+            results[category + "_" + name] = counters[name]
+    pygame.mixer.quit()
+    return results
+
+def benchmark_darken():
+    results = {}
+    for label, size in (("720p", (1280, 720)), ("1080p", (1920, 1080))):
+        source = make_benchmark_surface(size[0], size[1])
+        repeats = 10
+        start = time.perf_counter()
+        for i in range(repeats):
+            make_pre_darkened_copy(source, 0.1 + 0.08 * i)
+        results[label + "_ms"] = (time.perf_counter() - start) / repeats * 1000
+    return results
+
+def benchmark_frame():
+    results = {}
+    global SCREEN_WIDTH, SCREEN_HEIGHT
+    SCREEN_WIDTH, SCREEN_HEIGHT = 1920, 1080
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    shapes = make_default_collision_shapes()
+    bumper_surf, _ = get_alpha_mask_circle(20, color=(255,100,100))
+    ball_surf, _ = get_alpha_mask_circle(10, color=(120,120,120))
+    flipper_surf = pygame.Surface((60,15), pygame.SRCALPHA)
+    pygame.draw.rect(flipper_surf, (200,200,200), (0,0,60,15), border_radius=5)
+    flipper_atlases = {side: flipper_image_atlas(flipper_surf, side) for side in ("left", "right")}
+    background = make_benchmark_surface(1280, 720)
+    compositor = BackgroundCompositor()
+    font = pygame.font.SysFont(pygame.font.get_default_font(), 30)
+    for count in (10, 100, 400):
+        state = GameState(SCREEN_WIDTH, SCREEN_HEIGHT, shapes, seed=count)
+        positions = place_bumpers(count, shapes.bumper_radius, SCREEN_WIDTH, SCREEN_HEIGHT, seed=count)
+        state.bumpers = [BumperState(pos, shapes.bumper_mask) for pos in positions]
+        state.bumper_grid = build_bumper_grid(state.bumpers, shapes.bumper_reach)
+        bumper_sprites = {body: Bumper(body, bumper_surf) for body in state.bumpers}
+        bumper_group = pygame.sprite.Group(*bumper_sprites.values())
+        holes_group = pygame.sprite.Group(*[Hole(body, None) for body in state.holes])
+        flipper_group = pygame.sprite.Group(*[Flipper(body, flipper_atlases[body.side]) for body in state.flippers])
+        ball_sprite = Ball(state.ball, ball_surf)
+        ball_group = pygame.sprite.GroupSingle(ball_sprite)
+        rng = random.Random(count)
+        frames = 0
+        start = time.perf_counter()
+        while frames < 300 and state.phase == "playing":
+            inputs = []
+            if not state.ball.fired:
+                inputs.append(("fire", rng.uniform(0.2, math.pi - 0.2)))
+            if frames % 30 == 0:
+                inputs.append(("flip", rng.choice(("left", "right"))))
+            for name, obj in step(state, inputs, PHYSICS_DT):
+                if name == "bumper":
+                    bumper_sprites.pop(obj).kill()
+                elif name == "new_ball":
+                    ball_sprite.set_body(obj)
+            flipper_group.update()
+            holes_group.update()
+            ball_group.update(0.0)
+            screen.blit(compositor.get(background, BRIGHTNESS), (0,0))
+            bumper_group.draw(screen)
+            holes_group.draw(screen)
+            flipper_group.draw(screen)
+            ball_group.draw(screen)
+            state.wind.draw(screen)
+            screen.blit(TEXT_CACHE.render_number(font, "Level: ", state.level, (255,255,255)), (10,10))
+            screen.blit(TEXT_CACHE.render_number(font, "Shots left: ", state.shots_left, (255,255,255)), (10,40))
+            screen.blit(TEXT_CACHE.render_number(font, "Score: ", state.total_score+state.level_score, (255,255,255)), (10,70))
+            pygame.display.flip()
+            frames += 1
+        results["frame_ms_" + str(count)] = (time.perf_counter() - start) / frames * 1000
+    return results
+
+class SurfaceAudit(pygame.Surface):
+    def __init__(self, size):
+        super().__init__(size)
+        self.sources = []
+    def blit(self, source, dest, area=None, special_flags=0):
+        self.sources.append(source)
+        return super().blit(source, dest, area, special_flags)
+    def blits(self, blit_sequence, doreturn=1):
+        blit_sequence = list(blit_sequence)
+        self.sources.extend(item[0] for item in blit_sequence)
+        return super().blits(blit_sequence, doreturn)
+
+def audit_steady_frame_surfaces(font, layers, rects, corner_surf, hole_positions, frames, warmup=30):
+    global SHOW_OPTIONS
+    screen = SurfaceAudit((SCREEN_WIDTH, SCREEN_HEIGHT))
+    shapes = make_default_collision_shapes()
+    bumper_surf, _ = get_alpha_mask_circle(20, color=(255,100,100))
+    ball_surf, _ = get_alpha_mask_circle(10, color=(120,120,120))
+    state = GameState(SCREEN_WIDTH, SCREEN_HEIGHT, shapes, seed=1)
+    state.orgon_button_state = "VISIBLE"
+    state.repulsine_button_state = "VISIBLE"
+    sprite_groups = (pygame.sprite.Group(*[Bumper(body, bumper_surf) for body in state.bumpers]),
+                     pygame.sprite.Group(*[Hole(body, None) for body in state.holes]),
+                     pygame.sprite.Group(*[Flipper(body, flipper_image_atlas(load_flipper_image(body.side), body.side)) for body in state.flippers]))
+    ball_group = pygame.sprite.GroupSingle(Ball(state.ball, ball_surf))
+    background = BackgroundCompositor().get(make_benchmark_surface(SCREEN_WIDTH, SCREEN_HEIGHT), BRIGHTNESS)
+    fonts = (font, pygame.font.SysFont(FONT_NAME, 60))
+    sliders = (pygame.Rect(SCREEN_WIDTH//2 - 150, SCREEN_HEIGHT//2 - 30, 300, 20), pygame.Rect(SCREEN_WIDTH//2 - 150, SCREEN_HEIGHT//2 + 30, 300, 20))
+    aim_preview = AimPreview()
+    aim_preview.update(state, math.pi / 3)
+    overlay = FRAME_TIMER.render_overlay(font)
+    show_options = SHOW_OPTIONS
+    SHOW_OPTIONS = True
+    def draw_frame():
+        draw_scene(screen, state, layers, background, sprite_groups, ball_group, fonts, sliders,
+                   corner_surf, hole_positions, aim_preview, overlay)
+    def draw_frames(count, seen):
+        new_surfaces = 0
+        for i in range(count):
+            draw_frame()
+            new_surfaces += sum(1 for surf in screen.sources if id(surf) not in seen)
+            del screen.sources[:]
+        return new_surfaces
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        for i in range(warmup):
+            draw_frame()
+        # Holding the warm-up surfaces keeps their ids from being reused by a new Surface.
+        held = list(screen.sources)
+        seen = set(id(surf) for surf in held)
+        del screen.sources[:]
+        retained = tracemalloc.get_traced_memory()[0]
+        # Read twice so the baseline already counts the int object holding a reading.
+        retained = tracemalloc.get_traced_memory()[0]
+        new_surfaces = draw_frames(frames, seen)
+        retained = tracemalloc.get_traced_memory()[0] - retained
+    finally:
+        if started:
+            tracemalloc.stop()
+        SHOW_OPTIONS = show_options
+    del held
+    return {"steady_new_surfaces": new_surfaces, "steady_retained_bytes": retained}
+
+def benchmark_ui_layers():
+    results = {}
+    global SCREEN_WIDTH, SCREEN_HEIGHT
+    SCREEN_WIDTH, SCREEN_HEIGHT = 1920, 1080
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    font = pygame.font.SysFont(pygame.font.get_default_font(), 30)
+    rects = {"options": pygame.Rect(10, SCREEN_HEIGHT - 60, 140, 50),
+             "orgon": pygame.Rect(SCREEN_WIDTH - 150, SCREEN_HEIGHT - 60, 140, 50),
+             "repulsine": pygame.Rect(SCREEN_WIDTH - 150, SCREEN_HEIGHT - 120, 140, 50)}
+    corner_surf, _ = get_alpha_mask_circle(12, color=(200,200,200))
+    hole_positions = [((i+1) * SCREEN_WIDTH // (HOLES_COUNT+1), SCREEN_HEIGHT - 80) for i in range(HOLES_COUNT)]
+    frames = 300
+    start = time.perf_counter()
+    for i in range(frames):
+        sorted_positions = sorted(hole_positions, key=lambda p: p[0])
+        for j in range(len(sorted_positions)-1):
+            screen.blit(corner_surf, corner_surf.get_rect(midtop=((sorted_positions[j][0]+sorted_positions[j+1][0])//2, SCREEN_HEIGHT - 80)))
+        for name, (color, lines, top) in UILayers.buttons.items():
+            pygame.draw.rect(screen, color, rects[name], border_radius=8)
+            y = rects[name].y + (top if top is not None else 10)
+            for line in lines:
+                text = TEXT_CACHE.render(font, line, (0,0,0))
+                screen.blit(text, (rects[name].centerx - text.get_width()/2, y))
+                y += text.get_height()
+        menu_bg = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
+        menu_bg.fill((50,50,50,200))
+        screen.blit(menu_bg, (0,0))
+    results["direct_per_frame_ms"] = (time.perf_counter() - start) / frames * 1000
+    layers = UILayers(font)
+    layers.layout((SCREEN_WIDTH, SCREEN_HEIGHT), rects)
+    def draw_layers():
+        screen.blits(layers.corners(corner_surf, hole_positions), doreturn=False)
+        for name in UILayers.buttons:
+            screen.blit(*layers.face(name))
+        screen.blit(layers.backdrop, (0,0))
+    start = time.perf_counter()
+    for i in range(frames):
+        draw_layers()
+    results["layered_per_frame_ms"] = (time.perf_counter() - start) / frames * 1000
+    results["speedup"] = results["direct_per_frame_ms"] / results["layered_per_frame_ms"]
+    allocations = audit_steady_frame_surfaces(font, layers, rects, corner_surf, hole_positions, frames)
+    results.update(allocations)
+    ok = allocations["steady_new_surfaces"] == 0 and allocations["steady_retained_bytes"] <= 0
+    results["allocation_audit_failures"] = 0 if ok else 1
+    return results
+
+def benchmark_aim_preview():
+    results = {}
+    budget_failures = 0
+    shapes = make_default_collision_shapes()
+    rng = random.Random(21)
+    for count in (10, 100):
+        state = GameState(1920, 1080, shapes, seed=count)
+        positions = place_bumpers(count, shapes.bumper_radius, 1920, 1080, seed=count)
+        state.bumpers = [BumperState(pos, shapes.bumper_mask) for pos in positions]
+        state.bumper_grid = build_bumper_grid(state.bumpers, shapes.bumper_reach)
+        angles = [rng.uniform(0.2, math.pi - 0.2) for i in range(200)]
+        steps = 0
+        start = time.perf_counter()
+        for angle in angles:
+            steps += len(predict_path(state, angle, AIM_PREVIEW_STEPS, AIM_PREVIEW_STEPS)[0]) - 1
+        elapsed = time.perf_counter() - start
+        results["predict_300_steps_ms_" + str(count)] = elapsed / steps * 300 * 1000
+        # While aiming every mouse move is a new angle, so each frame pays for a fresh prefix.
+        preview = AimPreview()
+        costs = []
+        for angle in angles:
+            preview.update(state, angle)
+            costs.append(preview.compute_ms)
+        costs.sort()
+        results["aim_change_frame_p95_ms_" + str(count)] = costs[int(0.95 * len(costs))]
+        budget_failures += costs[int(0.95 * len(costs))] > AIM_PREVIEW_BUDGET_MS
+    preview = AimPreview()
+    frames = 1000
+    start = time.perf_counter()
+    for i in range(frames):
+        preview.update(state, angles[i // 100])
+    results["cached_update_us"] = (time.perf_counter() - start) / frames * 1e6
+    results["recomputes_per_1000_frames"] = preview.computes
+    results["budget_failures"] = budget_failures
+    return results
+
+def benchmark_startup():
+    results = {}
+    replay_path = os.path.join(os.getcwd(), "bench_startup_replay.bin")
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy")
+    script = os.path.abspath(__file__)
+    try:
+        with open(replay_path, "wb") as f:
+            f.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, 1, 1920, 1080, MAX_SHOTS, 0))
+            f.write(REPLAY_RECORD.pack(0, REPLAY_END, 0.0))
+        for label, command in (("import_ms", [sys.executable, "-c", "import sys; sys.path.insert(0, sys.argv[1]); import pygame_mizzz_pongle", os.path.dirname(script)]),
+                               ("cold_start_ms", [sys.executable, script, "-replay", replay_path, "-headless", "-unthrottled"]),
+                               ("windowed_start_ms", [sys.executable, script, "-replay", replay_path, "-unthrottled"]),
+                               ("windowed_serial_start_ms", [sys.executable, script, "-replay", replay_path, "-unthrottled", "-serialstartup"])):
+            timings = []
+            for i in range(3):
+                start = time.perf_counter()
+                subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+                timings.append(time.perf_counter() - start)
+            results[label] = min(timings) * 1000
+    finally:
+        if os.path.exists(replay_path):
+            os.remove(replay_path)
+    return results
+
+BENCHMARKS = {
+    "hue": benchmark_hue_shift,
+    "background": benchmark_background_blit,
+    "renderscale": benchmark_render_scale,
+    "colorcycle": benchmark_color_cycle,
+    "physics": benchmark_physics,
+    "collision": benchmark_bumper_collision,
+    "narrowphase": benchmark_narrow_phase,
+    "placement": benchmark_bumper_placement,
+    "flipper": benchmark_flipper_rotation,
+    "text": benchmark_text_cache,
+    "sound": benchmark_sound_bank,
+    "audio": benchmark_audio,
+    "darken": benchmark_darken,
+    "frame": benchmark_frame,
+    "ui": benchmark_ui_layers,
+    "aim": benchmark_aim_preview,
+    "startup": benchmark_startup,
+}
+
+def benchmark_direction(key):
+    parts = key.split(".")[-1].split("_")
+    if "ms" in parts or "us" in parts:
+        return -1
+    if key.endswith("per_s") or parts[-1] == "speedup":
+        return 1
+    return 0
+
+def save_benchmark_baseline(path, collected):
+    baseline = {"python": sys.version.split()[0], "pygame": pygame.version.ver, "platform": sys.platform,
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"), "results": collected}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    print("Benchmark baseline written to " + path)
+
+def compare_benchmark_baseline(path, collected, threshold):
+    if not os.path.exists(path):
+        # Timings only compare on the machine that recorded them, so no baseline ships with the game.
+        print("No benchmark baseline at " + path + ". Record one on this machine first with:")
+        print("  python " + os.path.basename(sys.argv[0]) + " -bench all -benchsave " + path)
+        return False
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        baseline = stored["results"]
+    except (OSError, ValueError, KeyError) as e:
+        print("Could not read benchmark baseline " + path + ": " + str(e))
+        return False
+    current = {"python": sys.version.split()[0], "pygame": pygame.version.ver, "platform": sys.platform}
+    for name in sorted(current):
+        if stored.get(name) != current[name]:
+            print("Warning: baseline " + path + " was recorded with " + name + " " + str(stored.get(name)) + ", this run uses " + current[name])
+    regressions = 0
+    for key in sorted(collected.keys()):
+        direction = benchmark_direction(key)
+        if direction == 0 or key not in baseline or not baseline[key]:
+            continue
+        change = (collected[key] - baseline[key]) / abs(baseline[key]) * 100
+        status = "ok"
+        if change * -direction > threshold:
+            status = "REGRESSION"
+            regressions += 1
+        print(key + ": " + str(round(baseline[key], 3)) + " -> " + str(round(collected[key], 3)) + " (" + ("%+.1f" % change) + "%) " + status)
+    print(str(regressions) + " regression(s) beyond " + str(threshold) + "% against " + path)
+    return regressions == 0
+
+
+def run_benchmarks(selection):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    pygame.init()
+    if selection == "all":
+        names = list(BENCHMARKS.keys())
+    else:
+        names = selection.split(",")
+    collected = {}
+    for name in names:
+        if name not in BENCHMARKS:
+            print("Unknown benchmark: " + name + " (available: " + ", ".join(BENCHMARKS.keys()) + ")")
+            continue
+        results = BENCHMARKS[name]()
+        for key in sorted(results.keys()):
+            print(name + "." + key + " = " + str(round(results[key], 3)))
+            collected[name + "." + key] = results[key]
+    pygame.quit()
+    failed = [key for key in collected if key.endswith("_failures") and collected[key]]
+    for key in failed:
+        print("FAILED: " + key)
+    if BENCH_SAVE_FILE:
+        save_benchmark_baseline(BENCH_SAVE_FILE, collected)
+    if BENCH_COMPARE_FILE and not compare_benchmark_baseline(BENCH_COMPARE_FILE, collected, BENCH_THRESHOLD):
+        sys.exit(1)
+    if failed:
+        sys.exit(1)
+
 if __name__=="__main__":
-    main()
+    if BENCH_MODE:
+        run_benchmarks(BENCH_MODE)
+    elif BUILD_BUNDLE_MODE:
+        run_bundle_builder()
+    elif SCORES_MODE:
+        print_score_store()
+    elif CALIBRATE_FILE:
+        run_level_calibration(CALIBRATE_FILE)
+    elif REPLAY_FILE and HEADLESS_MODE:
+        run_headless_replay(REPLAY_FILE)
+    else:
+        main()